@@ -0,0 +1,168 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import ObjectId
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
+
+from metrics import DB_PENDING
+from mongo_handler import MongoDBHandler
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMongoDBHandler:
+    """
+    Asyncio front end for MongoDBHandler.
+    Every call runs on a small thread pool so the discord.py event loop never waits on pymongo.
+    Transcriptions go through a write-behind buffer that inserts them into the `transcriptions`
+    collection with one bulk write, flushed on size or time.
+    """
+
+    def __init__(self, db_handler: MongoDBHandler, executor=None, flush_size=20, flush_interval=2.0, timeout=None):
+        self.db_handler = db_handler
+        self.executor = executor or ThreadPoolExecutor(max_workers=4, thread_name_prefix="mongo")
+        self.timeout = timeout  # seconds an awaited call may take, None waits forever
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        self._pending = []  # transcription entries waiting to be inserted
+        self._writing = []  # entries of the bulk write in progress
+        self._last_seq = 0
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # Keeps flushes in order
+        self._flush_listeners = []
+        DB_PENDING.set_function(self.pending_count)
+        self._stop = threading.Event()
+        self._flush_thread = threading.Thread(target=self._flush_loop, name="mongo-write-behind", daemon=True)
+        self._flush_thread.start()
+
+    @classmethod
+    def from_settings(cls, db_handler, settings, executor=None):
+        return cls(
+            db_handler,
+            executor=executor,
+            flush_size=settings.get("dbFlushSize", 20),
+            flush_interval=settings.get("dbFlushInterval", 2.0),
+            timeout=settings.get("dbTimeout", 30),
+        )
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+        return await asyncio.wait_for(future, self.timeout)
+
+    async def create_entry(self, collection_name, data):
+        return await self._run(self.db_handler.create_entry, collection_name, data)
+
+    async def read_entry(self, collection_name, query, projection=None):
+        return await self._run(self.db_handler.read_entry, collection_name, query, projection)
+
+    async def find_entries(self, collection_name, query, projection=None, sort=None, limit=None):
+        """Returns the matching entries as a list, the cursor is drained on the executor."""
+        def read():
+            return list(self.db_handler.find_entries(collection_name, query, projection, sort, limit))
+        return await self._run(read)
+
+    async def update_entry(self, collection_name, query, update_data):
+        return await self._run(self.db_handler.update_entry, collection_name, query, update_data)
+
+    async def delete_entry(self, collection_name, query):
+        return await self._run(self.db_handler.delete_entry, collection_name, query)
+
+    async def read_all_entries(self, collection_name):
+        return await self._run(self.db_handler.read_all_entries, collection_name)
+
+    def add_flush_listener(self, listener):
+        """Registers a callback that receives the transcription entries after they were written."""
+        self._flush_listeners.append(listener)
+
+    def queue_transcription(self, meeting_id, entry):
+        """
+        Buffers a transcription for its meeting. Thread-safe and never waits on the database.
+        Every entry gets a `seq` that increases in the order entries are queued (and across restarts,
+        it is based on the clock), which is what readers of new transcriptions page by (see written_seq).
+        """
+        entry["meeting_id"] = meeting_id
+        with self._pending_lock:
+            # A client-side id makes retrying a partially applied flush harmless
+            entry.setdefault("_id", ObjectId())
+            self._last_seq = max(self._last_seq + 1, time.time_ns())
+            entry["seq"] = self._last_seq
+            self._pending.append(entry)
+            full = len(self._pending) >= self.flush_size
+        if full:
+            self.executor.submit(self.flush_transcriptions)
+
+    def pending_count(self):
+        """Returns the number of transcriptions waiting for the next flush."""
+        with self._pending_lock:
+            return len(self._pending)
+
+    def written_seq(self):
+        """
+        Returns a seq below which every queued transcription is in the database. Entries are written out of
+        order (an unordered bulk write, failed ones are retried with a later flush), so a reader that
+        continues after the newest seq it has seen must not read past this.
+        """
+        with self._pending_lock:
+            unwritten = [entry["seq"] for entry in self._writing] + [entry["seq"] for entry in self._pending]
+            return min(unwritten, default=self._last_seq + 1)
+
+    def flush_transcriptions(self):
+        """Writes all buffered transcriptions in one bulk write. Blocking, runs on a worker thread."""
+        with self._flush_lock:
+            with self._pending_lock:
+                pending = self._pending
+                self._pending = []
+                self._writing = pending
+            if not pending:
+                return 0
+
+            failed = []
+            try:
+                self.db_handler.bulk_write("transcriptions", [InsertOne(entry) for entry in pending])
+            except BulkWriteError as e:
+                # Entries that already exist (duplicate key) were written by an earlier attempt
+                failed = [
+                    pending[error["index"]] for error in e.details.get("writeErrors", [])
+                    if error.get("code") != 11000
+                ]
+            except Exception:
+                logger.exception("Error flushing %d buffered transcription(s)", len(pending))
+                failed = pending
+
+            if failed:
+                logger.warning("Retrying %d transcription write(s) with the next flush", len(failed))
+            with self._pending_lock:
+                # Put failed entries back in front so they keep their order
+                self._pending = failed + self._pending
+                self._writing = []
+
+            failed_ids = {id(entry) for entry in failed}
+            written = [entry for entry in pending if id(entry) not in failed_ids]
+            for listener in self._flush_listeners if written else []:
+                try:
+                    listener(written)
+                except Exception:
+                    logger.exception("Error in transcription flush listener")
+            return len(written)
+
+    async def flush(self):
+        """Flushes the write-behind buffer, e.g. before a meeting is summarized."""
+        return await self._run(self.flush_transcriptions)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush_transcriptions()
+
+    def close(self):
+        """Stops the flush thread, writes what is left and shuts down the executor."""
+        self._stop.set()
+        self._flush_thread.join()
+        self.flush_transcriptions()
+        self.executor.shutdown(wait=True)
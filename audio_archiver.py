@@ -0,0 +1,268 @@
+import logging
+import os
+import queue
+import re
+import subprocess
+import threading
+import time
+
+from audio_buffer import INPUT_CHANNELS, INPUT_SAMPLE_RATE, SAMPLE_WIDTH
+from ogg_opus import OPUS_SAMPLE_RATE, OggOpusWriter, opus_packet_samples
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    "opus": ("opus", ["-c:a", "libopus", "-application", "voip"]),
+    "flac": ("flac", ["-c:a", "flac"]),
+    # Discord's own Opus packets in an Ogg container, nothing is decoded or encoded
+    "opus-passthrough": ("opus", None),
+}
+
+BYTES_PER_SECOND = INPUT_SAMPLE_RATE * INPUT_CHANNELS * SAMPLE_WIDTH
+
+
+class ArchivedAudio:
+    """Where an utterance ended up: the speaker's stream file and the utterance's position in it."""
+
+    def __init__(self, path, offset, duration):
+        self.path = path
+        self.offset = offset  # seconds from the start of the file
+        self.duration = duration  # seconds
+
+
+class _FfmpegStream:
+    """One long-running ffmpeg process that encodes a speaker's PCM into a single growing file."""
+
+    def __init__(self, path, audio_format, bitrate):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.disk_bytes = 0  # part of the file already counted in the archive's disk usage
+        codec = FORMATS[audio_format][1]
+        command = [
+            "ffmpeg", "-nostdin", "-v", "error", "-y",
+            "-f", "s16le", "-ar", str(INPUT_SAMPLE_RATE), "-ac", str(INPUT_CHANNELS), "-i", "-",
+            # Discord voice is mono in practice, keep one channel
+            "-ac", "1", *codec,
+        ]
+        if bitrate and audio_format == "opus":
+            command += ["-b:a", bitrate]
+        command.append(path)
+        self.process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+
+    def write(self, pcm):
+        self.process.stdin.write(pcm)
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        error = self.process.stderr.read().decode(errors="replace").strip()
+        if self.process.wait() != 0:
+            logger.error("Archiving %s failed: %s", self.path, error)
+
+
+class _OggOpusStream:
+    """Appends a speaker's Opus packets to an Ogg Opus file as they arrive."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.disk_bytes = 0
+        self.file = open(path, "wb")
+        self.writer = OggOpusWriter(self.file)
+
+    def write(self, packet):
+        self.writer.write_packet(*packet)
+
+    def close(self):
+        self.writer.close()
+        self.file.close()
+
+
+class AudioArchiver:
+    """
+    Writes recorded audio to disk in the background, one compressed file per meeting and speaker.
+    Recorders hand over raw PCM with archive(); it is queued and the utterance's place in the
+    speaker's file is returned right away, so the transcription can reference it before the audio
+    is written. The queue is bounded: when it is full, or the archive outgrows `max_bytes`,
+    audio is dropped rather than making the recorder wait.
+    In 'opus-passthrough' format recorders hand over every received Opus packet with
+    archive_packet() instead, and the packets are stored as they came from Discord.
+    """
+
+    def __init__(self, audio_path, audio_format="opus", bitrate="32k", max_queue_seconds=600, max_bytes=None):
+        if audio_format not in FORMATS:
+            raise ValueError(f"Unknown audio format: {audio_format}")
+        self.audio_path = audio_path
+        self.audio_format = audio_format
+        self.bitrate = bitrate
+        self.passthrough = FORMATS[audio_format][1] is None
+        self.max_queue_seconds = max_queue_seconds
+        self.max_bytes = max_bytes
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._offsets = {}  # (meeting id, user id) -> (path, seconds queued for the file so far)
+        self._streams = {}  # (meeting id, user id) -> _FfmpegStream, only used by the archiver thread
+        self._thread = None
+
+        self.queued_seconds = 0.0
+        self.archived_seconds = 0.0
+        self.dropped = 0
+        self._dropping = False
+        self.disk_bytes = 0  # measured by the archiver thread when it starts, the walk can take a while
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            settings.get("audioPath"),
+            audio_format=settings.get("audioFormat", "opus"),
+            bitrate=settings.get("audioBitrate", "32k"),
+            max_queue_seconds=settings.get("audioArchiveQueueSeconds", 600),
+            max_bytes=settings.get("audioArchiveMaxBytes"),
+        )
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="audio-archiver", daemon=True)
+            self._thread.start()
+
+    def archive(self, meeting_id, user, pcm):
+        """
+        Queues 48 kHz stereo PCM of one utterance. Returns its ArchivedAudio, or None if the audio
+        was dropped. Never blocks on disk or ffmpeg.
+        """
+        duration = len(pcm) / BYTES_PER_SECOND
+        position = self._reserve(meeting_id, user, duration)
+        if position is None:
+            return None
+        path, offset = position
+        self._queue.put(("write", (meeting_id, user.id), path, (pcm, duration)))
+        return ArchivedAudio(path, offset, duration)
+
+    def archive_packet(self, meeting_id, user, packet):
+        """
+        Queues one Opus packet (passthrough format only). Returns the file path and the packet's
+        offset in seconds, or None if it was dropped. Never blocks on disk.
+        """
+        samples = opus_packet_samples(packet)
+        duration = samples / OPUS_SAMPLE_RATE
+        position = self._reserve(meeting_id, user, duration, report=False)
+        if position is not None:
+            self._queue.put(("write", (meeting_id, user.id), position[0], ((packet, samples), duration)))
+        return position
+
+    def _reserve(self, meeting_id, user, duration, report=True):
+        """Claims the next `duration` seconds of the speaker's file, unless the archive is full."""
+        key = (meeting_id, user.id)
+        with self._lock:
+            full = self.queued_seconds + duration > self.max_queue_seconds
+            if full or (self.max_bytes is not None and self.disk_bytes >= self.max_bytes):
+                self.dropped += 1
+                # Packets come 50 times a second, only report the first one of a run of drops
+                if report or not self._dropping:
+                    reason = "queue is full" if full else f"is over its limit of {self.max_bytes} bytes"
+                    logger.warning("Audio archive %s, not archiving %.1fs of %s", reason, duration, user.name)
+                self._dropping = True
+                return None
+            self._dropping = False
+
+            path, offset = self._offsets.get(key, (None, 0.0))
+            if path is None:
+                path = self._stream_path(meeting_id, user)
+            self._offsets[key] = (path, offset + duration)
+            self.queued_seconds += duration
+        return path, offset
+
+    def close_meeting(self, meeting_id):
+        """Finishes the files of a meeting once everything queued for it is written."""
+        with self._lock:
+            for key in [key for key in self._offsets if key[0] == meeting_id]:
+                del self._offsets[key]
+        self._queue.put(("close", meeting_id, None, None))
+
+    def close(self):
+        """Writes what is still queued and finishes all files."""
+        if self._thread is not None:
+            self._queue.put(("stop", None, None, None))
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued_seconds": self.queued_seconds,
+                "archived_seconds": self.archived_seconds,
+                "dropped": self.dropped,
+                "open_files": len(self._offsets),
+                "disk_bytes": self.disk_bytes,
+            }
+
+    def _stream_path(self, meeting_id, user):
+        """A file name that is unique per speaker and recording run, so restarts never overwrite a file."""
+        directory = os.path.join(self.audio_path, re.sub(r"[^\w.-]", "_", str(meeting_id)))
+        extension = FORMATS[self.audio_format][0]
+        name = re.sub(r"[^\w.-]", "_", user.name)
+        return os.path.join(directory, f"{user.id}_{name}_{time.time_ns()}.{extension}")
+
+    def _measure_disk_usage(self):
+        total = 0
+        if self.audio_path and os.path.isdir(self.audio_path):
+            for root, _, files in os.walk(self.audio_path):
+                total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+        return total
+
+    def _run(self):
+        # Runs before the first write, so the files counted are the ones from earlier runs
+        self.disk_bytes = self._measure_disk_usage()
+        while True:
+            action, key, path, payload = self._queue.get()
+            if action == "write":
+                self._write(key, path, *payload)
+            elif action == "close":
+                for stream_key in [k for k in self._streams if k[0] == key]:
+                    self._close_stream(stream_key)
+            elif action == "stop":
+                for stream_key in list(self._streams):
+                    self._close_stream(stream_key)
+                return
+
+    def _write(self, key, path, data, duration):
+        stream = self._streams.get(key)
+        try:
+            if stream is None or stream.path != path:
+                if stream is not None:
+                    self._close_stream(key)
+                stream = self._streams[key] = self._open_stream(path)
+            stream.write(data)
+        except (OSError, ValueError) as e:
+            logger.error("Error archiving audio to %s: %s", path, e)
+        with self._lock:
+            self.queued_seconds -= duration
+            self.archived_seconds += duration
+        if stream is not None:
+            self._count_disk_usage(stream)
+
+    def _open_stream(self, path):
+        if self.passthrough:
+            return _OggOpusStream(path)
+        return _FfmpegStream(path, self.audio_format, self.bitrate)
+
+    def _close_stream(self, key):
+        stream = self._streams.pop(key)
+        stream.close()
+        self._count_disk_usage(stream)
+        logger.info("Archived %s (%.0f KiB)", stream.path, stream.disk_bytes / 1024)
+
+    def _count_disk_usage(self, stream):
+        """Adds what the file grew by since it was last counted."""
+        try:
+            size = os.path.getsize(stream.path)
+        except OSError:
+            return
+        with self._lock:
+            self.disk_bytes += size - stream.disk_bytes
+        stream.disk_bytes = size
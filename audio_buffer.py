@@ -0,0 +1,115 @@
+import numpy as np
+
+INPUT_SAMPLE_RATE = 48000  # Discord sends 48 kHz
+INPUT_CHANNELS = 2  # stereo
+SAMPLE_WIDTH = 2  # 16 bit PCM
+FRAME_BYTES = INPUT_CHANNELS * SAMPLE_WIDTH
+OUTPUT_SAMPLE_RATE = 16000  # Whisper expects 16 kHz mono
+DECIMATION = INPUT_SAMPLE_RATE // OUTPUT_SAMPLE_RATE
+
+
+def pcm_to_whisper(frames, out=None):
+    """
+    Converts a view of 48 kHz stereo int16 frames into 16 kHz mono float32 in one pass.
+    Both channels and every group of three consecutive frames are averaged, which
+    downmixes, low-pass filters and decimates at once. Only the output array is allocated.
+    """
+    usable = len(frames) - len(frames) % DECIMATION
+    grouped = frames[:usable].reshape(-1, DECIMATION * INPUT_CHANNELS)
+    if out is None:
+        out = np.empty(len(grouped), dtype=np.float32)
+    np.add.reduce(grouped, axis=1, dtype=np.float32, out=out)
+    out *= 1.0 / (32768.0 * DECIMATION * INPUT_CHANNELS)
+    return out
+
+
+class PcmRingBuffer:
+    """
+    Preallocated ring buffer of 48 kHz stereo int16 frames for one speaker.
+    Packets are copied straight into the backing array, reads convert views of it
+    without any intermediate bytes objects.
+    """
+
+    def __init__(self, max_seconds=30):
+        capacity = int(max_seconds * INPUT_SAMPLE_RATE)
+        # Keep the capacity a multiple of the decimation factor so wrapped reads stay aligned
+        capacity += -capacity % DECIMATION
+        self._frames = np.empty((capacity, INPUT_CHANNELS), dtype=np.int16)
+        self._start = 0
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def capacity(self):
+        return len(self._frames)
+
+    @property
+    def duration(self):
+        """Buffered audio in seconds."""
+        return self._length / INPUT_SAMPLE_RATE
+
+    @property
+    def nbytes(self):
+        """Bytes of audio currently buffered."""
+        return self._length * FRAME_BYTES
+
+    def free_frames(self):
+        return self.capacity - self._length
+
+    def write(self, pcm):
+        """Appends raw 48 kHz stereo PCM bytes to the buffer."""
+        incoming = np.frombuffer(pcm, dtype=np.int16).reshape(-1, INPUT_CHANNELS)
+        count = len(incoming)
+        if count > self.free_frames():
+            raise BufferError(
+                f"PCM buffer full ({self._length}/{self.capacity} frames), cannot add {count}"
+            )
+
+        end = (self._start + self._length) % self.capacity
+        first = min(count, self.capacity - end)
+        self._frames[end:end + first] = incoming[:first]
+        if first < count:
+            self._frames[:count - first] = incoming[first:]
+        self._length += count
+        return count
+
+    def _segments(self, frames):
+        """Returns up to two views covering the first `frames` buffered frames."""
+        first = min(frames, self.capacity - self._start)
+        segments = [self._frames[self._start:self._start + first]]
+        if first < frames:
+            segments.append(self._frames[:frames - first])
+        return segments
+
+    def to_whisper(self, frames=None):
+        """Returns the first `frames` buffered frames (default: all) as 16 kHz mono float32."""
+        frames = self._length if frames is None else min(frames, self._length)
+        out = np.empty(frames // DECIMATION, dtype=np.float32)
+        offset = 0
+        for segment in self._segments(frames):
+            # The start index and capacity are multiples of DECIMATION, so only
+            # the last segment can end on a partial group.
+            size = len(segment) // DECIMATION
+            pcm_to_whisper(segment, out[offset:offset + size])
+            offset += size
+        return out
+
+    def raw_bytes(self, frames=None):
+        """Returns a copy of the first `frames` buffered frames as raw PCM bytes."""
+        frames = self._length if frames is None else min(frames, self._length)
+        return b"".join(segment.tobytes() for segment in self._segments(frames))
+
+    def consume(self, frames):
+        """Drops the first `frames` frames, rounded down to keep reads aligned."""
+        frames = min(frames, self._length)
+        frames -= frames % DECIMATION
+        self._start = (self._start + frames) % self.capacity
+        self._length -= frames
+        if self._length == 0:
+            self._start = 0
+
+    def clear(self):
+        self._start = 0
+        self._length = 0
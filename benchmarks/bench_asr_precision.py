@@ -0,0 +1,95 @@
+"""
+Compares Whisper in full precision with the reduced-precision modes of the `quantization` setting.
+Reports load time, real-time factor (processing seconds per second of audio, lower is better)
+and word error rate on the LibriSpeech sample set used by the Hugging Face test suite.
+
+Run from the repository root: python -m benchmarks.bench_asr_precision --model-id openai/whisper-small
+"""
+import argparse
+import re
+import time
+
+from datasets import load_dataset
+
+from setup_model import setup_whisper_model
+
+REFERENCE_DATASET = "hf-internal-testing/librispeech_asr_dummy"
+
+
+def normalize(text):
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+
+def word_errors(reference, hypothesis):
+    """Word-level edit distance between two normalized transcripts."""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word),
+            ))
+        previous = current
+    return previous[-1]
+
+
+def load_samples(count):
+    dataset = load_dataset(REFERENCE_DATASET, "clean", split="validation")
+    samples = []
+    for row in dataset.select(range(min(count, len(dataset)))):
+        audio = row["audio"]
+        # The set is recorded at 16 kHz, the rate the bot hands to Whisper
+        assert audio["sampling_rate"] == 16000
+        samples.append((audio["array"].astype("float32"), row["text"]))
+    return samples
+
+
+def run_mode(model_id, device, quantization, samples, batch_size):
+    start = time.perf_counter()
+    model_pipeline = setup_whisper_model(model_id, device, quantization=quantization)
+    load_seconds = time.perf_counter() - start
+
+    # Warm up so one-off allocations are not counted
+    model_pipeline([samples[0][0]], batch_size=1, generate_kwargs={"task": "transcribe"})
+
+    audio_seconds = sum(len(audio) for audio, _ in samples) / 16000
+    start = time.perf_counter()
+    results = model_pipeline(
+        [audio for audio, _ in samples],
+        batch_size=batch_size,
+        generate_kwargs={"task": "transcribe"},
+        return_timestamps=False,
+    )
+    elapsed = time.perf_counter() - start
+
+    errors = 0
+    words = 0
+    for (_, reference), result in zip(samples, results):
+        reference_words = normalize(reference)
+        errors += word_errors(reference_words, normalize(result["text"]))
+        words += len(reference_words)
+    return load_seconds, elapsed / audio_seconds, errors / max(words, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model-id", default="openai/whisper-small")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--modes", nargs="+", default=["none", "int8", "bf16"])
+    parser.add_argument("--samples", type=int, default=20, help="how many reference utterances to transcribe")
+    parser.add_argument("--batch-size", type=int, default=4)
+    args = parser.parse_args()
+
+    samples = load_samples(args.samples)
+    audio_seconds = sum(len(audio) for audio, _ in samples) / 16000
+    print(f"{len(samples)} utterances, {audio_seconds:.1f}s of audio from {REFERENCE_DATASET}")
+    print(f"{'mode':>6} | {'load s':>7} {'RTF':>6} {'WER':>7}")
+    for mode in args.modes:
+        load_seconds, rtf, wer = run_mode(args.model_id, args.device, mode, samples, args.batch_size)
+        print(f"{mode:>6} | {load_seconds:>7.1f} {rtf:>6.3f} {wer * 100:>6.2f}%")
+
+
+if __name__ == "__main__":
+    main()
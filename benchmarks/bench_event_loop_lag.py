@@ -0,0 +1,56 @@
+"""
+Measures event-loop stall time while a meeting is summarized, once with the summarizer called
+inline on the loop (the old behaviour) and once through the ProcessingPipeline.
+The summarizer is a stub that blocks like a slow model would.
+
+Run from the repository root: python -m benchmarks.bench_event_loop_lag
+"""
+import argparse
+import asyncio
+import time
+
+from processing_pipeline import EventLoopLagProbe, ProcessingPipeline
+
+
+def blocking_summarizer(seconds):
+    # Stands in for torch inference or a synchronous HTTP request
+    time.sleep(seconds)
+    return "summary"
+
+
+async def measure(name, summarize, rounds, idle):
+    probe = EventLoopLagProbe(interval=0.01, warn_after=float("inf"))
+    probe.start()
+    await asyncio.sleep(idle)
+    for _ in range(rounds):
+        await summarize()
+        await asyncio.sleep(idle)
+    await probe.stop()
+    stats = probe.stats()
+    print(
+        f"{name:>9}: max stall {stats['max_lag'] * 1000:8.1f} ms, "
+        f"mean {stats['mean_lag'] * 1000:6.2f} ms over {stats['samples']} samples"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--summary-seconds", type=float, default=1.0, help="how long the stub summarizer blocks")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    pipeline = ProcessingPipeline({})
+
+    async def inline():
+        blocking_summarizer(args.summary_seconds)
+
+    async def offloaded():
+        await pipeline.run("summarization", blocking_summarizer, args.summary_seconds)
+
+    await measure("inline", inline, args.rounds, idle=0.2)
+    await measure("pipeline", offloaded, args.rounds, idle=0.2)
+    await pipeline.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,166 @@
+"""
+Memory under overload: speakers with stuck microphones send continuous audio for an hour (sped up)
+while a stub transcription model is slower than the incoming audio, so the transcription queue is
+always full. Runs every overload policy and reports the process RSS and the memory held by speaker
+buffers and queued utterances over time. The interesting number is the growth per audio-hour in
+the second half of the run, which should stay near zero for every policy.
+
+'block' keeps memory flat by making the packet thread wait, which shows up as a lower replay speed.
+'saved' counts the utterances transcribed by the end, including the queue drained after the replay.
+
+Run from the repository root: python -m benchmarks.bench_memory_pressure --hours 1
+Needs discord.py (for the recorder's Opus decoder import), no Discord connection.
+"""
+import argparse
+import logging
+import os
+import resource
+import shutil
+import tempfile
+import time
+from types import SimpleNamespace
+
+from benchmarks.bench_pcm_buffer import make_packets
+from memory_budget import BufferBudget
+from transcription_scheduler import OVERLOAD_POLICIES, TranscriptionScheduler
+from voice_recorder import VoiceRecorder
+
+PACKET_SECONDS = 0.02
+
+
+class StubASR:
+    """Answers like the Hugging Face ASR pipeline after sleeping `rtf` times the audio length."""
+
+    def __init__(self, rtf):
+        self.rtf = rtf
+
+    def __call__(self, audio_arrays, batch_size=1, generate_kwargs=None, return_timestamps=False):
+        time.sleep(self.rtf * sum(len(audio) for audio in audio_arrays) / 16000)
+        return [{"text": "stuck microphone"} for _ in audio_arrays]
+
+
+class CountingDB:
+    """Stands in for AsyncMongoDBHandler, only counts the transcriptions."""
+
+    def __init__(self):
+        self.transcriptions = 0
+
+    def queue_transcription(self, meeting_id, entry):
+        self.transcriptions += 1
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak instead of current RSS, in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_policy(policy, args, packets):
+    spill_path = tempfile.mkdtemp(prefix="notebot-spill-")
+    settings = {
+        "useOriginalLanguage": True,
+        "maxUtteranceSeconds": args.utterance_seconds,
+        "audioBufferBudgetMB": args.buffer_budget_mb,
+        "transcriptionWorkers": args.asr_workers,
+        "transcriptionBatchSize": 4,
+        "transcriptionQueueSize": args.queue_size,
+        "transcriptionQueueMaxBytes": int(args.queue_mb * 1024 * 1024),
+        "transcriptionOverloadPolicy": policy,
+        "transcriptionSpillPath": spill_path,
+        "transcriptionSpillMaxBytes": int(args.spill_mb * 1024 * 1024),
+    }
+    scheduler = TranscriptionScheduler(StubASR(args.asr_rtf), settings)
+    scheduler.start()
+    budget = BufferBudget.from_settings(settings)
+    db = CountingDB()
+    recorders = [
+        VoiceRecorder(
+            SimpleNamespace(id=i, name=f"speaker{i}"), "memory-benchmark", scheduler, settings, db, budget=budget
+        )
+        for i in range(args.speakers)
+    ]
+
+    total_ticks = int(args.hours * 3600 / PACKET_SECONDS)
+    sample_every = max(1, total_ticks // args.samples)
+    tick_seconds = PACKET_SECONDS / args.speed
+    samples = []  # (audio hours, rss, buffered bytes, queued bytes)
+    start = time.perf_counter()
+    for tick in range(total_ticks):
+        packet = packets[tick % len(packets)]
+        for recorder in recorders:
+            recorder.add_packet(packet)
+        if tick % sample_every == 0:
+            queue = scheduler.stats()
+            samples.append(
+                (tick * PACKET_SECONDS / 3600, rss_bytes(), budget.stats()["buffered_bytes"], queue["queued_bytes"])
+            )
+        delay = start + (tick + 1) * tick_seconds - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    seconds = time.perf_counter() - start
+
+    stats = scheduler.stats()
+    for recorder in recorders:
+        recorder.release()
+    scheduler.stop()
+    shutil.rmtree(spill_path, ignore_errors=True)
+
+    # Growth per audio-hour over the second half, after the queue and buffers have filled up
+    half = samples[len(samples) // 2:]
+    hours = half[-1][0] - half[0][0]
+    growth = (half[-1][1] - half[0][1]) / hours if hours else 0.0
+    return {
+        "policy": policy,
+        "speed": args.hours * 3600 / seconds,
+        "rss_start": samples[len(samples) // 10][1],
+        "rss_peak": max(sample[1] for sample in samples),
+        "rss_end": samples[-1][1],
+        "growth": growth,
+        "buffers_peak": max(sample[2] for sample in samples),
+        "queue_peak": max(sample[3] for sample in samples),
+        "transcribed": db.transcriptions,
+        "dropped": stats["dropped"],
+        "spilled": stats["spilled"],
+        "forced_flushes": budget.forced_flushes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--policies", nargs="+", choices=OVERLOAD_POLICIES, default=list(OVERLOAD_POLICIES))
+    parser.add_argument("--hours", type=float, default=1.0, help="hours of continuous audio per speaker")
+    parser.add_argument("--speakers", type=int, default=4)
+    parser.add_argument("--speed", type=float, default=100.0, help="replay rate, 1 is real time")
+    parser.add_argument("--samples", type=int, default=200, help="memory samples per run")
+    parser.add_argument("--utterance-seconds", type=float, default=30, help="maxUtteranceSeconds, the per-speaker cap")
+    parser.add_argument("--buffer-budget-mb", type=float, default=8, help="audioBufferBudgetMB for all speakers")
+    parser.add_argument("--queue-size", type=int, default=64)
+    parser.add_argument("--queue-mb", type=float, default=16, help="transcriptionQueueMaxBytes in MiB")
+    parser.add_argument("--spill-mb", type=float, default=256, help="transcriptionSpillMaxBytes in MiB")
+    parser.add_argument("--asr-rtf", type=float, default=0.005, help="stub transcription seconds per audio second")
+    parser.add_argument("--asr-workers", type=int, default=1)
+    args = parser.parse_args()
+    # Every run drops or spills on purpose, keep the warnings out of the table
+    logging.basicConfig(level=logging.ERROR)
+
+    packets = make_packets(10)
+    mib = 2 ** 20
+    print(
+        f"{'policy':>13} | {'speed':>6} | {'RSS MiB':>7} {'peak':>6} {'end':>6} {'MiB/h':>6} | "
+        f"{'buf MiB':>7} {'queue MiB':>9} | {'saved':>6} {'dropped':>7} {'spilled':>7} {'forced':>6}"
+    )
+    for policy in args.policies:
+        r = run_policy(policy, args, packets)
+        print(
+            f"{r['policy']:>13} | {r['speed']:>5.0f}x | {r['rss_start'] / mib:>7.1f} {r['rss_peak'] / mib:>6.1f} "
+            f"{r['rss_end'] / mib:>6.1f} {r['growth'] / mib:>6.1f} | {r['buffers_peak'] / mib:>7.1f} "
+            f"{r['queue_peak'] / mib:>9.1f} | {r['transcribed']:>6} {r['dropped']:>7} {r['spilled']:>7} "
+            f"{r['forced_flushes']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compares memory allocated per second of speech for the old BytesIO + pydub
+conversion path and the preallocated PcmRingBuffer.
+
+Run from the repository root: python -m benchmarks.bench_pcm_buffer
+"""
+import argparse
+import io
+import time
+import tracemalloc
+
+import numpy as np
+from pydub import AudioSegment
+
+from audio_buffer import FRAME_BYTES, INPUT_SAMPLE_RATE, PcmRingBuffer
+
+PACKET_FRAMES = 960  # 20 ms at 48 kHz
+
+
+def make_packets(seconds):
+    """Synthetic speech-like stereo PCM: a modulated tone with some noise, cut into 20 ms packets."""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * INPUT_SAMPLE_RATE)) / INPUT_SAMPLE_RATE
+    signal = 0.3 * np.sin(2 * np.pi * 220 * t) * (0.5 + 0.5 * np.sin(2 * np.pi * 3 * t))
+    signal += 0.02 * rng.standard_normal(len(t))
+    pcm = (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+    stereo = np.repeat(pcm[:, None], 2, axis=1).tobytes()
+    step = PACKET_FRAMES * FRAME_BYTES
+    return [stereo[i:i + step] for i in range(0, len(stereo), step)]
+
+
+def legacy_path(packets):
+    buffer = io.BytesIO()
+    for packet in packets:
+        buffer.write(packet)
+    buffer.seek(0)
+    audio_segment = AudioSegment.from_raw(buffer, sample_width=2, frame_rate=48000, channels=2)
+    audio_segment = audio_segment.set_channels(1).set_frame_rate(16000)
+    samples = np.array(audio_segment.get_array_of_samples())
+    return samples.astype(np.float32) / 32768.0
+
+
+def ring_buffer_path(packets, buffer):
+    for packet in packets:
+        buffer.write(packet)
+    audio_array = buffer.to_whisper()
+    buffer.clear()
+    return audio_array
+
+
+def measure(name, seconds, fn):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:>12}: {peak / seconds / 1024:9.1f} KiB peak allocation per second of speech, "
+        f"{elapsed * 1000 / seconds:6.2f} ms CPU per second of speech ({len(result)} samples out)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=20.0, help="length of the synthetic utterance")
+    args = parser.parse_args()
+
+    packets = make_packets(args.seconds)
+    # The ring buffer is allocated once per speaker, not per utterance
+    buffer = PcmRingBuffer(max_seconds=args.seconds + 1)
+
+    measure("BytesIO+pydub", args.seconds, lambda: legacy_path(packets))
+    measure("ring buffer", args.seconds, lambda: ring_buffer_path(packets, buffer))
+
+
+if __name__ == "__main__":
+    main()
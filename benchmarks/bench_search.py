@@ -0,0 +1,167 @@
+"""
+Search latency over a large transcript history: builds the embedding index from synthetic utterances
+(appended in flush-sized batches, like the bot does) and measures query latency over all meetings and
+restricted to the meetings one user attended, then the time to load the index from disk again.
+
+By default vectors come from a hashing encoder (bag of hashed words), which costs next to nothing, so
+the numbers are the index itself. With --model a real sentence embedding model is used, and the query
+latency includes encoding the question. With --mongo-uri the utterances are also written to a scratch
+database (dropped afterwards) to time the MongoDB text search and the combined search command.
+
+Run from the repository root: python -m benchmarks.bench_search --utterances 100000
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+import zlib
+from datetime import datetime, timedelta
+
+import numpy as np
+from bson import ObjectId
+
+from search_index import EmbeddingIndex, SearchIndex, TransformerEncoder
+
+SYLLABLES = ["ba", "chi", "de", "fu", "ga", "ho", "ki", "lo", "ma", "ne", "pi", "ro", "sa", "ti", "vu", "ze"]
+
+
+class HashingEncoder:
+    """Normalized bag of hashed words, a stand-in for a sentence embedding model."""
+
+    model_id = "hashing"
+
+    def __init__(self, dimensions=384):
+        self.dimensions = dimensions
+
+    def load(self):
+        pass
+
+    def encode(self, texts):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.split():
+                code = zlib.crc32(word.encode())
+                vectors[row, code % self.dimensions] += 1.0 if code & 0x80000000 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+
+def make_corpus(utterances, per_meeting, seed=0):
+    """Utterances with Zipf-distributed words, spread over meetings of `per_meeting` utterances."""
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(5000)]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    start = datetime(2024, 1, 1)
+    entries = []
+    for index in range(utterances):
+        meeting = index // per_meeting
+        words = rng.choices(vocabulary, weights, k=rng.randint(3, 30))
+        entries.append({
+            "_id": ObjectId(),
+            "meeting_id": f"meeting_bench_{meeting}",
+            "user": f"speaker{index % 5}",
+            "user_id": index % 5,
+            "timestamp": start + timedelta(days=meeting, seconds=index % per_meeting * 10),
+            "transcription": " ".join(words),
+        })
+    return entries
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda fraction: ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+    return f"p50 {pick(0.5):6.1f} ms  p95 {pick(0.95):6.1f} ms  p99 {pick(0.99):6.1f} ms"
+
+
+def time_queries(function, queries):
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        function(query)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--utterances", type=int, default=100_000)
+    parser.add_argument("--per-meeting", type=int, default=250, help="utterances per meeting")
+    parser.add_argument("--attended", type=float, default=0.1, help="share of the meetings the searching user attended")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--flush-size", type=int, default=20, help="utterances per append, like dbFlushSize")
+    parser.add_argument("--dimensions", type=int, default=384, help="vector size of the hashing encoder")
+    parser.add_argument("--model", default=None, help="sentence embedding model instead of the hashing encoder")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--mongo-uri", default=None, help="also time MongoDB text search in a scratch database")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    entries = make_corpus(args.utterances, args.per_meeting)
+    meeting_ids = sorted({entry["meeting_id"] for entry in entries})
+    rng = random.Random(1)
+    attended = rng.sample(meeting_ids, max(1, int(len(meeting_ids) * args.attended)))
+    queries = [" ".join(rng.choice(entries)["transcription"].split()[:3]) for _ in range(args.queries)]
+    print(f"{len(entries)} utterances in {len(meeting_ids)} meetings, {len(attended)} attended, {len(queries)} queries")
+
+    encoder = TransformerEncoder(args.model, args.device) if args.model else HashingEncoder(args.dimensions)
+    path = tempfile.mkdtemp(prefix="notebot-search-")
+    try:
+        index = EmbeddingIndex(path, encoder)
+        index.open()
+        start = time.perf_counter()
+        for offset in range(0, len(entries), args.flush_size):
+            index.add(entries[offset:offset + args.flush_size])
+        build = time.perf_counter() - start
+        disk = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        print(f"index: appended in {build:.1f} s ({len(entries) / build:,.0f} utterances/s), {disk / 2 ** 20:.1f} MiB on disk")
+
+        start = time.perf_counter()
+        reloaded = EmbeddingIndex(path, encoder)
+        reloaded.open()
+        print(f"index: loaded {reloaded._count} utterances in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        all_meetings = time_queries(lambda query: index.search(query, args.limit), queries)
+        print(f"embedding search, all meetings:      {percentiles(all_meetings)}")
+        filtered = time_queries(lambda query: index.search(query, args.limit, attended), queries)
+        print(f"embedding search, attended meetings: {percentiles(filtered)}")
+
+        if args.mongo_uri:
+            from mongo_handler import MongoDBHandler
+
+            db_handler = MongoDBHandler(args.mongo_uri, f"notebot_search_bench_{os.getpid()}")
+            try:
+                db_handler.ensure_indexes()
+                collection = db_handler.db["transcriptions"]
+                for offset in range(0, len(entries), 10_000):
+                    collection.insert_many(entries[offset:offset + 10_000])
+                attended_set = set(attended)
+                db_handler.db["meetings"].insert_many([
+                    {
+                        "meeting_id": meeting_id,
+                        "meeting_title": meeting_id,
+                        "start_date": datetime(2024, 1, 1),
+                        "attendees": [{"id": 1, "name": "searcher"}] if meeting_id in attended_set else [],
+                    }
+                    for meeting_id in meeting_ids
+                ])
+                search_index = SearchIndex(db_handler, reloaded)
+                text = time_queries(lambda query: search_index.text_search(query, args.limit), queries)
+                print(f"text search, all meetings:           {percentiles(text)}")
+                text = time_queries(lambda query: search_index.text_search(query, args.limit, attended), queries)
+                print(f"text search, attended meetings:      {percentiles(text)}")
+                combined = time_queries(lambda query: search_index.search(query, 1, args.limit), queries)
+                print(f"search command (text + embedding):   {percentiles(combined)}")
+                search_index.close()
+            finally:
+                db_handler.client.drop_database(db_handler.database_name)
+                db_handler.close_connection()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Compares pydub's detect_nonsilent with the NumPy EnergyVAD on synthetic speech/silence fixtures.
+Reports VAD CPU time and how many seconds of audio would be handed to Whisper.
+
+Run from the repository root: python -m benchmarks.bench_vad
+"""
+import argparse
+import time
+
+import numpy as np
+from pydub import AudioSegment
+from pydub.silence import detect_nonsilent
+
+from audio_buffer import PcmRingBuffer
+from vad import EnergyVAD, SAMPLE_RATE
+
+INPUT_SAMPLE_RATE = 48000
+
+
+def make_fixture(pattern, seed=0):
+    """
+    Builds 48 kHz stereo PCM from a list of (seconds, is_speech) segments.
+    Speech is an amplitude-modulated harmonic tone, silence is faint background noise.
+    """
+    rng = np.random.default_rng(seed)
+    parts = []
+    for seconds, is_speech in pattern:
+        t = np.arange(int(seconds * INPUT_SAMPLE_RATE)) / INPUT_SAMPLE_RATE
+        if is_speech:
+            envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+            signal = 0.25 * envelope * (np.sin(2 * np.pi * 180 * t) + 0.5 * np.sin(2 * np.pi * 360 * t))
+            signal += 0.01 * rng.standard_normal(len(t))
+        else:
+            signal = 0.001 * rng.standard_normal(len(t))
+        parts.append(signal)
+    pcm = (np.clip(np.concatenate(parts), -1, 1) * 32767).astype(np.int16)
+    return np.repeat(pcm[:, None], 2, axis=1).tobytes()
+
+
+FIXTURES = {
+    "short utterance": [(0.5, False), (2.0, True), (5.0, False)],
+    "pauses": [(1.0, False), (3.0, True), (0.4, False), (2.0, True), (3.0, False), (4.0, True), (5.0, False)],
+    "long monologue": [(0.5, False), (25.0, True), (5.0, False)],
+    "silence only": [(8.0, False)],
+}
+
+
+def run_pydub(raw):
+    audio_segment = AudioSegment(data=raw, sample_width=2, frame_rate=INPUT_SAMPLE_RATE, channels=2)
+    start = time.perf_counter()
+    ranges = detect_nonsilent(audio_segment, min_silence_len=1000, silence_thresh=-40)
+    elapsed = time.perf_counter() - start
+    # The old code transcribed the whole segment as soon as anything was nonsilent
+    kept = len(audio_segment) / 1000 if ranges else 0.0
+    return elapsed, kept
+
+
+def run_energy_vad(raw, vad):
+    buffer = PcmRingBuffer(max_seconds=len(raw) / 4 / INPUT_SAMPLE_RATE + 1)
+    buffer.write(raw)
+    audio_array = buffer.to_whisper()
+    start = time.perf_counter()
+    trimmed = vad.trim(audio_array)
+    elapsed = time.perf_counter() - start
+    return elapsed, len(trimmed) / SAMPLE_RATE
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per fixture, the fastest one is reported")
+    args = parser.parse_args()
+
+    vad = EnergyVAD()
+    print(f"{'fixture':>16} {'length':>8} | {'pydub ms':>9} {'kept s':>7} | {'numpy ms':>9} {'kept s':>7}")
+    for name, pattern in FIXTURES.items():
+        raw = make_fixture(pattern)
+        length = sum(seconds for seconds, _ in pattern)
+        pydub_runs = [run_pydub(raw) for _ in range(args.repeat)]
+        numpy_runs = [run_energy_vad(raw, vad) for _ in range(args.repeat)]
+        pydub_time, pydub_kept = min(pydub_runs)
+        numpy_time, numpy_kept = min(numpy_runs)
+        print(
+            f"{name:>16} {length:>7.1f}s | {pydub_time * 1000:>9.1f} {pydub_kept:>7.1f} | "
+            f"{numpy_time * 1000:>9.2f} {numpy_kept:>7.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
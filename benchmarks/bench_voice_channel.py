@@ -0,0 +1,327 @@
+"""
+End-to-end benchmark of a voice channel without Discord: simulated users join through the
+NoteBot voice-state handlers, talk in turns by replaying 20 ms PCM (or Opus) packets into the
+session at real time or faster, then leave so the meeting is summarized and DMed.
+Transcription and summarization are stubs that sleep like a model would, MongoDB is mongomock.
+
+Reports per speaker count: packets/s delivered, utterance-to-database latency percentiles
+(from a speaker's last packet to the bulk write of the transcription), memory per speaker,
+peak thread count, event-loop lag and the time from the last leave to the summary DMs.
+
+Run from the repository root: python -m benchmarks.bench_voice_channel --speakers 1 10 50 200
+Needs mongomock (pip install mongomock); --format opus also needs libopus.
+"""
+import argparse
+import asyncio
+import collections
+import os
+import resource
+import threading
+import time
+from types import SimpleNamespace
+
+import mongomock
+
+from benchmarks.bench_pcm_buffer import make_packets
+from mongo_handler import MongoDBHandler
+from notebot import NoteBot
+from processing_pipeline import EventLoopLagProbe
+
+PACKET_SECONDS = 0.02
+
+
+class StubASR:
+    """Answers like the Hugging Face ASR pipeline after sleeping `rtf` times the audio length."""
+
+    def __init__(self, rtf):
+        self.rtf = rtf
+
+    def __call__(self, audio_arrays, batch_size=1, generate_kwargs=None, return_timestamps=False):
+        time.sleep(self.rtf * sum(len(audio) for audio in audio_arrays) / 16000)
+        return [{"text": f"utterance of {len(audio) / 16000:.1f} seconds"} for audio in audio_arrays]
+
+
+class StubSummaryBackend:
+    """MapReduceSummarizer backend that sleeps `seconds` per call instead of running a model."""
+
+    produces_title = True
+    context_tokens = 4000
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def count_tokens(self, text):
+        return len(text) // 4 + 1
+
+    def map(self, chunks, label):
+        time.sleep(self.seconds)
+        return [f"{len(chunk.splitlines())} utterances" for chunk in chunks]
+
+    def reduce(self, text, label):
+        time.sleep(self.seconds)
+        return f"Benchmark meeting\n{len(text)} characters summarized"
+
+
+class FakeMember:
+    def __init__(self, member_id, dms):
+        self.id = member_id
+        self.name = f"speaker{member_id}"
+        self.bot = False
+        self.dms = dms
+
+    async def send(self, content):
+        self.dms.append(time.perf_counter())
+
+
+class FakeVoiceClient:
+    def __init__(self, channel):
+        self.channel = channel
+
+    def listen(self, sink):
+        self.sink = sink
+
+    async def disconnect(self):
+        self.channel.guild.voice_client = None
+
+
+class FakeGuild:
+    def __init__(self):
+        self.id = 1
+        self.name = "benchmark"
+        self.voice_client = None
+        self.members = {}
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild):
+        self.id = 2
+        self.name = "voice"
+        self.guild = guild
+        self.members = []
+        guild.voice_channels = [self]
+
+    async def connect(self, cls=None):
+        self.guild.voice_client = FakeVoiceClient(self)
+        return self.guild.voice_client
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak instead of current RSS, in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Sampler(threading.Thread):
+    """Samples RSS and thread count while a scenario runs."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak_rss = rss_bytes()
+        self.peak_threads = threading.active_count()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(0.1):
+            self.peak_rss = max(self.peak_rss, rss_bytes())
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+
+
+def make_opus_packets(pcm_packets):
+    from discord import opus
+
+    opus._load_default()
+    encoder = opus.Encoder()
+    return [encoder.encode(packet, encoder.SAMPLES_PER_FRAME) for packet in pcm_packets]
+
+
+def replay(session, members, packets, args, utterance_ends):
+    """
+    Plays the fixture for every member from one thread, like voice_recv's packet router.
+    Each member talks `talk` seconds, then pauses; members are staggered so turns overlap.
+    Returns the number of packets delivered, the number of utterances and the seconds it took.
+    """
+    talk_ticks = int(args.talk / PACKET_SECONDS)
+    cycle_ticks = talk_ticks + int(args.pause / PACKET_SECONDS)
+    offsets = [i * cycle_ticks // len(members) for i in range(len(members))]
+    tick_seconds = PACKET_SECONDS / args.speed
+    total_ticks = int(args.duration / PACKET_SECONDS)
+    talking = [False] * len(members)
+
+    sent = 0
+    # Counted here, the flush listener consumes utterance_ends while the replay is still running
+    utterances = 0
+    start = time.perf_counter()
+    for tick in range(total_ticks):
+        for i, member in enumerate(members):
+            position = (tick + offsets[i]) % cycle_ticks
+            if position < talk_ticks:
+                packet = packets[position % len(packets)]
+                if args.format == "opus":
+                    # Like voice_recv's VoiceData from a sink with decode=False
+                    data = SimpleNamespace(pcm=b"", opus=packet)
+                else:
+                    data = SimpleNamespace(pcm=packet, opus=None)
+                session.handle_voice_packet(member, data)
+                sent += 1
+                talking[i] = True
+            elif talking[i]:
+                talking[i] = False
+                utterance_ends[member.id].append(time.perf_counter())
+                utterances += 1
+        delay = start + (tick + 1) * tick_seconds - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    # Utterances cut off by the end of the replay are flushed too
+    for i, member in enumerate(members):
+        if talking[i]:
+            utterance_ends[member.id].append(time.perf_counter())
+            utterances += 1
+    return sent, utterances, time.perf_counter() - start
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+async def run_scenario(speakers, args, pcm_packets, opus_packets):
+    settings = {
+        "saveAudio": args.save_audio != "off",
+        "audioPath": args.audio_path,
+        "audioFormat": args.save_audio,
+        "minimumMeetingParticipants": 1,
+        "useOriginalLanguage": True,
+        "silenceTimeout": args.silence_timeout,
+        "transcriptionWorkers": args.asr_workers,
+        "transcriptionCacheSize": 0,  # Every utterance replays the same audio
+        "rollingSummaryUtterances": 0,
+        "dbFlushInterval": 0.5,
+    }
+    db_handler = MongoDBHandler("mongodb://benchmark", "notebot_benchmark", client=mongomock.MongoClient())
+    guild = FakeGuild()
+    channel = FakeVoiceChannel(guild)
+    bot = SimpleNamespace(guilds=[guild])
+    note_bot = NoteBot(
+        bot,
+        settings=settings,
+        db_handler=db_handler,
+        model_pipeline=StubASR(args.asr_rtf),
+        summary_backend=StubSummaryBackend(args.summary_seconds),
+    )
+    await note_bot.cog_load()
+    probe = EventLoopLagProbe(interval=0.01, warn_after=float("inf"))
+    probe.start()
+
+    # Utterance-to-database latency, matched per speaker in the order the utterances ended
+    utterance_ends = collections.defaultdict(collections.deque)
+    latencies = []
+
+    def on_flush(entries):
+        now = time.perf_counter()
+        for entry in entries:
+            ends = utterance_ends.get(entry["user_id"])
+            if ends:
+                latencies.append(now - ends.popleft())
+
+    note_bot.db.add_flush_listener(on_flush)
+
+    baseline_rss = rss_bytes()
+    sampler = Sampler()
+    sampler.start()
+
+    dms = []
+    members = [FakeMember(i + 100, dms) for i in range(speakers)]
+    for member in members:
+        guild.members[member.id] = member
+        channel.members.append(member)
+        await note_bot.on_voice_state_update(member, SimpleNamespace(channel=None), SimpleNamespace(channel=channel))
+
+    session = note_bot.sessions[(guild.id, channel.id)]
+    packets = opus_packets if args.format == "opus" else pcm_packets
+    sent, utterances, seconds = await asyncio.to_thread(replay, session, members, packets, args, utterance_ends)
+
+    # Wait until every utterance reached the database
+    deadline = time.perf_counter() + args.silence_timeout + args.drain_timeout
+    while any(utterance_ends.values()) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+    missing = sum(len(ends) for ends in utterance_ends.values())
+
+    leave_start = time.perf_counter()
+    for member in members:
+        channel.members.remove(member)
+        await note_bot.on_voice_state_update(member, SimpleNamespace(channel=channel), SimpleNamespace(channel=None))
+    while len(dms) < speakers and time.perf_counter() - leave_start < args.drain_timeout:
+        await asyncio.sleep(0.05)
+    summary_seconds = (max(dms) - leave_start) if len(dms) == speakers else float("nan")
+
+    sampler.stopped.set()
+    sampler.join()
+    await probe.stop()
+    await note_bot.cog_unload()
+
+    lag = probe.stats()
+    return {
+        "speakers": speakers,
+        "packets_per_second": sent / seconds,
+        "target_packets_per_second": sent / args.duration * args.speed,
+        "utterances": utterances,
+        "missing": missing,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "mib_per_speaker": (sampler.peak_rss - baseline_rss) / speakers / 2 ** 20,
+        "threads": sampler.peak_threads,
+        "max_lag_ms": lag["max_lag"] * 1000,
+        "mean_lag_ms": lag["mean_lag"] * 1000,
+        "summary_seconds": summary_seconds,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--speakers", type=int, nargs="+", default=[1, 10, 50, 100, 200])
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds of meeting audio replayed per scenario")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay rate, 1 is real time")
+    parser.add_argument("--talk", type=float, default=4.0, help="seconds each speaker talks per turn")
+    parser.add_argument("--pause", type=float, default=6.0, help="seconds of silence between turns")
+    parser.add_argument("--silence-timeout", type=float, default=1.0)
+    parser.add_argument("--format", choices=["pcm", "opus"], default="pcm", help="what the sink delivers")
+    parser.add_argument("--save-audio", choices=["off", "opus", "flac", "opus-passthrough"], default="off")
+    parser.add_argument("--audio-path", default="./benchmark-recordings")
+    parser.add_argument("--asr-rtf", type=float, default=0.05, help="stub transcription seconds per audio second")
+    parser.add_argument("--asr-workers", type=int, default=2)
+    parser.add_argument("--summary-seconds", type=float, default=0.5, help="stub summarizer seconds per call")
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    if args.pause / args.speed <= args.silence_timeout:
+        parser.error("the pause between turns must be longer than the silence timeout in wall time")
+
+    pcm_packets = make_packets(args.talk)
+    opus_packets = make_opus_packets(pcm_packets) if args.format == "opus" else None
+
+    print(
+        f"{'speakers':>8} | {'pkt/s':>8} {'target':>8} | {'utts':>5} {'lost':>4} | "
+        f"{'p50 s':>6} {'p95 s':>6} {'p99 s':>6} | {'MiB/spk':>7} {'threads':>7} | "
+        f"{'lag max ms':>10} {'mean':>6} | {'summary s':>9}"
+    )
+    for speakers in args.speakers:
+        r = await run_scenario(speakers, args, pcm_packets, opus_packets)
+        print(
+            f"{r['speakers']:>8} | {r['packets_per_second']:>8.0f} {r['target_packets_per_second']:>8.0f} | "
+            f"{r['utterances']:>5} {r['missing']:>4} | {r['p50']:>6.2f} {r['p95']:>6.2f} {r['p99']:>6.2f} | "
+            f"{r['mib_per_speaker']:>7.2f} {r['threads']:>7} | {r['max_lag_ms']:>10.1f} {r['mean_lag_ms']:>6.2f} | "
+            f"{r['summary_seconds']:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
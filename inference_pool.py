@@ -0,0 +1,225 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_main(model_id, device, torch_threads, cache_dir, quantization, jobs, results, current_job):
+    """Entry point of a worker process: loads the model once, then serves jobs until it gets None."""
+    import torch
+    from setup_model import setup_whisper_model
+
+    torch.set_num_threads(torch_threads)
+    try:
+        model_pipeline = setup_whisper_model(model_id, device, cache_dir, quantization)
+    except Exception as e:
+        results.put(("failed", os.getpid(), repr(e)))
+        return
+    results.put(("ready", os.getpid(), None))
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job_id, audio_arrays, kwargs = job
+        # Shared memory, unlike the queue it is up to date even if the process dies in the middle of the job
+        current_job.value = job_id
+        try:
+            results.put((job_id, model_pipeline(audio_arrays, **kwargs), None))
+        except Exception as e:
+            results.put((job_id, None, repr(e)))
+        current_job.value = -1
+
+
+class ProcessInferenceBackend:
+    """
+    Runs Whisper in `processes` worker processes instead of one pipeline in the bot's process.
+    Each worker loads the model once and uses `torch_threads` threads, so a CPU-only box can
+    transcribe several speakers at once without contending for the GIL.
+    Every worker holds its own copy of the weights, so memory grows with `processes`.
+    Instances are called like a Hugging Face ASR pipeline and block until a worker is done;
+    jobs go to whichever worker is free first. A job whose worker process dies fails with a
+    RuntimeError, as do all jobs once no worker is left.
+    """
+
+    def __init__(self, model_id, device="cpu", processes=2, torch_threads=None, cache_dir="cache", quantization="none"):
+        self.processes = max(1, processes)
+        self.torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // self.processes)
+        # Lets the TranscriptionScheduler start enough threads to keep every worker busy
+        self.concurrency = self.processes
+
+        context = multiprocessing.get_context("spawn")
+        self._jobs = context.Queue()
+        self._results = context.Queue()
+        self._futures = {}
+        self._futures_lock = threading.Lock()
+        self._job_ids = itertools.count()
+        self._state = threading.Condition()
+        self._loaded = set()  # pids of the workers that loaded the model
+        self._failed = set()  # pids of the workers that failed to load it or exited
+        self._closing = False
+        self._exited = set()  # pids of the workers whose exit was already handled
+
+        self._workers = []
+        self._current_jobs = []  # per worker, id of the job it is working on (-1 if none)
+        for i in range(self.processes):
+            current_job = context.RawValue("q", -1)
+            worker = context.Process(
+                target=_worker_main,
+                args=(model_id, device, self.torch_threads, cache_dir, quantization, self._jobs, self._results, current_job),
+                name=f"whisper-worker-{i}",
+                daemon=True,
+            )
+            worker.start()
+            self._workers.append(worker)
+            self._current_jobs.append(current_job)
+
+        self._collector = threading.Thread(target=self._collect, name="whisper-results", daemon=True)
+        self._collector.start()
+        logger.info(
+            "Started %d Whisper worker process(es) with %s torch thread(s) each", self.processes, self.torch_threads
+        )
+
+    @classmethod
+    def from_settings(cls, settings, cache_dir="cache"):
+        device = settings.get("device")
+        return cls(
+            settings.get("model_id"),
+            device="cpu" if device in (None, "auto") else device,
+            processes=settings.get("inferenceProcesses", 2),
+            torch_threads=settings.get("torchThreadsPerWorker"),
+            cache_dir=cache_dir,
+            quantization=settings.get("quantization", "none"),
+        )
+
+    def wait_until_ready(self, timeout=None):
+        """
+        Blocks until every worker has loaded its model. Returns False on timeout and raises
+        RuntimeError if a worker failed to load the model or exited.
+        """
+        with self._state:
+            done = self._state.wait_for(lambda: len(self._loaded | self._failed) >= self.processes, timeout=timeout)
+            if self._failed:
+                raise RuntimeError(f"{len(self._failed)} of {self.processes} Whisper worker(s) failed to load the model")
+            return done
+
+    def __call__(self, audio_arrays, **kwargs):
+        future = Future()
+        job_id = next(self._job_ids)
+        with self._futures_lock:
+            if not any(worker.is_alive() for worker in self._workers):
+                raise RuntimeError("No Whisper worker process is running")
+            self._futures[job_id] = future
+        self._jobs.put((job_id, audio_arrays, kwargs))
+        return future.result()
+
+    def _collect(self):
+        last_check = time.monotonic()
+        while True:
+            try:
+                job_id, result, error = self._results.get(timeout=1.0)
+            except queue.Empty:
+                job_id = "idle"
+            if time.monotonic() - last_check >= 1.0:
+                last_check = time.monotonic()
+                self._check_workers()
+            if job_id == "idle":
+                continue
+            if job_id == "ready":
+                with self._state:
+                    self._loaded.add(result)
+                    self._state.notify_all()
+                continue
+            if job_id == "failed":
+                logger.error("Whisper worker %s failed to load the model: %s", result, error)
+                with self._state:
+                    self._failed.add(result)
+                    self._state.notify_all()
+                continue
+            if job_id is None:
+                return
+
+            with self._futures_lock:
+                future = self._futures.pop(job_id, None)
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(RuntimeError(f"Whisper worker failed: {error}"))
+            else:
+                future.set_result(result)
+
+    def _check_workers(self):
+        """Fails the jobs of worker processes that died; with no worker left, fails every waiting job."""
+        if self._closing:
+            return
+        for worker, current_job in zip(self._workers, self._current_jobs):
+            if worker.exitcode is None or worker.pid in self._exited:
+                continue
+            self._exited.add(worker.pid)
+            logger.error("Whisper worker %s exited with code %s", worker.pid, worker.exitcode)
+            with self._state:
+                # Also covers workers that died while loading the model, e.g. killed for using too much memory
+                self._failed.add(worker.pid)
+                self._state.notify_all()
+            with self._futures_lock:
+                future = self._futures.pop(current_job.value, None)
+            if future is not None:
+                future.set_exception(RuntimeError(f"Whisper worker {worker.pid} exited during the job"))
+
+        if not any(worker.is_alive() for worker in self._workers):
+            with self._futures_lock:
+                futures = list(self._futures.values())
+                self._futures.clear()
+            for future in futures:
+                future.set_exception(RuntimeError("No Whisper worker process is running"))
+
+    def terminate(self):
+        """Stops the workers right away, e.g. after one of them failed to load the model."""
+        self._closing = True
+        for worker in self._workers:
+            worker.terminate()
+        for worker in self._workers:
+            worker.join()
+        self._results.put((None, None, None))
+        self._collector.join()
+
+    def close(self):
+        self._closing = True
+        for _ in self._workers:
+            self._jobs.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._results.put((None, None, None))
+        self._collector.join()
+
+
+def load_inference_backend(settings):
+    """
+    Loads the transcription model with the configured `inferenceBackend` and returns it once it
+    can take work: a Hugging Face pipeline ('thread') or a ProcessInferenceBackend ('process').
+    """
+    inference_backend = settings.get("inferenceBackend", "thread")
+    if inference_backend == "process":
+        # Several model copies in worker processes, for CPU-only machines
+        backend = ProcessInferenceBackend.from_settings(settings)
+        try:
+            backend.wait_until_ready()
+        except RuntimeError:
+            backend.terminate()
+            raise
+        return backend
+    if inference_backend == "thread":
+        from setup_model import setup_whisper_model
+
+        return setup_whisper_model(
+            settings.get("model_id"),
+            settings.get("device"),
+            quantization=settings.get("quantization", "none"),
+        )
+    raise ValueError(f"Unknown inference backend: {inference_backend}")
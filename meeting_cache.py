@@ -0,0 +1,83 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ActiveMeeting:
+    def __init__(self, meeting_id, guild_id, channel_id, start_date, attendees):
+        self.meeting_id = meeting_id
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.start_date = start_date
+        self.attendees = list(attendees)  # [{"id": ..., "name": ...}]
+        self.attendee_ids = {a["id"] for a in self.attendees}
+
+    @classmethod
+    def from_document(cls, meeting):
+        return cls(
+            meeting["meeting_id"],
+            meeting.get("guild_id"),
+            meeting.get("channel_id"),
+            meeting.get("start_date"),
+            meeting.get("attendees", []),
+        )
+
+
+class ActiveMeetingCache:
+    """
+    In-process view of all meetings without an end_date, keyed by (guild_id, channel_id).
+    It is loaded once at startup; afterwards every meeting start, attendee change and meeting
+    end goes through the cog, which updates the cache and the database together. A cache miss
+    therefore means there is no active meeting and needs no database read.
+    Meetings created before guild/channel ids were stored are kept under (None, None)
+    until a channel adopts them.
+    """
+
+    def __init__(self):
+        self._meetings = {}
+        self.loaded = False
+
+    async def load(self, db):
+        """Fills the cache from the database using the end_date index."""
+        meetings = await db.find_entries(
+            "meetings",
+            {"end_date": None},
+            projection={"transcriptions": 0},
+            sort=[("start_date", 1)],
+        )
+        self._meetings = {}
+        for meeting in meetings:
+            active = ActiveMeeting.from_document(meeting)
+            # If several meetings are open for one channel, the newest one wins
+            self._meetings[(active.guild_id, active.channel_id)] = active
+        self.loaded = True
+        logger.info("Loaded %d active meeting(s) into the cache", len(self._meetings))
+
+    def get(self, guild_id, channel_id):
+        return self._meetings.get((guild_id, channel_id))
+
+    def adopt_legacy(self, guild_id, channel_id):
+        """Moves an active meeting without guild/channel ids to the given channel, if there is one."""
+        active = self._meetings.pop((None, None), None)
+        if active is not None:
+            active.guild_id = guild_id
+            active.channel_id = channel_id
+            self._meetings[(guild_id, channel_id)] = active
+        return active
+
+    def start(self, active):
+        self._meetings[(active.guild_id, active.channel_id)] = active
+
+    def end(self, guild_id, channel_id):
+        return self._meetings.pop((guild_id, channel_id), None)
+
+    def add_attendee(self, active, member):
+        """Adds the member to the cached attendees. Returns False if they were already there."""
+        if member.id in active.attendee_ids:
+            return False
+        active.attendee_ids.add(member.id)
+        active.attendees.append({"id": member.id, "name": member.name})
+        return True
+
+    def __len__(self):
+        return len(self._meetings)
@@ -1,88 +1,278 @@
+import heapq
+import logging
 import os
-import torch
-from openai import OpenAI
-from transformers import pipeline
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from mongo_handler import MongoDBHandler
+from setup_model import quantization_dtype, quantize_model, resolve_device, resolve_quantization
+from summarizer import HuggingFaceSummaryBackend, MapReduceSummarizer, OpenAISummaryBackend
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 
+TRANSCRIPT_PROJECTION = {
+    "user": 1, "user_id": 1, "timestamp": 1, "start_time": 1, "end_time": 1, "transcription": 1, "seq": 1,
+}
+
+
+def spoken_at(transcript):
+    """When an utterance was spoken. Transcriptions saved before capture times were recorded only have the save time."""
+    return transcript.get("start_time") or transcript["timestamp"]
+
+
+def transcript_line(transcript):
+    return f"{transcript['user']}: \"{transcript['transcription']}\""
+
+
+def merge_fragments(transcripts, max_gap_seconds=2.0, max_words=150):
+    """
+    Joins consecutive utterances of the same speaker that follow each other within `max_gap_seconds`,
+    up to `max_words` words, so the summarizer sees one line per turn instead of one per fragment.
+    """
+    current = None
+    words = 0
+    for transcript in transcripts:
+        if current is not None:
+            same_speaker = transcript.get("user_id", transcript["user"]) == current.get("user_id", current["user"])
+            gap = (spoken_at(transcript) - (current.get("end_time") or spoken_at(current))).total_seconds()
+            length = len(transcript["transcription"].split())
+            if same_speaker and gap <= max_gap_seconds and words + length <= max_words:
+                current["transcription"] += " " + transcript["transcription"]
+                current["end_time"] = transcript.get("end_time") or spoken_at(transcript)
+                words += length
+                continue
+            yield current
+        current = dict(transcript)
+        words = len(current["transcription"].split())
+    if current is not None:
+        yield current
+
+
+class RollingSummary:
+    """Partial summaries of the part of a meeting that has already been folded in."""
+
+    def __init__(self):
+        self.partials = []
+        self.last_seq = None  # seq of the newest transcription that is part of the partials
+        self.new_utterances = 0
+        self.last_fold = time.time()
+        self.scheduled = False
+        self.lock = threading.Lock()  # Held while folding, the final summary waits for it
+
+
 class MeetingReader:
-    def __init__(self, db_handler: MongoDBHandler, settings):
+    def __init__(self, db_handler: MongoDBHandler, settings, summary_backend=None, written_seq=None):
         """
         Initialize MeetingReader with an existing MongoDBHandler instance.
         :param db_handler: Instance of MongoDBHandler to interact with the database.
+        :param summary_backend: Optional backend for the MapReduceSummarizer (e.g. a stub for testing).
+        :param written_seq: Optional callable returning the seq below which all transcriptions are written
+            (AsyncMongoDBHandler.written_seq), rolling summaries don't read past it.
         """
         self.settings = settings
         self.db_handler = db_handler
         self.summarizer_model_id = self.settings.get("summarizer_model_id")
 
-        device = self.settings.get("device")
-        if device == 'auto':
-            device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-
         # Determine if we're using a ChatGPT-like model
         self.use_chatgpt = self.summarizer_model_id and "gpt" in self.summarizer_model_id.lower()
 
-        if not self.use_chatgpt:
-            # Use Hugging Face pipeline
-            self.summarizer = pipeline("summarization", model=self.summarizer_model_id, device=device)
-            self.client = None
-        else:
-            # Create the OpenAI client
-            api_key = os.getenv("OPENAI_API_KEY")
-            self.client = OpenAI(api_key=api_key)
+        # The summarization model is loaded on first use (see load_summarizer), not at startup
+        self.summarizer = None
+        self.client = None
+        self._summary_backend = summary_backend
+        self._map_reduce = None
+        self._load_lock = threading.Lock()
+
+        # Rolling summaries are updated in the background while a meeting is running
+        self.rolling_utterances = self.settings.get("rollingSummaryUtterances", 50)
+        self.rolling_interval = self.settings.get("rollingSummaryMinutes", 5) * 60
+        self.rolling_summaries = {}  # meeting_id -> RollingSummary
+        self._summarized = OrderedDict()  # recently summarized meetings, late transcriptions don't start a rolling summary
+        self._rolling_lock = threading.Lock()
+        self._rolling_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rolling-summary")
+        self._written_seq = written_seq
+
+        # Short fragments of one speaker are joined into one line before summarizing
+        self.merge_gap_seconds = self.settings.get("transcriptMergeGapSeconds", 2.0)
+        self.merge_max_words = self.settings.get("transcriptMergeMaxWords", 150)
+
+    @property
+    def map_reduce(self):
+        return self.load_summarizer()
+
+    def load_summarizer(self):
+        """Loads the summarization backend once; safe to call from several threads."""
+        with self._load_lock:
+            if self._map_reduce is not None:
+                return self._map_reduce
+
+            start = time.perf_counter()
+            summary_workers = self.settings.get("summaryWorkers", 4)
+            summary_backend = self._summary_backend
+            if summary_backend is None and not self.use_chatgpt:
+                from transformers import pipeline
+
+                device = resolve_device(self.settings.get("device"))
+                quantization = resolve_quantization(self.settings.get("quantization", "none"), device)
+
+                # Use Hugging Face pipeline
+                self.summarizer = pipeline(
+                    "summarization",
+                    model=self.summarizer_model_id,
+                    device=device,
+                    # Keep the model's default precision unless bf16 was asked for
+                    torch_dtype=quantization_dtype(quantization, device) if quantization == "bf16" else None,
+                )
+                self.summarizer.model = quantize_model(self.summarizer.model, quantization)
+                summary_backend = HuggingFaceSummaryBackend(self.summarizer, max_workers=summary_workers)
+            elif summary_backend is None:
+                from openai import OpenAI
+
+                # Create the OpenAI client, shared by every summarization thread
+                api_key = os.getenv("OPENAI_API_KEY")
+                self.client = OpenAI(api_key=api_key)
+                summary_backend = OpenAISummaryBackend(
+                    self.client, self.summarizer_model_id, max_concurrency=summary_workers
+                )
+
+            # Long meetings are summarized in chunks that fit the model's context window
+            self._map_reduce = MapReduceSummarizer(summary_backend, self.settings.get("summaryChunkTokens"))
+            logger.info("Summarizer %s loaded in %.1fs", self.summarizer_model_id, time.perf_counter() - start)
+            return self._map_reduce
+
+    def iter_meeting_transcripts(self, meeting_id, after_seq=None, before_seq=None, batch_size=500):
+        """
+        Yields the utterances of a meeting in the order they were spoken, optionally only those queued after
+        `after_seq` and before `before_seq`. Transcriptions are saved in the order the model finishes them,
+        so each speaker's utterances are read with their own cursor, sorted by capture time, and the cursors
+        are merged. Memory use depends on the number of speakers, not on the meeting length.
+        """
+        query = {"meeting_id": meeting_id}
+        seq = {}
+        if after_seq is not None:
+            seq["$gt"] = after_seq
+        if before_seq is not None:
+            seq["$lt"] = before_seq
+        if after_seq is not None:
+            query["seq"] = seq
+        elif seq:
+            # Transcriptions saved before sequence numbers were recorded are older than any
+            query["$or"] = [{"seq": seq}, {"seq": None}]
+        # None also matches transcriptions saved before user ids were recorded
+        speakers = set(self.db_handler.distinct_values("transcriptions", "user_id", query)) | {None}
+        cursors = [
+            self.db_handler.find_entries(
+                "transcriptions",
+                dict(query, user_id=speaker),
+                projection=TRANSCRIPT_PROJECTION,
+                sort=[("start_time", 1), ("timestamp", 1)],
+                batch_size=batch_size,
+            )
+            for speaker in speakers
+        ]
+        try:
+            yield from heapq.merge(*cursors, key=spoken_at)
+        finally:
+            for cursor in cursors:
+                cursor.close()
+
+    def iter_merged_transcripts(self, meeting_id, after_seq=None):
+        """Like iter_meeting_transcripts, with consecutive fragments of the same speaker joined."""
+        return merge_fragments(
+            self.iter_meeting_transcripts(meeting_id, after_seq=after_seq), self.merge_gap_seconds, self.merge_max_words
+        )
+
+    def note_transcriptions(self, entries):
+        """
+        Flush listener for the write-behind buffer. Counts new utterances per meeting and schedules
+        a rolling summary update every `rollingSummaryUtterances` utterances or `rollingSummaryMinutes` minutes.
+        """
+        if self.rolling_utterances <= 0:
+            return
+        for meeting_id, count in Counter(entry["meeting_id"] for entry in entries).items():
+            with self._rolling_lock:
+                if meeting_id in self._summarized:
+                    continue
+                state = self.rolling_summaries.setdefault(meeting_id, RollingSummary())
+                state.new_utterances += count
+                due = (
+                    state.new_utterances >= self.rolling_utterances
+                    or time.time() - state.last_fold >= self.rolling_interval
+                )
+                if not due or state.scheduled:
+                    continue
+                state.scheduled = True
+            self._rolling_executor.submit(self._fold_rolling_summary, meeting_id, state)
+
+    def _fold_rolling_summary(self, meeting_id, state):
+        """Summarizes the utterances since the last fold and adds them to the meeting's partial summaries."""
+        with self._rolling_lock:
+            state.scheduled = False
+            if self.rolling_summaries.get(meeting_id) is not state:
+                # The meeting was summarized in the meantime
+                return
+            state.new_utterances = 0
+            state.last_fold = time.time()
+
+        try:
+            with state.lock:
+                # Only what is written up to here; a transcription still waiting to be written would be skipped
+                # by the next update, which continues after the newest seq read now
+                before_seq = self._written_seq() if self._written_seq is not None else None
+                transcripts = list(
+                    self.iter_meeting_transcripts(meeting_id, after_seq=state.last_seq, before_seq=before_seq)
+                )
+                seqs = [t["seq"] for t in transcripts if t.get("seq") is not None]
+                if not seqs:
+                    return
+                lines = [
+                    transcript_line(t)
+                    for t in merge_fragments(transcripts, self.merge_gap_seconds, self.merge_max_words)
+                ]
+                state.partials, _ = self.map_reduce.summarize_part(lines, state.partials)
+                state.last_seq = max(seqs)
+                logger.info("Rolling summary of %s updated with %d utterance(s)", meeting_id, len(transcripts))
+        except Exception:
+            logger.exception("Error updating rolling summary of %s", meeting_id)
+
+    def close(self):
+        """Stops the rolling summary updates, one that is already running finishes in the background."""
+        self._rolling_executor.shutdown(wait=False, cancel_futures=True)
 
     def read_meeting_transcripts(self, meeting_id):
         """
-        Reads a meeting from the database and lists its transcripts ordered by timestamp,
+        Reads a meeting from the database and lists its transcripts in the order they were spoken,
         then summarizes the meeting and updates the database with the summary and meeting title.
         """
-        # Fetch the meeting document
-        meeting = self.db_handler.read_entry("meetings", {"meeting_id": meeting_id})
+        # Fetch the meeting document without any legacy transcriptions array
+        meeting = self.db_handler.read_entry("meetings", {"meeting_id": meeting_id}, {"transcriptions": 0})
 
         if not meeting:
-            print(f"No meeting found with ID: {meeting_id}")
+            logger.warning("No meeting found with ID: %s", meeting_id)
             return
 
-        # Extract and sort transcriptions by timestamp
-        transcripts = meeting.get("transcriptions", [])
-        sorted_transcripts = sorted(transcripts, key=lambda t: t["timestamp"])
-
-        # Display the transcripts
-        meeting_transcripts = ""
-        for transcript in sorted_transcripts:
-            user = transcript["user"]
-            transcription = transcript["transcription"]
-            meeting_transcripts += f"{user}: \"{transcription}\"\n"
-
-        summary_text = "No summary available for this meeting."
-
-        # Summarize using the appropriate method
-        if self.use_chatgpt and self.client is not None:
-            # Use OpenAI client
-            chat_prompt = (
-                "You are given transcripts from a meeting.\n\n"
-                "Dont make any information up or assume anything. Only summarize the existing transcripts.\n\n"
-                "Generate the response in the language that was spoken in the meeting. So if the transcripts are in german, sumamrize in germand and create a german title. If the languag is englisch, do everything in english and so on. \n\n"
-                "1. Invent a brief, fitting meeting title that captures the overall theme or purpose of the meeting.\n"
-                "2. Summarize the key points, decisions, and action items from the transcripts.\n\n"
-                "3. Create a to-do list of action items that need to be completed after the meeting.\n\n"
-                "The first line of your response should be the newly created meeting title.\n\n"
-                f"Transcripts:\n{meeting_transcripts}"
-            )
+        with self._rolling_lock:
+            state = self.rolling_summaries.pop(meeting_id, None)
+            self._summarized[meeting_id] = True
+            while len(self._summarized) > 1000:
+                self._summarized.popitem(last=False)
+        if state is None:
+            state = RollingSummary()
 
-            response = self.client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that summarizes meeting transcripts."},
-                    {"role": "user", "content": chat_prompt}
-                ],
-                model=self.summarizer_model_id,
-                max_tokens=300,
-                temperature=0.7,
+        # Waits for a rolling update that is still running, then only folds in what came after it
+        with state.lock:
+            # Stream the transcripts as lines, the summarizer chunks them on its token budget
+            lines = (
+                transcript_line(transcript)
+                for transcript in self.iter_merged_transcripts(meeting_id, after_seq=state.last_seq)
             )
-            summary_text = response.choices[0].message.content.strip()
+            summary_text, _ = self.map_reduce.summarize(lines, partials=state.partials)
 
+        if summary_text and getattr(self.map_reduce.backend, "produces_title", False):
             # Extract the meeting title from the first line of the summary (if present)
             lines = summary_text.split('\n')
             meeting_title = lines[0].strip() if lines else "Untitled Meeting"
@@ -93,20 +283,20 @@ class MeetingReader:
             self.db_handler.update_entry(
                 "meetings",
                 {"meeting_id": meeting_id},
-                {"$set": {"meeting_title": meeting_title, "summary": summary_text}}
+                {"$set": {
+                    "meeting_title": meeting_title,
+                    "summary": summary_text,
+                    "summary_model": self.summarizer_model_id,
+                }}
             )
 
         else:
-            # Use the Hugging Face summarizer pipeline
-            summary = self.summarizer(meeting_transcripts, max_length=130, min_length=30, do_sample=False)
-            if summary and len(summary) > 0:
-                summary_text = summary[0]['summary_text']
-
+            summary_text = summary_text or "No summary available for this meeting."
             # Update the database with the summary (no meeting title from Hugging Face)
             self.db_handler.update_entry(
                 "meetings",
                 {"meeting_id": meeting_id},
-                {"$set": {"summary": summary_text}}
+                {"$set": {"summary": summary_text, "summary_model": self.summarizer_model_id}}
             )
 
         return summary_text
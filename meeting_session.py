@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+from collections import Counter
+
+import discord
+from discord.ext import voice_recv
+
+from metrics import RECORDERS_EVICTED
+from voice_recorder import VoiceRecorder
+
+logger = logging.getLogger(__name__)
+
+
+class PendingTranscriptions:
+    """
+    Counts, per meeting, the utterances that were cut from a speaker's buffer but are not saved yet
+    (queued for or being transcribed). The summary of a finished meeting waits for these to reach zero.
+    """
+
+    def __init__(self):
+        self._counts = Counter()
+        self._condition = threading.Condition()
+
+    def add(self, meeting_id):
+        with self._condition:
+            self._counts[meeting_id] += 1
+
+    def done(self, meeting_id):
+        with self._condition:
+            self._counts[meeting_id] -= 1
+            if self._counts[meeting_id] <= 0:
+                del self._counts[meeting_id]
+                self._condition.notify_all()
+
+    def count(self, meeting_id):
+        with self._condition:
+            return self._counts[meeting_id]
+
+    def wait(self, meeting_id, timeout=None):
+        """Blocks until every utterance of the meeting is saved. Returns False on timeout."""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._counts[meeting_id], timeout=timeout)
+
+
+class MeetingSession:
+    """
+    Everything the bot keeps for one voice channel: the active meeting, the voice connection
+    and one recorder per speaker. The transcription backend, silence scheduler, database
+    handler and audio archiver are shared by all sessions.
+    """
+
+    def __init__(
+        self, guild_id, channel_id, transcriber, silence_scheduler, settings, db, archiver=None, budget=None, pending=None
+    ):
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.transcriber = transcriber
+        self.silence_scheduler = silence_scheduler
+        self.settings = settings
+        self.db = db
+        self.archiver = archiver
+        self.budget = budget
+        self.pending = pending  # Shared PendingTranscriptions
+        # Recorders of speakers that stayed silent this long are dropped, with their buffers
+        self.idle_seconds = settings.get("recorderIdleSeconds", 300)
+        self._last_idle_check = time.time()
+
+        self.meeting = None  # ActiveMeeting
+        self.voice_client = None
+        self.recorders = {}  # user id -> VoiceRecorder
+
+    @property
+    def key(self):
+        return (self.guild_id, self.channel_id)
+
+    @property
+    def meeting_id(self):
+        return self.meeting.meeting_id if self.meeting is not None else None
+
+    def set_meeting(self, meeting):
+        """Attaches the active meeting, recorders created before it was known follow along."""
+        self.meeting = meeting
+        # Copied, the voice thread adds recorders for new speakers while this runs
+        for recorder in list(self.recorders.values()):
+            recorder.meeting_id = self.meeting_id
+
+    def handle_voice_packet(self, user, data: voice_recv.VoiceData):
+        """Sink callback for every received voice packet in this channel."""
+        if user is None:
+            return
+
+        recorder = self.recorders.get(user.id)
+        if recorder is None:
+            recorder = VoiceRecorder(
+                user, self.meeting_id, self.transcriber, self.settings, self.db, self.archiver, self.budget, self.pending
+            )
+            self.recorders[user.id] = recorder
+        # voice_recv hands over b"" (not None) as pcm when the sink doesn't decode
+        if data.pcm:
+            recorder.add_packet(data.pcm)
+        elif data.opus:
+            # Passthrough sink: the recorder archives the packet and decodes it for transcription
+            recorder.add_opus_packet(data.opus)
+        else:
+            # Lost packet, nothing to record
+            return
+        self.silence_scheduler.touch(recorder)
+        self.evict_idle_recorders()
+
+    def release_recorder(self, user_id):
+        """Transcribes what a speaker still has buffered and drops their recorder. May block on a full queue."""
+        recorder = self.recorders.pop(user_id, None)
+        if recorder is None:
+            return
+        self.silence_scheduler.forget(recorder)
+        recorder.release()
+        RECORDERS_EVICTED.inc()
+
+    def evict_idle_recorders(self):
+        """Releases recorders that received nothing for `recorderIdleSeconds`. Cheap unless a check is due."""
+        now = time.time()
+        if self.idle_seconds is None or now - self._last_idle_check < min(60, self.idle_seconds):
+            return
+        self._last_idle_check = now
+        for user_id, recorder in list(self.recorders.items()):
+            if now - recorder.last_spoken_time >= self.idle_seconds:
+                logger.info("Releasing the recorder of %s after %.0fs of silence", recorder.user.name, self.idle_seconds)
+                self.release_recorder(user_id)
+
+    async def connect(self, voice_channel):
+        """Joins the voice channel and starts listening. Returns False if that is not possible."""
+        if self.voice_client is not None:
+            return True
+
+        # Discord allows one voice connection per guild
+        current = voice_channel.guild.voice_client
+        if current is not None:
+            logger.warning(
+                "Cannot record %s, already connected to %s in %s",
+                voice_channel.name, current.channel.name, voice_channel.guild.name,
+            )
+            return False
+
+        try:
+            self.voice_client = await voice_channel.connect(cls=voice_recv.VoiceRecvClient)
+        except discord.ClientException as e:
+            logger.error("Error connecting to the voice channel: %s", e)
+            return False
+        # With an Opus passthrough archive the packets are decoded by the recorders instead of the sink
+        passthrough = self.archiver is not None and self.archiver.passthrough
+        self.voice_client.listen(voice_recv.BasicSink(self.handle_voice_packet, decode=not passthrough))
+        logger.info("Bot connected to %s in %s", voice_channel.name, voice_channel.guild.name)
+        return True
+
+    async def disconnect(self):
+        if self.voice_client is not None:
+            await self.voice_client.disconnect()
+            self.voice_client = None
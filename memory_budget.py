@@ -0,0 +1,51 @@
+import threading
+
+from metrics import BUFFER_BUDGET_FLUSHES
+
+
+class BufferBudget:
+    """
+    Global cap on the PCM buffered by all recorders together. Each recorder is already capped at
+    `maxUtteranceSeconds`, but many long-winded speakers (or stuck microphones) at once can still add
+    up. Recorders report their buffered bytes after every packet; once the total is over `max_bytes`
+    the speaker with the most buffered audio is picked to be flushed early.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self._usage = {}  # recorder -> buffered bytes
+        self._total = 0
+        self._lock = threading.Lock()
+        self.forced_flushes = 0
+
+    @classmethod
+    def from_settings(cls, settings):
+        max_megabytes = settings.get("audioBufferBudgetMB")
+        return cls(int(max_megabytes * 1024 * 1024) if max_megabytes is not None else None)
+
+    def update(self, recorder, nbytes):
+        """Records a recorder's buffered bytes. Returns the recorder to flush if the budget is exceeded."""
+        with self._lock:
+            self._total += nbytes - self._usage.get(recorder, 0)
+            self._usage[recorder] = nbytes
+            if self.max_bytes is None or self._total <= self.max_bytes:
+                return None
+            victim = max(self._usage, key=self._usage.get)
+            # Counted as flushed right away so the next packets don't pick it again
+            self._total -= self._usage[victim]
+            self._usage[victim] = 0
+            self.forced_flushes += 1
+        BUFFER_BUDGET_FLUSHES.inc()
+        return victim
+
+    def remove(self, recorder):
+        with self._lock:
+            self._total -= self._usage.pop(recorder, 0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "buffered_bytes": self._total,
+                "recorders": len(self._usage),
+                "forced_flushes": self.forced_flushes,
+            }
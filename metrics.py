@@ -0,0 +1,348 @@
+"""
+Process-wide metrics in the Prometheus text format, span timing and logging helpers.
+The metrics every module reports into are defined at the bottom of this file; MetricsServer
+serves them on a local HTTP endpoint for Prometheus to scrape.
+"""
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _CounterValue:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        return [("", (), self.value)]
+
+
+class _GaugeValue:
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Reads the value from `function` at scrape time instead."""
+        self.function = function
+
+    def samples(self):
+        return [("", (), self.function() if self.function is not None else self.value)]
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(list(self.buckets) + [float("inf")], counts):
+            cumulative += count
+            samples.append(("_bucket", (("le", _format_value(bound)),), cumulative))
+        samples.append(("_sum", (), total))
+        samples.append(("_count", (), cumulative))
+        return samples
+
+
+class Metric:
+    """A metric family; with label names, values are kept per label combination (see labels())."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), **options):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.options = options
+        self._values = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            # Unlabeled metrics are exported as 0 until they are first used
+            self.labels()
+
+    def labels(self, **labels):
+        """Returns the value for one label combination; keep it around on hot paths."""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        value = self._values.get(key)
+        if value is None:
+            with self._lock:
+                value = self._values.setdefault(key, self._new_value())
+        return value
+
+    def remove(self, **labels):
+        with self._lock:
+            self._values.pop(tuple(str(labels[name]) for name in self.labelnames), None)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            for suffix, extra, sample in value.samples():
+                labels = _format_labels(self.labelnames, key, extra)
+                lines.append(f"{self.name}{suffix}{labels} {_format_value(sample)}")
+        return "\n".join(lines)
+
+    def _new_value(self):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_value(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_value(self):
+        return _GaugeValue()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def _new_value(self):
+        return _HistogramValue(tuple(self.options.get("buckets") or DEFAULT_BUCKETS))
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, labelnames, **options):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **options)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=None):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+class MetricsServer:
+    """Serves the registry at http://host:port/metrics from a background thread."""
+
+    def __init__(self, registry, host="127.0.0.1", port=9108):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("metrics request: " + format, *args)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        logger.info("Serving metrics on http://%s:%d/metrics", self.host, self.server_port)
+
+    @property
+    def server_port(self):
+        return self._server.server_address[1] if self._server is not None else self.port
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class LogSampler:
+    """
+    Lets a frequent message through at most once per `interval` seconds, for log lines on hot paths
+    (e.g. once per packet or utterance). The emitted line says how many were held back.
+    """
+
+    def __init__(self, logger, interval=10.0):
+        self.logger = logger
+        self.interval = interval
+        self._last = float("-inf")
+        self._held_back = 0
+        self._lock = threading.Lock()
+
+    def log(self, level, message, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last < self.interval:
+                self._held_back += 1
+                return
+            held_back = self._held_back
+            self._held_back = 0
+            self._last = now
+        if held_back:
+            message += f" ({held_back} similar message(s) held back)"
+        self.logger.log(level, message, *args)
+
+
+_tracing = False
+
+
+def enable_tracing(enabled=True):
+    """Turns span timing on or off for the whole process."""
+    global _tracing
+    _tracing = enabled
+
+
+@contextmanager
+def span(name):
+    """Times a processing stage into notebot_span_seconds when tracing is enabled."""
+    if not _tracing:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        SPAN_SECONDS.labels(span=name).observe(elapsed)
+        logger.debug("span %s took %.1f ms", name, elapsed * 1000)
+
+
+def setup(settings):
+    """Applies the logging level and tracing settings, starts the metrics endpoint if metricsPort is set."""
+    logging.getLogger().setLevel(settings.get("logLevel", "INFO"))
+    enable_tracing(settings.get("tracing", False))
+    port = settings.get("metricsPort")
+    if port is None:
+        return None
+    server = MetricsServer(REGISTRY, settings.get("metricsHost", "127.0.0.1"), port)
+    server.start()
+    return server
+
+
+REGISTRY = MetricsRegistry()
+
+# Voice recording
+PACKETS = REGISTRY.counter("notebot_packets_total", "Voice packets received", ["speaker"])
+BUFFER_BYTES = REGISTRY.gauge("notebot_buffer_bytes", "PCM buffered and waiting for transcription", ["speaker"])
+BUFFER_BUDGET_FLUSHES = REGISTRY.counter(
+    "notebot_buffer_budget_flushes_total", "Utterances flushed early because all buffers together were over budget"
+)
+RECORDERS_EVICTED = REGISTRY.counter("notebot_recorders_evicted_total", "Recorders removed after their speaker left or went idle")
+VAD_INPUT_SECONDS = REGISTRY.counter("notebot_vad_input_seconds_total", "Seconds of audio checked by the VAD")
+VAD_KEPT_SECONDS = REGISTRY.counter("notebot_vad_kept_seconds_total", "Seconds of audio the VAD passed on")
+VAD_DROPPED_WINDOWS = REGISTRY.counter("notebot_vad_dropped_windows_total", "Windows without speech, not transcribed")
+
+# Transcription
+ASR_QUEUE_DEPTH = REGISTRY.gauge("notebot_asr_queue_depth", "Utterances waiting for a transcription worker")
+ASR_QUEUE_BYTES = REGISTRY.gauge("notebot_asr_queue_bytes", "Memory held by audio waiting for transcription")
+ASR_DROPPED = REGISTRY.counter("notebot_asr_dropped_total", "Utterances dropped because the queue was full")
+ASR_SPILLED = REGISTRY.counter("notebot_asr_spilled_total", "Utterances spilled to disk because the queue was full")
+ASR_CACHE_HITS = REGISTRY.counter("notebot_asr_cache_hits_total", "Utterances answered from the transcription cache")
+ASR_AUDIO_SECONDS = REGISTRY.counter("notebot_asr_audio_seconds_total", "Seconds of audio transcribed")
+ASR_BATCH_SECONDS = REGISTRY.histogram("notebot_asr_batch_seconds", "Time per transcription batch")
+ASR_REAL_TIME_FACTOR = REGISTRY.histogram(
+    "notebot_asr_real_time_factor",
+    "Transcription time per second of audio, per batch",
+    buckets=(0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5),
+)
+
+# Database
+MONGO_OP_SECONDS = REGISTRY.histogram(
+    "notebot_mongo_op_seconds", "MongoDB call latency", ["operation", "collection"]
+)
+MONGO_ERRORS = REGISTRY.counter("notebot_mongo_errors_total", "Failed MongoDB calls", ["operation", "collection"])
+DB_PENDING = REGISTRY.gauge("notebot_db_pending_transcriptions", "Transcriptions in the write-behind buffer")
+
+# Summarization and delivery
+SUMMARY_SECONDS = REGISTRY.histogram(
+    "notebot_summarization_seconds",
+    "Time per summarization stage",
+    ["stage"],
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 900),
+)
+SUMMARY_TOKENS = REGISTRY.counter("notebot_summarization_tokens_total", "Summarizer tokens", ["direction"])
+DM_FANOUT_SECONDS = REGISTRY.histogram("notebot_dm_fanout_seconds", "Time to DM a summary to all attendees")
+DM_FAILURES = REGISTRY.counter("notebot_dm_failures_total", "Summary DMs that could not be sent")
+
+# Event loop and tracing
+EVENT_LOOP_LAG = REGISTRY.histogram("notebot_event_loop_lag_seconds", "How late the event loop woke up")
+SPAN_SECONDS = REGISTRY.histogram("notebot_span_seconds", "Duration of traced processing stages", ["span"])
@@ -0,0 +1,71 @@
+"""
+Moves transcriptions stored in the legacy `meetings.transcriptions` array into the
+`transcriptions` collection.
+
+Usage: python3 ./migrate_transcriptions.py [--dry-run] [--keep-array]
+
+The migration is idempotent: every utterance is upserted on (meeting_id, timestamp, user),
+so it can be re-run after an interruption.
+"""
+import argparse
+import logging
+import os
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+from metrics import LOG_FORMAT
+from mongo_handler import MongoDBHandler
+
+
+def migrate_meeting(db_handler, meeting, dry_run=False, keep_array=False):
+    """Copies the transcriptions of one meeting document, returns the number of utterances."""
+    meeting_id = meeting["meeting_id"]
+    operations = []
+    for transcript in meeting.get("transcriptions", []):
+        entry = dict(transcript)
+        entry["meeting_id"] = meeting_id
+        key = {"meeting_id": meeting_id, "timestamp": entry["timestamp"], "user": entry["user"]}
+        operations.append(UpdateOne(key, {"$setOnInsert": entry}, upsert=True))
+
+    if dry_run:
+        print(f"[dry run] {meeting_id}: would migrate {len(operations)} utterance(s)")
+        return len(operations)
+
+    db_handler.bulk_write("transcriptions", operations)
+    if not keep_array:
+        db_handler.update_entry("meetings", {"meeting_id": meeting_id}, {"$unset": {"transcriptions": ""}})
+    print(f"{meeting_id}: migrated {len(operations)} utterance(s)")
+    return len(operations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move meeting transcriptions into their own collection.")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be migrated")
+    parser.add_argument("--keep-array", action="store_true", help="do not remove the array from the meeting documents")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+
+    load_dotenv()
+    db_handler = MongoDBHandler(os.getenv("MONGO_URI"), os.getenv("MONGO_DB_NAME"))
+    db_handler.ensure_indexes()
+
+    # Only meetings that still have a non-empty array, one document at a time
+    cursor = db_handler.find_entries(
+        "meetings",
+        {"transcriptions.0": {"$exists": True}},
+        projection={"meeting_id": 1, "transcriptions": 1},
+        batch_size=1,
+    )
+    meetings = 0
+    utterances = 0
+    for meeting in cursor:
+        utterances += migrate_meeting(db_handler, meeting, args.dry_run, args.keep_array)
+        meetings += 1
+
+    print(f"Done: {utterances} utterance(s) from {meetings} meeting(s).")
+    db_handler.close_connection()
+
+
+if __name__ == "__main__":
+    main()
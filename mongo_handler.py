@@ -1,19 +1,46 @@
+import functools
+import logging
+import time
 
 from pymongo import MongoClient
 
+from metrics import MONGO_ERRORS, MONGO_OP_SECONDS, LogSampler
+
+logger = logging.getLogger(__name__)
+
+
+def timed(operation):
+    """Records the latency of a handler method, whose first argument is the collection name."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, collection_name, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, collection_name, *args, **kwargs)
+            except Exception:
+                MONGO_ERRORS.labels(operation=operation, collection=collection_name).inc()
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                MONGO_OP_SECONDS.labels(operation=operation, collection=collection_name).observe(elapsed)
+        return wrapper
+    return decorator
+
+
 class MongoDBHandler:
-    def __init__(self, mongo_uri, database_name):
+    def __init__(self, mongo_uri, database_name, client=None):
         # Load MongoDB connection settings from environment variables
         self.mongo_uri = mongo_uri
         self.database_name = database_name
         
-        # Connect to MongoDB
-        self.client = MongoClient(self.mongo_uri)
+        # Connect to MongoDB (an existing client, e.g. mongomock, can be passed in for testing)
+        self.client = client if client is not None else MongoClient(self.mongo_uri)
         self.db = self.client[self.database_name]
+        self._bulk_log = LogSampler(logger)
         
         self.ping = self.client.admin.command("ping")
         if self.ping.get("ok") == 1.0:
-            print(f"Connected to MongoDB database: {self.database_name}")
+            logger.info("Connected to MongoDB database: %s", self.database_name)
         else:
             raise Exception("Authentication failed")
         
@@ -22,7 +49,7 @@ class MongoDBHandler:
         if isinstance(data, dict):
             sanitized = {}
             for key, value in data.items():
-                if key.startswith('$') and key in ['$set', '$push', '$inc', '$pull']:
+                if key.startswith('$') and key in ['$set', '$push', '$inc', '$pull', '$unset', '$addToSet']:
                     # Allow MongoDB operators
                     sanitized[key] = self.sanitize_data(value)
                 elif key.startswith('$'):
@@ -38,18 +65,60 @@ class MongoDBHandler:
 
 
 
+    def ensure_indexes(self):
+        """Creates the indexes the bot's queries rely on. Safe to call on every start."""
+        meetings = self.db["meetings"]
+        meetings.create_index([("meeting_id", 1)])
+        meetings.create_index([("end_date", 1)])
+        meetings.create_index([("start_date", -1)])
+        meetings.create_index([("guild_id", 1), ("channel_id", 1), ("end_date", 1)])
+        transcriptions = self.db["transcriptions"]
+        transcriptions.create_index([("meeting_id", 1), ("timestamp", 1)])
+        # Each speaker's utterances in the order they were spoken, merged into one transcript by MeetingReader
+        transcriptions.create_index([("meeting_id", 1), ("user_id", 1), ("start_time", 1), ("timestamp", 1)])
+        # Keyword search (SearchIndex.text_search); no stemming, meetings are in Swiss German as well as English
+        transcriptions.create_index([("transcription", "text")], default_language="none")
+        meetings.create_index([("attendees.id", 1)])
+
+    @timed("insert")
     def create_entry(self, collection_name, data):
         """Inserts a new entry into the specified collection."""
         collection = self.db[collection_name]
         result = collection.insert_one(data)
         return result.inserted_id
 
-    def read_entry(self, collection_name, query):
+    @timed("find_one")
+    def read_entry(self, collection_name, query, projection=None):
         """Finds and returns an entry based on the provided query."""
         collection = self.db[collection_name]
-        result = collection.find_one(query)
+        result = collection.find_one(query, projection)
         return result
 
+    def find_entries(self, collection_name, query, projection=None, sort=None, limit=None, batch_size=None):
+        """Returns a cursor over all entries matching the query, so large results can be streamed."""
+        collection = self.db[collection_name]
+        cursor = collection.find(query, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        return cursor
+
+    @timed("count")
+    def count_entries(self, collection_name, query):
+        """Returns the number of entries matching the query."""
+        collection = self.db[collection_name]
+        return collection.count_documents(query)
+
+    @timed("distinct")
+    def distinct_values(self, collection_name, field, query):
+        """Returns the distinct values of `field` among the entries matching the query."""
+        collection = self.db[collection_name]
+        return collection.distinct(field, query)
+
+    @timed("update")
     def update_entry(self, collection_name, query, update_data):
         """Updates an existing entry based on the provided query."""
         # Comment out sanitization to verify raw data:
@@ -58,30 +127,46 @@ class MongoDBHandler:
         collection = self.db[collection_name]
         result = collection.update_one(query, update_data)
         if result.matched_count:
-            print(f"Successfully updated {result.modified_count} entry/entries.")
+            logger.debug("Successfully updated %d entry/entries.", result.modified_count)
         else:
-            print("No matching entry found to update.")
+            logger.debug("No matching entry found to update.")
         return result.modified_count
 
+    @timed("delete")
     def delete_entry(self, collection_name, query):
         """Deletes an entry based on the provided query."""
         collection = self.db[collection_name]
         result = collection.delete_one(query)
         if result.deleted_count:
-            print(f"Successfully deleted {result.deleted_count} entry/entries.")
+            logger.debug("Successfully deleted %d entry/entries.", result.deleted_count)
         else:
-            print("No matching entry found to delete.")
+            logger.debug("No matching entry found to delete.")
         return result.deleted_count
 
+    @timed("bulk_write")
+    def bulk_write(self, collection_name, operations):
+        """Executes a list of pymongo write operations in one unordered batch."""
+        if not operations:
+            return None
+        collection = self.db[collection_name]
+        result = collection.bulk_write(operations, ordered=False)
+        self._bulk_log.log(
+            logging.INFO,
+            "Bulk write to %s: %d operation(s), %d inserted, %d upserted, %d modified.",
+            collection_name, len(operations), result.inserted_count, result.upserted_count, result.modified_count,
+        )
+        return result
+
+    @timed("find_all")
     def read_all_entries(self, collection_name):
         """Reads all entries from the specified collection."""
         collection = self.db[collection_name]
         results = collection.find()
         entries = list(results)
-        print(f"Found {len(entries)} entries.")
+        logger.debug("Found %d entries.", len(entries))
         return entries
 
     def close_connection(self):
         """Closes the MongoDB connection."""
         self.client.close()
-        print("MongoDB connection closed.")
\ No newline at end of file
+        logger.info("MongoDB connection closed.")
\ No newline at end of file
@@ -1,19 +1,36 @@
+import asyncio
 import discord
+import logging
 import os
+import threading
 import time
-import traceback
 from dotenv import load_dotenv
-from discord.ext import commands, voice_recv
+from discord.ext import commands
+from collections import defaultdict
 from datetime import datetime
 import json
 from mongo_handler import MongoDBHandler
-from voice_recorder import VoiceRecorder
-from setup_model import setup_whisper_model
+from async_mongo_handler import AsyncMongoDBHandler
+from meeting_cache import ActiveMeeting, ActiveMeetingCache
+from meeting_session import MeetingSession, PendingTranscriptions
+from audio_archiver import AudioArchiver
+from memory_budget import BufferBudget
+from inference_pool import ProcessInferenceBackend, load_inference_backend
+from transcription_scheduler import TranscriptionScheduler
+from transcription_cache import TranscriptionCache
+from silence_scheduler import SilenceScheduler
 from meeting_reader import MeetingReader
+from search_index import SearchIndex
+from processing_pipeline import EventLoopLagProbe, ProcessingPipeline
+from startup_timer import StartupTimer
+import metrics
+from metrics import DM_FAILURES, DM_FANOUT_SECONDS, LogSampler
 
-load_dotenv()
+logger = logging.getLogger(__name__)
+
+startup_timer = StartupTimer()
 
-discord.opus._load_default()
+load_dotenv()
 
 bot = commands.Bot(
     command_prefix=commands.when_mentioned, intents=discord.Intents.all()
@@ -21,19 +38,46 @@ bot = commands.Bot(
 
 
 class NoteBot(commands.Cog):
-    def __init__(self, bot):
+    def __init__(self, bot, settings=None, db_handler=None, model_pipeline=None, summary_backend=None):
+        """
+        The optional arguments replace the settings file, the MongoDB connection from the environment
+        and the models, e.g. with stubs in benchmarks.
+        """
         self.bot = bot
-        self.meeting_id = None
-        self.recorders = {}
+        self.sessions = {}  # (guild id, channel id) -> MeetingSession
+        self.active_meetings = ActiveMeetingCache()
+        # Join events of one channel are handled one at a time, so a burst of joins starts only one meeting
+        self._join_locks = defaultdict(asyncio.Lock)  # (guild id, channel id) -> asyncio.Lock
 
-        self.db_handler = MongoDBHandler(
+        self.db_handler = db_handler or MongoDBHandler(
             os.getenv("MONGO_URI"), os.getenv("MONGO_DB_NAME")
         )
 
-        with open("./settings.json", "r") as file:
-            self.settings = json.load(file)
+        if settings is None:
+            with open("./settings.json", "r") as file:
+                settings = json.load(file)
+        self.settings = settings
+        # Logging level, tracing and the Prometheus endpoint (off unless metricsPort is set)
+        self.metrics_server = metrics.setup(self.settings)
+        self._voice_state_log = LogSampler(logger, self.settings.get("logSampleSeconds", 10))
+
+        # Blocking work (database, transcription, summarization) never runs on the event loop
+        self.pipeline = ProcessingPipeline(self.settings)
+        self.loop_probe = EventLoopLagProbe()
+
+        # Event-loop facing handler, the blocking one above stays with the MeetingReader
+        self.db = AsyncMongoDBHandler.from_settings(
+            self.db_handler, self.settings, executor=self.pipeline.executors["db"]
+        )
 
-        self.meeting_reader = MeetingReader(self.db_handler, self.settings)
+        self.meeting_reader = MeetingReader(
+            self.db_handler, self.settings, summary_backend, written_seq=self.db.written_seq
+        )
+        # Keep the rolling summaries up to date as transcriptions are written
+        self.db.add_flush_listener(self.meeting_reader.note_transcriptions)
+        # ...and the search index
+        self.search_index = SearchIndex.from_settings(self.db_handler, self.settings)
+        self.db.add_flush_listener(self.search_index.note_transcriptions)
 
         if (
             self.settings.get("saveAudio")
@@ -41,228 +85,374 @@ class NoteBot(commands.Cog):
         ):
             # Ensure the recordings directory exists
             os.makedirs(self.settings.get("audioPath"), exist_ok=True)
-
-        self.whisper_pipeline = setup_whisper_model(self.settings.get("model_id"), self.settings.get("device"))
+            # Recordings are compressed and written in the background, off the transcription path
+            self.archiver = AudioArchiver.from_settings(self.settings)
+            self.archiver.start()
+        else:
+            self.archiver = None
+
+        # Caps the audio buffered by all speakers together, on top of maxUtteranceSeconds per speaker
+        self.buffer_budget = BufferBudget.from_settings(self.settings)
+        # Utterances cut from the buffers but not saved yet, per meeting
+        self.pending_transcriptions = PendingTranscriptions()
+
+        transcription_cache = None
+        if self.settings.get("transcriptionCacheSize", 0) > 0:
+            transcription_cache = TranscriptionCache.from_settings(self.settings)
+        # The model is loaded in the background, utterances queue up in the scheduler until it is ready
+        self.whisper_pipeline = None
+        self.transcription_scheduler = TranscriptionScheduler(None, self.settings, cache=transcription_cache)
+        self.transcription_scheduler.add_batch_listener(lambda batch: startup_timer.mark("first transcription"))
+        self.transcription_scheduler.start()
+        if model_pipeline is not None:
+            self.whisper_pipeline = model_pipeline
+            self.transcription_scheduler.set_model(model_pipeline)
+        else:
+            threading.Thread(target=self.load_transcription_model, name="model-loader", daemon=True).start()
+        self.silence_scheduler = SilenceScheduler(
+            self.settings.get("silenceTimeout", 5.0), self.settings.get("logSampleSeconds", 10)
+        )
+        self.silence_scheduler.start()
         self.minimumMeetingParticipants = self.settings.get("minimumMeetingParticipants", 2)
 
-    def create_meeting_entry(self, meeting_id, attendees, start_date, end_date):
+    def load_transcription_model(self):
+        """Loads the Whisper model and hands it to the transcription scheduler once it is ready."""
+        try:
+            whisper_pipeline = load_inference_backend(self.settings)
+        except Exception:
+            logger.exception("Failed to load the transcription model")
+            return
+
+        self.whisper_pipeline = whisper_pipeline
+        self.transcription_scheduler.set_model(whisper_pipeline)
+        startup_timer.mark("transcription model ready")
+
+    async def cog_load(self):
+        await self.pipeline.run("db", self.db_handler.ensure_indexes)
+        # Warm the active meeting cache so join/leave events don't have to query the database
+        await self.active_meetings.load(self.db)
+        self.loop_probe.start()
+        # Load the summarizer before the first meeting ends, without blocking startup
+        self.pipeline.executors["summarization"].submit(self.meeting_reader.load_summarizer)
+        # Loads the embedding index (if enabled) and indexes transcriptions it hasn't seen yet
+        self.search_index.start()
+
+    async def cog_unload(self):
+        await self.loop_probe.stop()
+        # Producers first: utterances that are transcribed now still reach the database below
+        self.silence_scheduler.stop()
+        await asyncio.to_thread(self.transcription_scheduler.stop)
+        # Writes what is left in the write-behind buffer and shuts down the db executor
+        await asyncio.to_thread(self.db.close)
+        await self.pipeline.shutdown()
+        self.meeting_reader.close()
+        self.search_index.close()
+        if self.archiver is not None:
+            self.archiver.close()
+            logger.info("Audio archive: %s", self.archiver.stats())
+        if isinstance(self.whisper_pipeline, ProcessInferenceBackend):
+            self.whisper_pipeline.close()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        logger.info("Event loop lag: %s", self.loop_probe.stats())
+        logger.info("Startup timing: %s", startup_timer.stats())
+
+    def get_session(self, voice_channel):
+        """Returns the session of a voice channel, creating it on first use."""
+        key = (voice_channel.guild.id, voice_channel.id)
+        session = self.sessions.get(key)
+        if session is None:
+            session = MeetingSession(
+                voice_channel.guild.id,
+                voice_channel.id,
+                self.transcription_scheduler,
+                self.silence_scheduler,
+                self.settings,
+                self.db,
+                self.archiver,
+                self.buffer_budget,
+                self.pending_transcriptions,
+            )
+            self.sessions[key] = session
+        return session
+
+    async def create_meeting_entry(self, meeting_id, voice_channel, attendees, start_date, end_date):
         """Creates a meeting entry in the MongoDB database."""
         data = {
             "meeting_id": meeting_id,
+            "guild_id": voice_channel.guild.id,
+            "channel_id": voice_channel.id,
             "attendees": attendees,
             "start_date": start_date,
             "end_date": end_date,
-            "transcriptions": []
         }
-        self.db_handler.create_entry("meetings", data)
-        self.meeting_id = meeting_id
-        print(f"Meeting entry created: {meeting_id}")
+        await self.db.create_entry("meetings", data)
+        active_meeting = ActiveMeeting.from_document(data)
+        self.active_meetings.start(active_meeting)
+        logger.info("Meeting entry created: %s", meeting_id)
+        return active_meeting
 
     async def connect_to_existing_calls(self):
         for guild in self.bot.guilds:
-            for member in guild.members:
-                # Check if the member is in a voice channel and is not a bot
-                if member.voice is not None and not member.bot:
-                    voice_channel = member.voice.channel
-                    if guild.voice_client is None:
-                        try:
-                            # Connect to the user's voice channel if not already connected
-                            vc = await voice_channel.connect(
-                                cls=voice_recv.VoiceRecvClient
-                            )
-                            print(
-                                f"Bot connected to {voice_channel.name} (user already in channel)"
-                            )
-
-                            # Define the callback to handle received voice packets
-                            def callback(user, data: voice_recv.VoiceData):
-                                if user is None:
-                                    return
-
-                                if user.id not in self.recorders:
-                                    self.recorders[user.id] = VoiceRecorder(
-                                        user, self.meeting_id, self.whisper_pipeline, self.settings, self.db_handler
-                                    )
-                                recorder = self.recorders[user.id]
-                                recorder.add_packet(data.pcm)
-
-                            vc.listen(voice_recv.BasicSink(callback))
-                        except discord.ClientException as e:
-                            print(f"Error connecting to the voice channel: {e}")
-                        except Exception as e:
-                            print(f"An unexpected error occurred: {e}")
-                            traceback.print_exc()
+            if guild.voice_client is not None:
+                continue
+            voice_channel = self._channel_to_rejoin(guild)
+            if voice_channel is None:
+                continue
+
+            # Same path as members joining: resumes the cached meeting or starts one, never records without
+            try:
+                for member in [m for m in voice_channel.members if not m.bot]:
+                    await self.handle_join(member, voice_channel)
+                if guild.voice_client is not None:
+                    logger.info("Rejoined %s (users already in channel)", voice_channel.name)
+            except Exception:
+                logger.exception("Error rejoining %s", voice_channel.name)
+
+    def _channel_to_rejoin(self, guild):
+        """The channel whose meeting is still running, otherwise the first with enough people for a new one."""
+        occupied = [c for c in guild.voice_channels if any(not m.bot for m in c.members)]
+        for voice_channel in occupied:
+            if self.active_meetings.get(guild.id, voice_channel.id) is not None:
+                return voice_channel
+        for voice_channel in occupied:
+            if sum(not m.bot for m in voice_channel.members) >= self.minimumMeetingParticipants:
+                return voice_channel
+        return None
+
+    @commands.command(name="search")
+    async def search(self, ctx, *, query: str):
+        """Searches the meetings you attended, e.g. `@NoteBot search when is the deadline`. Results come as a DM."""
+        hits = await self.pipeline.run(
+            "db", self.search_index.search, query, ctx.author.id, self.settings.get("searchResults", 5)
+        )
+        if not hits:
+            message_content = f"Nothing found for \"{query}\"."
+        else:
+            lines = [f"**Results for \"{query}\":**"]
+            for hit in hits:
+                date_str = hit["meeting_start"].strftime("%d.%m.%Y") if hit["meeting_start"] else "unknown date"
+                text = hit["transcription"] if len(hit["transcription"]) <= 200 else hit["transcription"][:200] + "…"
+                lines.append(f"- **{hit['meeting_title']}** ({date_str}) {hit['user']}: \"{text}\"")
+            message_content = "\n".join(lines)[:2000]
+
+        # Transcripts only go to the person asking, not to everyone in the channel
+        try:
+            await ctx.author.send(message_content)
+        except discord.Forbidden:
+            await ctx.reply("I can't send you a DM, please allow direct messages from server members.")
+            return
+        if ctx.guild is not None:
+            await ctx.reply("Sent you the results.")
 
     @commands.Cog.listener()
     async def on_voice_state_update(self, member, before, after):
-        print(f"Voice state update detected for {member.name}")
+        self._voice_state_log.log(logging.DEBUG, "Voice state update detected for %s", member.name)
         if member.bot:
             return
 
-        voice_client = member.guild.voice_client
-
-        # Check if the user joined a voice channel
-        if before.channel is None and after.channel is not None:
-            voice_channel = after.channel
-
-            # Count non-bot members currently in the channel
-            non_bot_members = [m for m in voice_channel.members if not m.bot]
-
-            # Check for active meeting
-            active_meeting = self.db_handler.read_entry("meetings", {"end_date": None})
-            if active_meeting:
-                # Meeting already exists and is ongoing
-                self.meeting_id = active_meeting["meeting_id"]
-                print(f"Reconnected to active meeting: {self.meeting_id}")
-
-                # Check if new attendee is already in the meeting's attendee list
-                attendees = active_meeting.get("attendees", [])
-                if not any(a["id"] == member.id for a in attendees):
-                    # Add the new user to attendees
-                    attendees.append({"id": member.id, "name": member.name})
-                    self.db_handler.update_entry(
-                        "meetings",
-                        {"meeting_id": self.meeting_id},
-                        {"$set": {"attendees": attendees}}
-                    )
-                    print(f"Added new attendee {member.name} to meeting {self.meeting_id}")
-
-                # If the bot is disconnected, connect now
-                if voice_client is None:
-                    try:
-                        vc = await voice_channel.connect(cls=voice_recv.VoiceRecvClient)
-                        print(f"Bot connected to {voice_channel.name}")
-
-                        def callback(user, data: voice_recv.VoiceData):
-                            if user is None:
-                                return
-                            if user.id not in self.recorders:
-                                self.recorders[user.id] = VoiceRecorder(
-                                    user, self.meeting_id, self.whisper_pipeline, self.settings, self.db_handler
-                                )
-                            recorder = self.recorders[user.id]
-                            recorder.add_packet(data.pcm)
-
-                        vc.listen(voice_recv.BasicSink(callback))
-
-                    except Exception as e:
-                        print(f"Error handling voice channel join: {e}")
-                        traceback.print_exc()
-            else:
-                # No active meeting. Check if we have enough participants to start one.
-                if len(non_bot_members) >= self.minimumMeetingParticipants:
-                    # Create a new meeting
-                    try:
-                        meeting_id = f"meeting_{int(time.time())}"
-                        # Store both user id and name for each attendee
-                        attendees = [{"id": m.id, "name": m.name} for m in non_bot_members]
-                        start_date = datetime.now()
-                        end_date = None
-                        self.create_meeting_entry(meeting_id, attendees, start_date, end_date)
-                        print(f"New meeting '{meeting_id}' created.")
-
-                        # Connect to the voice channel
-                        vc = await voice_channel.connect(cls=voice_recv.VoiceRecvClient)
-                        print(f"Bot connected to {voice_channel.name}")
-
-                        def callback(user, data: voice_recv.VoiceData):
-                            if user is None:
-                                return
-
-                            if user.id not in self.recorders:
-                                self.recorders[user.id] = VoiceRecorder(
-                                    user, self.meeting_id, self.whisper_pipeline, self.settings, self.db_handler
-                                )
-
-                            recorder = self.recorders[user.id]
-                            recorder.add_packet(data.pcm)
-
-                        vc.listen(voice_recv.BasicSink(callback))
-
-                    except Exception as e:
-                        print(f"Error handling voice channel join: {e}")
-                        traceback.print_exc()
-                else:
-                    # Not enough participants to start a new meeting; do nothing and don't join
-                    print(f"Not enough participants to start a meeting. Need at least {self.minimumMeetingParticipants}, have {len(non_bot_members)}. Waiting...")
-
-        # Check if the bot should disconnect after any voice state update
-        if voice_client is not None:
-            voice_channel = voice_client.channel
-            # Get a list of non-bot members currently in the voice channel
-            non_bot_members = [m for m in voice_channel.members if not m.bot]
-
-            if len(non_bot_members) == 0:
-                # No non-bot members left in the voice channel; disconnect the bot
-                try:
-                    end_date = datetime.now()
-                    active_meetings = self.db_handler.read_all_entries("meetings")
-                    # Sort by newest start_date and update the latest meeting
-                    latest_meeting = max(
-                        active_meetings, key=lambda m: m["start_date"], default=None
-                    )
-
-                    await voice_client.disconnect()
-
-                    if latest_meeting:
-                        self.db_handler.update_entry(
-                            "meetings",
-                            {"meeting_id": latest_meeting['meeting_id']},
-                            {"$set": {"end_date": end_date}}
-                        )
-
-                        # Read meeting transcripts and summarize
-                        self.meeting_reader.read_meeting_transcripts(latest_meeting['meeting_id'])
-
-                        # After summarizing, fetch the updated meeting document with title and summary
-                        updated_meeting = self.db_handler.read_entry(
-                            "meetings", {"meeting_id": latest_meeting['meeting_id']}
-                        )
-
-                        # Prepare the DM message
-                        meeting_title = updated_meeting.get("meeting_title", "Meeting Summary")
-                        meeting_summary = updated_meeting.get("summary", "No summary available.")
-                        start_date_str = updated_meeting["start_date"].strftime("%d.%m.%Y %H:%M")
-                        if updated_meeting["end_date"]:
-                            end_date_str = updated_meeting["end_date"].strftime("%H:%M")
-                        else:
-                            end_date_str = "Ongoing"
-                        attendees = updated_meeting.get("attendees", [])
-                        attendee_names = ", ".join([a["name"] for a in attendees])
-
-                        message_content = (
-                            f"# {meeting_title}\n"
-                            f"**Date:** {start_date_str} - {end_date_str}\n"
-                            f"**Attendees:** {attendee_names}\n"
-                            f"**Summary:**\n{meeting_summary}"
-                        )
-
-                        # Send DMs to attendees
-                        for att in attendees:
-                            member = voice_channel.guild.get_member(att["id"])
-                            if member is not None:
-                                try:
-                                    await member.send(message_content)
-                                    print(f"Sent meeting summary to {member.name}")
-                                except Exception as e:
-                                    print(f"Failed to send DM to {member.name}: {e}")
-
-                    self.meeting_id = None
-                    print(
-                        f"Bot disconnected from {voice_channel.name} because no users are left."
-                    )
-                except Exception as e:
-                    print(f"Error disconnecting the bot: {e}")
-                    traceback.print_exc()
+        # Check if the user joined (or moved to) a voice channel
+        if after.channel is not None and after.channel != before.channel:
+            await self.handle_join(member, after.channel)
+
+        # Check if the channel the user left should be closed
+        if before.channel is not None and before.channel != after.channel:
+            session = self.sessions.get((before.channel.guild.id, before.channel.id))
+            if session is not None:
+                # Transcribe what they said last and free their buffer; can wait on a full transcription queue
+                await asyncio.to_thread(session.release_recorder, member.id)
+            await self.handle_leave(before.channel)
+
+    async def handle_join(self, member, voice_channel):
+        # The check for an active meeting and its creation must not interleave with another join
+        async with self._join_locks[(voice_channel.guild.id, voice_channel.id)]:
+            await self._handle_join(member, voice_channel)
+
+    async def _handle_join(self, member, voice_channel):
+        guild_id = voice_channel.guild.id
+
+        # Count non-bot members currently in the channel
+        non_bot_members = [m for m in voice_channel.members if not m.bot]
+
+        # Check for active meeting in this channel (served from the cache, no database read)
+        active_meeting = self.active_meetings.get(guild_id, voice_channel.id)
+        if active_meeting is None:
+            active_meeting = self.active_meetings.adopt_legacy(guild_id, voice_channel.id)
+            if active_meeting is not None:
+                await self.db.update_entry(
+                    "meetings",
+                    {"meeting_id": active_meeting.meeting_id},
+                    {"$set": {"guild_id": guild_id, "channel_id": voice_channel.id}}
+                )
+
+        if active_meeting:
+            # Meeting already exists and is ongoing
+            session = self.get_session(voice_channel)
+            session.set_meeting(active_meeting)
+            logger.debug("Reconnected to active meeting: %s", active_meeting.meeting_id)
+
+            # Check if new attendee is already in the meeting's attendee list
+            if self.active_meetings.add_attendee(active_meeting, member):
+                # Add the new user to attendees
+                await self.db.update_entry(
+                    "meetings",
+                    {"meeting_id": active_meeting.meeting_id},
+                    {"$addToSet": {"attendees": {"id": member.id, "name": member.name}}}
+                )
+                logger.info("Added new attendee %s to meeting %s", member.name, active_meeting.meeting_id)
+
+            # If the bot is disconnected, connect now
+            try:
+                await session.connect(voice_channel)
+            except Exception:
+                logger.exception("Error handling voice channel join")
+
+        elif len(non_bot_members) >= self.minimumMeetingParticipants:
+            # No active meeting, but enough participants to start one
+            session = self.get_session(voice_channel)
+            try:
+                # Connect to the voice channel first, a meeting that can't be recorded would never be ended.
+                # Discord allows one voice connection per guild, so this fails while another channel is recorded.
+                if not await session.connect(voice_channel):
+                    self.sessions.pop(session.key, None)
+                    return
+
+                meeting_id = f"meeting_{guild_id}_{voice_channel.id}_{int(time.time())}"
+                # Store both user id and name for each attendee
+                attendees = [{"id": m.id, "name": m.name} for m in non_bot_members]
+                start_date = datetime.now()
+                end_date = None
+                active_meeting = await self.create_meeting_entry(
+                    meeting_id, voice_channel, attendees, start_date, end_date
+                )
+                logger.info("New meeting '%s' created.", meeting_id)
+                # Recorders created for packets that arrived in the meantime follow along
+                session.set_meeting(active_meeting)
+
+            except Exception:
+                logger.exception("Error handling voice channel join")
+                if session.meeting is None:
+                    # Don't record without a meeting to save the transcriptions to
+                    await session.disconnect()
+                    self.sessions.pop(session.key, None)
+        else:
+            # Not enough participants to start a new meeting; do nothing and don't join
+            logger.info(
+                "Not enough participants to start a meeting. Need at least %d, have %d. Waiting...",
+                self.minimumMeetingParticipants, len(non_bot_members),
+            )
+
+    async def handle_leave(self, voice_channel):
+        session = self.sessions.get((voice_channel.guild.id, voice_channel.id))
+        if session is None or session.voice_client is None:
+            return
+
+        # Get a list of non-bot members currently in the voice channel
+        non_bot_members = [m for m in voice_channel.members if not m.bot]
+        if len(non_bot_members) == 0:
+            # No non-bot members left in the voice channel; disconnect the bot
+            try:
+                await self.end_session(session, voice_channel)
+                logger.info("Bot disconnected from %s because no users are left.", voice_channel.name)
+            except Exception:
+                logger.exception("Error disconnecting the bot")
+
+    async def end_session(self, session, voice_channel):
+        """Disconnects from the channel, closes its meeting and hands the summary off to the background."""
+        end_date = datetime.now()
+        # The meeting of this channel, taken out of the active meeting cache
+        latest_meeting = self.active_meetings.end(session.guild_id, session.channel_id)
+
+        await session.disconnect()
+        self.sessions.pop(session.key, None)
+
+        if latest_meeting:
+            if self.archiver is not None:
+                self.archiver.close_meeting(latest_meeting.meeting_id)
+            await self.db.update_entry(
+                "meetings",
+                {"meeting_id": latest_meeting.meeting_id},
+                {"$set": {"end_date": end_date}}
+            )
+
+            # Summarizing can take minutes, don't hold up the voice state handler for it
+            self.pipeline.spawn(
+                latest_meeting.meeting_id,
+                self.send_meeting_summary(latest_meeting.meeting_id, voice_channel.guild),
+            )
+
+    async def send_meeting_summary(self, meeting_id, guild):
+        """Summarizes a finished meeting on the summarization pool and DMs the result to its attendees."""
+        # The last utterances were only just submitted, wait until they are transcribed...
+        timeout = self.settings.get("summarizationTimeout", 900)
+        if not await asyncio.to_thread(self.pending_transcriptions.wait, meeting_id, timeout):
+            logger.warning(
+                "Summarizing %s without %d utterance(s) that are still being transcribed",
+                meeting_id, self.pending_transcriptions.count(meeting_id),
+            )
+        # ...and make sure buffered transcriptions are stored before summarizing
+        await self.db.flush()
+
+        # Read meeting transcripts and summarize
+        await self.pipeline.run("summarization", self.meeting_reader.read_meeting_transcripts, meeting_id)
+
+        # After summarizing, fetch the updated meeting document with title and summary
+        updated_meeting = await self.db.read_entry(
+            "meetings", {"meeting_id": meeting_id}, {"transcriptions": 0}
+        )
+
+        # Prepare the DM message
+        meeting_title = updated_meeting.get("meeting_title", "Meeting Summary")
+        meeting_summary = updated_meeting.get("summary", "No summary available.")
+        start_date_str = updated_meeting["start_date"].strftime("%d.%m.%Y %H:%M")
+        if updated_meeting["end_date"]:
+            end_date_str = updated_meeting["end_date"].strftime("%H:%M")
+        else:
+            end_date_str = "Ongoing"
+        attendees = updated_meeting.get("attendees", [])
+        attendee_names = ", ".join([a["name"] for a in attendees])
+
+        message_content = (
+            f"# {meeting_title}\n"
+            f"**Date:** {start_date_str} - {end_date_str}\n"
+            f"**Attendees:** {attendee_names}\n"
+            f"**Summary:**\n{meeting_summary}"
+        )
+
+        # Send DMs to attendees concurrently
+        async def send_dm(member):
+            try:
+                await member.send(message_content)
+                logger.debug("Sent meeting summary to %s", member.name)
+            except Exception as e:
+                DM_FAILURES.inc()
+                logger.warning("Failed to send DM to %s: %s", member.name, e)
+
+        members = [guild.get_member(att["id"]) for att in attendees]
+        members = [member for member in members if member is not None]
+        start = time.perf_counter()
+        await asyncio.gather(*(send_dm(member) for member in members))
+        DM_FANOUT_SECONDS.observe(time.perf_counter() - start)
+        logger.info("Sent the summary of %s to %d attendee(s)", meeting_id, len(members))
 
 
 @bot.event
 async def on_ready():
-    print("Logged in as {0.id}/{0}".format(bot.user))
-    print("------")
+    logger.info("Logged in as %s/%s", bot.user.id, bot.user)
+    startup_timer.mark("logged in")
+    # on_ready fires again after every reconnect, the cog only needs to be set up once
+    if bot.get_cog("NoteBot") is not None:
+        return
     note_bot = NoteBot(bot)
     await bot.add_cog(note_bot)
+    startup_timer.mark("handling events")
     await note_bot.connect_to_existing_calls()
+    startup_timer.mark("calls rejoined")
 
 
-bot.run(os.getenv("DISCORD_BOT_TOKEN"))
\ No newline at end of file
+# Guarded so that worker processes (which re-import this module when spawned) don't start the bot
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format=metrics.LOG_FORMAT)
+    discord.opus._load_default()
+    # Logging is set up above, discord.py's own handler would print every line twice
+    bot.run(os.getenv("DISCORD_BOT_TOKEN"), log_handler=None)
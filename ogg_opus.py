@@ -0,0 +1,118 @@
+import random
+import struct
+
+OPUS_SAMPLE_RATE = 48000
+# Samples the decoder drops at the start of a stream, the encoder lookahead of libopus at 48 kHz
+PRE_SKIP = 312
+
+# Frame durations in samples at 48 kHz, indexed by the TOC configuration (RFC 6716, section 3.1)
+_FRAME_SAMPLES = (
+    [480, 960, 1920, 2880] * 3  # SILK: 10, 20, 40, 60 ms
+    + [480, 960] * 2  # Hybrid: 10, 20 ms
+    + [120, 240, 480, 960] * 4  # CELT: 2.5, 5, 10, 20 ms
+)
+
+
+def _crc_table():
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def ogg_crc(data):
+    """The CRC-32 variant Ogg uses: polynomial 0x04C11DB7, no reflection, zero initial value."""
+    crc = 0
+    table = _CRC_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ table[(crc >> 24) ^ byte]
+    return crc
+
+
+def opus_packet_samples(packet):
+    """Returns how many 48 kHz samples an Opus packet decodes to, read from its TOC byte."""
+    if not packet:
+        return 0
+    toc = packet[0]
+    frame_samples = _FRAME_SAMPLES[toc >> 3]
+    code = toc & 0x03
+    if code == 0:
+        frames = 1
+    elif code in (1, 2):
+        frames = 2
+    else:
+        frames = packet[1] & 0x3F if len(packet) > 1 else 0
+    return frame_samples * frames
+
+
+class OggOpusWriter:
+    """
+    Writes Opus packets into an Ogg Opus stream (RFC 7845) without re-encoding them.
+    Packets are collected into pages of about `page_packets` packets, so the file on disk grows
+    as the meeting goes on and stays readable up to the last written page.
+    """
+
+    def __init__(self, file, channels=2, page_packets=50, vendor="NoteBot"):
+        self.file = file
+        self.page_packets = page_packets
+        self.serial = random.getrandbits(32)
+        self.sequence = 0
+        # Samples of all packets written so far. The pre-skip is part of this count (RFC 7845, section 4),
+        # decoders subtract it themselves, so the first 20 ms packet ends at granule 960
+        self.granule = 0
+        self._segments = []
+        self._packets = []
+        self._closed = False
+
+        head = struct.pack("<8sBBHIhB", b"OpusHead", 1, channels, PRE_SKIP, OPUS_SAMPLE_RATE, 0, 0)
+        vendor = vendor.encode()
+        tags = b"OpusTags" + struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", 0)
+        self._write_page([head], granule=0, header_type=0x02)
+        self._write_page([tags], granule=0)
+
+    def write_packet(self, packet, samples=None):
+        """Adds one Opus packet; `samples` is read from the packet when not given."""
+        if samples is None:
+            samples = opus_packet_samples(packet)
+        segments = len(packet) // 255 + 1
+        if self._packets and (len(self._segments) + segments > 255 or len(self._packets) >= self.page_packets):
+            self.flush()
+        self._packets.append(packet)
+        self._segments.extend([255] * (len(packet) // 255) + [len(packet) % 255])
+        self.granule += samples
+
+    def flush(self):
+        """Writes the collected packets as one page."""
+        if self._packets:
+            self._write_page(self._packets, self.granule, segments=self._segments)
+            self._packets = []
+            self._segments = []
+
+    def close(self):
+        """Writes the last page with the end-of-stream flag set."""
+        if self._closed:
+            return
+        self._write_page(self._packets, self.granule, header_type=0x04, segments=self._segments)
+        self._packets = []
+        self._segments = []
+        self._closed = True
+        self.file.flush()
+
+    def _write_page(self, packets, granule, header_type=0, segments=None):
+        if segments is None:
+            segments = []
+            for packet in packets:
+                segments.extend([255] * (len(packet) // 255) + [len(packet) % 255])
+        header = struct.pack(
+            "<4sBBqIIIB", b"OggS", 0, header_type, granule, self.serial, self.sequence, 0, len(segments)
+        )
+        page = bytearray(header + bytes(segments) + b"".join(packets))
+        struct.pack_into("<I", page, 22, ogg_crc(page))
+        self.file.write(page)
+        self.sequence += 1
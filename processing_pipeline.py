@@ -0,0 +1,121 @@
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import EVENT_LOOP_LAG
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessingPipeline:
+    """
+    Event-loop facing front end for all blocking work.
+    Database calls and summarization run on their own thread pools (transcription has its own
+    TranscriptionScheduler, fed from the voice threads). Every call has a timeout, and background
+    jobs are tracked per key (e.g. a meeting, which names them in the log) so shutdown can cancel them.
+    """
+
+    def __init__(self, settings):
+        self.executors = {
+            "db": ThreadPoolExecutor(max_workers=settings.get("dbWorkers", 4), thread_name_prefix="db"),
+            "summarization": ThreadPoolExecutor(
+                max_workers=settings.get("summarizationWorkers", 1), thread_name_prefix="summarization"
+            ),
+        }
+        self.timeouts = {
+            "db": settings.get("dbTimeout", 30),
+            "summarization": settings.get("summarizationTimeout", 900),
+        }
+        self._tasks = {}  # key -> set of asyncio tasks
+
+    async def run(self, stage, fn, *args, timeout=None, **kwargs):
+        """
+        Runs a blocking function on the stage's executor and waits for it without blocking the loop.
+        On timeout or cancellation a job that has not started yet is dropped; one that is already
+        running finishes in the background and its result is discarded.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executors[stage], functools.partial(fn, *args, **kwargs))
+        timeout = timeout if timeout is not None else self.timeouts[stage]
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            logger.warning("%s job %s timed out after %ss", stage, getattr(fn, '__name__', fn), timeout)
+            raise
+
+    def spawn(self, key, coroutine):
+        """Starts a background task for `key`; errors are logged instead of being lost."""
+        task = asyncio.create_task(coroutine)
+        tasks = self._tasks.setdefault(key, set())
+        tasks.add(task)
+
+        def done(task):
+            tasks.discard(task)
+            if not tasks:
+                self._tasks.pop(key, None)
+            if not task.cancelled() and task.exception() is not None:
+                error = task.exception()
+                logger.error("Background job for %s failed: %s", key, error, exc_info=error)
+
+        task.add_done_callback(done)
+        return task
+
+    async def shutdown(self):
+        tasks = [task for tasks in self._tasks.values() for task in tasks]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for executor in self.executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+class EventLoopLagProbe:
+    """
+    Measures how long the event loop is stalled: a task sleeps for `interval` seconds and records
+    how much later than requested it wakes up.
+    """
+
+    def __init__(self, interval=0.1, warn_after=0.25):
+        self.interval = interval
+        self.warn_after = warn_after
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.record(time.perf_counter() - start - self.interval)
+
+    def record(self, lag):
+        lag = max(0.0, lag)
+        self.samples += 1
+        self.total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+        EVENT_LOOP_LAG.observe(lag)
+        if lag >= self.warn_after:
+            self.stalls += 1
+            logger.warning("Event loop stalled for %.0f ms", lag * 1000)
+
+    def stats(self):
+        return {
+            "samples": self.samples,
+            "mean_lag": self.total_lag / self.samples if self.samples else 0.0,
+            "max_lag": self.max_lag,
+            "stalls": self.stalls,
+        }
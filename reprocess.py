@@ -0,0 +1,284 @@
+"""
+Re-transcribes saved recordings and re-summarizes stored meetings, e.g. after switching
+`model_id` or `summarizer_model_id`.
+
+Usage:
+    python3 ./reprocess.py transcribe [--model-id ID] [--meeting MEETING_ID ...] [--force]
+    python3 ./reprocess.py summarize [--summarizer-model-id ID] [--meeting MEETING_ID ...] [--force]
+
+Every rewritten document records the model that produced it (`transcription_model` on
+transcriptions, `summary_model` on meetings), and documents that already carry the target model
+are skipped. An interrupted run therefore resumes where it stopped, the last written bulk being
+the checkpoint. Settings not given on the command line are read from settings.json.
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+from inference_pool import ProcessInferenceBackend, load_inference_backend
+from metrics import LOG_FORMAT
+from mongo_handler import MongoDBHandler
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+READ_SIZE = 64 * 1024
+
+
+def decode_audio(path, offset=None, duration=None):
+    """Streams a recording through ffmpeg and returns it as 16 kHz mono float32."""
+    command = ["ffmpeg", "-nostdin", "-v", "error"]
+    if offset:
+        command += ["-ss", str(offset)]
+    command += ["-i", path]
+    if duration:
+        command += ["-t", str(duration)]
+    command += ["-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-"]
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    chunks = []
+    while True:
+        chunk = process.stdout.read(READ_SIZE)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    error = process.stderr.read().decode(errors="replace").strip()
+    if process.wait() != 0:
+        raise RuntimeError(f"ffmpeg could not decode {path}: {error}")
+    return np.frombuffer(b"".join(chunks), dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def iter_pages(db_handler, collection_name, query, projection, page_size):
+    """
+    Yields the matching documents in _id order, one fresh query per page. A single cursor would sit
+    idle between getMores while the slow work catches up, and the server drops it after 10 minutes.
+    """
+    last_id = None
+    while True:
+        page_query = dict(query, _id={"$gt": last_id}) if last_id is not None else query
+        page = list(db_handler.find_entries(
+            collection_name, page_query, projection=projection, sort=[("_id", 1)], limit=page_size
+        ))
+        yield from page
+        if len(page) < page_size:
+            return
+        last_id = page[-1]["_id"]
+
+
+def bounded_map(executor, fn, items, limit):
+    """Like executor.map, but keeps at most `limit` items in flight so a long input is not read ahead."""
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class ThroughputReport:
+    """Counts processed items and media time against wall time."""
+
+    def __init__(self, unit):
+        self.unit = unit
+        self.start = time.perf_counter()
+        self.items = 0
+        self.failed = 0
+        self.media_seconds = 0.0
+
+    def add(self, media_seconds):
+        self.items += 1
+        self.media_seconds += media_seconds
+
+    def line(self):
+        wall_seconds = time.perf_counter() - self.start
+        rate = self.media_seconds / wall_seconds if wall_seconds else 0.0
+        return (
+            f"{self.items} {self.unit} ({self.failed} failed), {self.media_seconds / 3600:.2f} audio-hours "
+            f"in {wall_seconds / 3600:.2f} wall-hours: {rate:.1f} audio-hours per wall-hour"
+        )
+
+
+def transcribe(args, settings, db_handler):
+    model_id = args.model_id or settings.get("model_id")
+    settings = dict(settings, model_id=model_id)
+    task = 'transcribe' if settings.get("useOriginalLanguage") == True else "translate"
+    batch_size = max(1, settings.get("transcriptionBatchSize", 4))
+
+    query = {"audio_path": {"$exists": True}}
+    if not args.force:
+        query["transcription_model"] = {"$ne": model_id}
+    if args.meeting:
+        query["meeting_id"] = {"$in": args.meeting}
+    remaining = db_handler.count_entries("transcriptions", query)
+    logger.info("%d utterance(s) to transcribe with %s", remaining, model_id)
+    if not remaining:
+        return
+
+    model_pipeline = load_inference_backend(settings)
+    inference_workers = max(1, settings.get("transcriptionWorkers", 1), getattr(model_pipeline, "concurrency", 1))
+    report = ThroughputReport("utterances")
+    updates = []
+
+    def decode_entry(entry):
+        try:
+            return entry, decode_audio(entry["audio_path"], entry.get("audio_offset"), entry.get("audio_duration"))
+        except (OSError, RuntimeError) as e:
+            logger.warning("Skipping %s: %s", entry["_id"], e)
+            return entry, None
+
+    def run_batch(batch):
+        return model_pipeline(
+            [audio for _, audio in batch],
+            batch_size=len(batch),
+            generate_kwargs={"task": task},
+            return_timestamps=False,
+        )
+
+    def collect(future):
+        batch = batch_of.pop(future)
+        try:
+            results = future.result()
+        except Exception as e:
+            logger.error("Transcription batch of %d utterance(s) failed: %s", len(batch), e)
+            report.failed += len(batch)
+            return
+        for (entry, audio), result in zip(batch, results):
+            updates.append(UpdateOne(
+                {"_id": entry["_id"]},
+                {"$set": {"transcription": result["text"].strip(), "transcription_model": model_id}},
+            ))
+            report.add(len(audio) / SAMPLE_RATE)
+        if len(updates) >= args.write_batch:
+            db_handler.bulk_write("transcriptions", updates)
+            updates.clear()
+            logger.info(report.line())
+
+    entries = iter_pages(
+        db_handler,
+        "transcriptions",
+        query,
+        projection={"audio_path": 1, "audio_offset": 1, "audio_duration": 1},
+        page_size=args.write_batch,
+    )
+    batch_of = {}  # inference future -> its batch
+    with ThreadPoolExecutor(max_workers=args.decoders, thread_name_prefix="decode") as decoders, \
+            ThreadPoolExecutor(max_workers=inference_workers, thread_name_prefix="inference") as inference:
+        batch = []
+        for entry, audio in bounded_map(decoders, decode_entry, entries, args.decoders * 4):
+            if audio is None:
+                report.failed += 1
+                continue
+            batch.append((entry, audio))
+            if len(batch) < batch_size:
+                continue
+            future = inference.submit(run_batch, batch)
+            batch_of[future] = batch
+            batch = []
+            # Keep every inference worker busy, but don't decode far ahead of them
+            while len(batch_of) > inference_workers * 2:
+                done, _ = wait(list(batch_of), return_when=FIRST_COMPLETED)
+                for finished in done:
+                    collect(finished)
+        if batch:
+            future = inference.submit(run_batch, batch)
+            batch_of[future] = batch
+        for future in list(batch_of):
+            wait([future])
+            collect(future)
+
+    if updates:
+        db_handler.bulk_write("transcriptions", updates)
+    if isinstance(model_pipeline, ProcessInferenceBackend):
+        model_pipeline.close()
+    logger.info("Done: %s", report.line())
+
+
+def summarize(args, settings, db_handler):
+    from meeting_reader import MeetingReader
+
+    model_id = args.summarizer_model_id or settings.get("summarizer_model_id")
+    settings = dict(settings, summarizer_model_id=model_id, rollingSummaryUtterances=0)
+
+    # Only finished meetings, running ones are summarized by the bot when they end
+    query = {"end_date": {"$ne": None}}
+    if not args.force:
+        query["summary_model"] = {"$ne": model_id}
+    if args.meeting:
+        query["meeting_id"] = {"$in": args.meeting}
+    # Read up front, a cursor kept open while meetings are summarized one by one would time out
+    meetings = list(db_handler.find_entries(
+        "meetings",
+        query,
+        projection={"meeting_id": 1, "start_date": 1, "end_date": 1},
+        sort=[("start_date", 1)],
+    ))
+    logger.info("%d meeting(s) to summarize with %s", len(meetings), model_id)
+
+    meeting_reader = MeetingReader(db_handler, settings)
+    meeting_reader.load_summarizer()
+    report = ThroughputReport("meetings")
+
+    def summarize_meeting(meeting):
+        try:
+            meeting_reader.read_meeting_transcripts(meeting["meeting_id"])
+        except Exception as e:
+            logger.error("Summarizing %s failed: %s", meeting["meeting_id"], e)
+            return meeting, False
+        return meeting, True
+
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="summarize") as executor:
+        for meeting, succeeded in bounded_map(executor, summarize_meeting, meetings, args.workers * 2):
+            if not succeeded:
+                report.failed += 1
+                continue
+            report.add((meeting["end_date"] - meeting["start_date"]).total_seconds())
+            if report.items % 10 == 0:
+                logger.info(report.line())
+    logger.info("Done: %s", report.line())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-transcribe recordings or re-summarize meetings.")
+    parser.add_argument("--settings", default="./settings.json", help="settings file to read defaults from")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    transcribe_parser = subparsers.add_parser("transcribe", help="re-transcribe utterances that have a recording")
+    transcribe_parser.add_argument("--model-id", help="transcription model (default: model_id from the settings)")
+    transcribe_parser.add_argument("--decoders", type=int, default=os.cpu_count() or 1, help="parallel ffmpeg decoders")
+    transcribe_parser.add_argument("--write-batch", type=int, default=200, help="utterances per bulk write")
+
+    summarize_parser = subparsers.add_parser("summarize", help="re-summarize finished meetings")
+    summarize_parser.add_argument("--summarizer-model-id", help="summarizer (default: summarizer_model_id from the settings)")
+    summarize_parser.add_argument("--workers", type=int, default=2, help="meetings summarized at the same time")
+
+    for subparser in (transcribe_parser, summarize_parser):
+        subparser.add_argument("--meeting", nargs="+", help="only these meeting ids")
+        subparser.add_argument("--force", action="store_true", help="also redo documents already made with the model")
+    args = parser.parse_args()
+
+    with open(args.settings, "r") as file:
+        settings = json.load(file)
+    logging.basicConfig(level=settings.get("logLevel", "INFO"), format=LOG_FORMAT)
+
+    load_dotenv()
+    db_handler = MongoDBHandler(os.getenv("MONGO_URI"), os.getenv("MONGO_DB_NAME"))
+    db_handler.ensure_indexes()
+    if args.command == "transcribe":
+        transcribe(args, settings, db_handler)
+    else:
+        summarize(args, settings, db_handler)
+    db_handler.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+Search over the transcriptions of past meetings. Keywords are looked up with MongoDB's text index;
+with `searchEmbeddingModel` set, an embedding index on local disk also finds utterances that say the
+same thing in other words. Both result lists are combined by reciprocal rank fusion.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+from bson import ObjectId
+
+from metrics import REGISTRY
+from setup_model import resolve_device
+
+logger = logging.getLogger(__name__)
+
+SEARCH_SECONDS = REGISTRY.histogram("notebot_search_seconds", "Time per transcript search", ["index"])
+SEARCH_INDEX_SIZE = REGISTRY.gauge("notebot_search_index_utterances", "Utterances in the embedding index")
+
+HIT_PROJECTION = {"meeting_id": 1, "user": 1, "user_id": 1, "timestamp": 1, "start_time": 1, "transcription": 1}
+# Transcriptions are written out of _id order (retried writes, flushes the index never saw before a restart),
+# so catching up starts this long before the newest indexed one; rows already indexed are skipped
+CATCH_UP_OVERLAP = timedelta(hours=1)
+# Rank constant of reciprocal rank fusion, damps the difference between the first few ranks
+RRF_K = 60
+
+
+class TransformerEncoder:
+    """Sentence embeddings from a Hugging Face encoder: mean-pooled over the tokens and normalized."""
+
+    def __init__(self, model_id, device_setting="auto", cache_dir="cache", batch_size=64, max_tokens=128):
+        self.model_id = model_id
+        self.device_setting = device_setting
+        self.cache_dir = cache_dir
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.tokenizer = None
+        self.model = None
+        self._load_lock = threading.Lock()
+
+    def load(self):
+        with self._load_lock:
+            if self.model is not None:
+                return
+            from transformers import AutoModel, AutoTokenizer
+
+            self.device = resolve_device(self.device_setting)
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_id, cache_dir=self.cache_dir)
+            model = AutoModel.from_pretrained(self.model_id, cache_dir=self.cache_dir)
+            self.model = model.to(self.device).eval()
+
+    @property
+    def dimensions(self):
+        self.load()
+        return self.model.config.hidden_size
+
+    def encode(self, texts):
+        """Returns one normalized float32 row per text."""
+        import torch
+
+        self.load()
+        rows = []
+        with torch.inference_mode():
+            for start in range(0, len(texts), self.batch_size):
+                tokens = self.tokenizer(
+                    texts[start:start + self.batch_size],
+                    padding=True,
+                    truncation=True,
+                    max_length=self.max_tokens,
+                    return_tensors="pt",
+                ).to(self.device)
+                hidden = self.model(**tokens).last_hidden_state
+                mask = tokens["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                rows.append(torch.nn.functional.normalize(pooled, dim=1).float().cpu().numpy())
+        return np.concatenate(rows) if rows else np.empty((0, self.dimensions), dtype=np.float32)
+
+
+class EmbeddingIndex:
+    """
+    Brute-force cosine search over one normalized vector per utterance, fast enough for a few hundred
+    thousand utterances (a matrix-vector product, ~10 ms per 100k rows with 384 dimensions).
+    Rows are kept in append-only files in `path`, so adding utterances never rewrites the index:
+    vectors.f32 (float32 rows), ids.bin (12-byte ObjectIds), meetings.i32 (row -> number of the meeting)
+    and meetings.txt (one meeting id per line). meta.json records the model the vectors came from.
+    """
+
+    def __init__(self, path, encoder):
+        self.path = path
+        self.encoder = encoder
+        self.ready = False
+        self.dimensions = None
+        self._count = 0
+        self._vectors = None  # grows by doubling, rows past _count are unused
+        self._ids = []  # bytes of the ObjectIds, by row
+        self._known = set()
+        self._meeting_rows = np.empty(0, dtype=np.int32)
+        self._meeting_ids = []  # meeting number -> meeting id
+        self._meeting_numbers = {}
+        self._lock = threading.Lock()
+        SEARCH_INDEX_SIZE.set_function(lambda: self._count)
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def open(self):
+        """Loads the model and the stored rows; blocking, a new model starts an empty index."""
+        self.encoder.load()
+        self.dimensions = self.encoder.dimensions
+        os.makedirs(self.path, exist_ok=True)
+        meta = {"model": self.encoder.model_id, "dimensions": self.dimensions}
+        try:
+            with open(self._file("meta.json")) as file:
+                stored = json.load(file)
+        except (OSError, ValueError):
+            stored = None
+        if stored != meta:
+            if stored is not None:
+                logger.info("Search index was built with %s, rebuilding it for %s", stored.get("model"), meta["model"])
+            for name in ("vectors.f32", "ids.bin", "meetings.i32", "meetings.txt"):
+                open(self._file(name), "wb").close()
+            with open(self._file("meta.json"), "w") as file:
+                json.dump(meta, file)
+
+        vectors = np.fromfile(self._file("vectors.f32"), dtype=np.float32)
+        ids = open(self._file("ids.bin"), "rb").read()
+        meeting_rows = np.fromfile(self._file("meetings.i32"), dtype=np.int32)
+        with open(self._file("meetings.txt")) as file:
+            meeting_ids = file.read().splitlines()
+
+        # A crash between the appends can leave one file a few rows ahead, the shortest one counts
+        count = min(len(vectors) // self.dimensions, len(ids) // 12, len(meeting_rows))
+        for name, row_bytes in (("vectors.f32", 4 * self.dimensions), ("ids.bin", 12), ("meetings.i32", 4)):
+            if os.path.getsize(self._file(name)) != count * row_bytes:
+                os.truncate(self._file(name), count * row_bytes)
+
+        with self._lock:
+            self._vectors = np.empty((max(count, 1024), self.dimensions), dtype=np.float32)
+            self._vectors[:count] = vectors[:count * self.dimensions].reshape(count, self.dimensions)
+            self._ids = [ids[row * 12:row * 12 + 12] for row in range(count)]
+            self._known = set(self._ids)
+            self._meeting_rows = meeting_rows[:count].copy()
+            self._meeting_ids = meeting_ids
+            self._meeting_numbers = {meeting_id: number for number, meeting_id in enumerate(meeting_ids)}
+            self._count = count
+            self.ready = True
+        logger.info("Search index loaded: %d utterance(s) from %d meeting(s)", count, len(meeting_ids))
+
+    def last_id(self):
+        """The newest ObjectId in the index (ObjectIds sort by their bytes), or None if it is empty."""
+        with self._lock:
+            return ObjectId(max(self._ids)) if self._ids else None
+
+    def add(self, entries):
+        """Embeds and appends transcriptions (dicts with _id, meeting_id and transcription) not indexed yet."""
+        entries = [
+            entry for entry in entries
+            if entry.get("transcription", "").strip() and entry["_id"].binary not in self._known
+        ]
+        if not entries:
+            return 0
+        vectors = self.encoder.encode([entry["transcription"] for entry in entries]).astype(np.float32)
+
+        new_meetings = []
+        rows = np.empty(len(entries), dtype=np.int32)
+        for row, entry in enumerate(entries):
+            number = self._meeting_numbers.get(entry["meeting_id"])
+            if number is None:
+                number = self._meeting_numbers[entry["meeting_id"]] = len(self._meeting_ids)
+                self._meeting_ids.append(entry["meeting_id"])
+                new_meetings.append(entry["meeting_id"])
+            rows[row] = number
+        ids = [entry["_id"].binary for entry in entries]
+
+        # Meetings first: rows are only counted once all of their files have them
+        if new_meetings:
+            with open(self._file("meetings.txt"), "a") as file:
+                file.write("".join(f"{meeting_id}\n" for meeting_id in new_meetings))
+        with open(self._file("vectors.f32"), "ab") as file:
+            file.write(vectors.tobytes())
+        with open(self._file("ids.bin"), "ab") as file:
+            file.write(b"".join(ids))
+        with open(self._file("meetings.i32"), "ab") as file:
+            file.write(rows.tobytes())
+
+        with self._lock:
+            count = self._count + len(entries)
+            if count > len(self._vectors):
+                grown = np.empty((max(count, 2 * len(self._vectors)), self.dimensions), dtype=np.float32)
+                grown[:self._count] = self._vectors[:self._count]
+                self._vectors = grown
+            self._vectors[self._count:count] = vectors
+            self._meeting_rows = np.concatenate([self._meeting_rows, rows])
+            self._ids.extend(ids)
+            self._known.update(ids)
+            self._count = count
+        return len(entries)
+
+    def search(self, query, limit=10, meeting_ids=None):
+        """Returns [(ObjectId, cosine similarity)] of the closest utterances, optionally only from some meetings."""
+        vector = self.encoder.encode([query])[0]
+        with self._lock:
+            count = self._count
+            vectors = self._vectors
+            meeting_rows = self._meeting_rows
+            ids = self._ids
+            numbers = self._meeting_numbers
+        if count == 0:
+            return []
+        scores = vectors[:count] @ vector
+        if meeting_ids is not None:
+            allowed = [numbers[meeting_id] for meeting_id in meeting_ids if meeting_id in numbers]
+            scores[~np.isin(meeting_rows[:count], allowed)] = -np.inf
+        limit = min(limit, count)
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        best = best[np.argsort(-scores[best])]
+        return [(ObjectId(ids[row]), float(scores[row])) for row in best if scores[row] > -np.inf]
+
+
+class SearchIndex:
+    """
+    Finds utterances of past meetings for the search command. New transcriptions reach the embedding
+    index through the write-behind flush listener (note_transcriptions); older ones are caught up on
+    start. Embedding runs on one background thread, never on the flush or the event loop.
+    """
+
+    def __init__(self, db_handler, embeddings=None, catch_up_batch=256):
+        self.db_handler = db_handler
+        self.embeddings = embeddings
+        self.catch_up_batch = catch_up_batch
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-index")
+
+    @classmethod
+    def from_settings(cls, db_handler, settings):
+        embeddings = None
+        model_id = settings.get("searchEmbeddingModel")
+        if model_id:
+            encoder = TransformerEncoder(model_id, settings.get("device", "auto"))
+            embeddings = EmbeddingIndex(settings.get("searchIndexPath") or "./search-index", encoder)
+        return cls(db_handler, embeddings)
+
+    def start(self):
+        """Loads the embedding index and indexes what was transcribed since it was last saved."""
+        if self.embeddings is not None:
+            self._executor.submit(self._open)
+
+    def _open(self):
+        try:
+            self.embeddings.open()
+            self.catch_up()
+        except Exception:
+            logger.exception("Failed to load the search index, only keyword search is available")
+
+    def catch_up(self):
+        """Embeds the stored transcriptions not indexed yet, from shortly before the newest indexed one on."""
+        start = time.perf_counter()
+        last_id = self.embeddings.last_id()
+        query = {}
+        if last_id is not None:
+            query["_id"] = {"$gt": ObjectId.from_datetime(last_id.generation_time - CATCH_UP_OVERLAP)}
+        projection = {"meeting_id": 1, "transcription": 1}
+        cursor = self.db_handler.find_entries(
+            "transcriptions", query, projection, sort=[("_id", 1)], batch_size=self.catch_up_batch
+        )
+        added = 0
+        batch = []
+        for entry in cursor:
+            batch.append(entry)
+            if len(batch) >= self.catch_up_batch:
+                added += self.embeddings.add(batch)
+                batch = []
+        added += self.embeddings.add(batch)
+        if added:
+            logger.info("Search index caught up on %d utterance(s) in %.1f s", added, time.perf_counter() - start)
+
+    def note_transcriptions(self, entries):
+        """Flush listener: queues freshly written transcriptions for the embedding index."""
+        if self.embeddings is not None:
+            self._executor.submit(self._add, list(entries))
+
+    def _add(self, entries):
+        # Runs after _open on the same thread; if the index failed to load there is nothing to add to
+        if not self.embeddings.ready:
+            return
+        try:
+            self.embeddings.add(entries)
+        except Exception:
+            logger.exception("Error adding %d utterance(s) to the search index", len(entries))
+
+    def attended_meetings(self, user_id):
+        cursor = self.db_handler.find_entries("meetings", {"attendees.id": user_id}, {"meeting_id": 1})
+        return [meeting["meeting_id"] for meeting in cursor]
+
+    def text_search(self, query, limit=10, meeting_ids=None):
+        """Keyword search over the text index, best matches first."""
+        start = time.perf_counter()
+        text_query = {"$text": {"$search": query}}
+        if meeting_ids is not None:
+            text_query["meeting_id"] = {"$in": meeting_ids}
+        projection = dict(HIT_PROJECTION, score={"$meta": "textScore"})
+        hits = list(self.db_handler.find_entries(
+            "transcriptions", text_query, projection, sort=[("score", {"$meta": "textScore"})], limit=limit
+        ))
+        SEARCH_SECONDS.labels(index="text").observe(time.perf_counter() - start)
+        return hits
+
+    def semantic_search(self, query, limit=10, meeting_ids=None):
+        """Nearest utterances in the embedding index, [] while it is disabled or still loading."""
+        if self.embeddings is None or not self.embeddings.ready:
+            return []
+        start = time.perf_counter()
+        matches = self.embeddings.search(query, limit, meeting_ids)
+        SEARCH_SECONDS.labels(index="embedding").observe(time.perf_counter() - start)
+        if not matches:
+            return []
+        documents = {
+            document["_id"]: document
+            for document in self.db_handler.find_entries(
+                "transcriptions", {"_id": {"$in": [object_id for object_id, _ in matches]}}, HIT_PROJECTION
+            )
+        }
+        # Utterances deleted from the database since they were indexed are skipped
+        return [dict(documents[object_id], similarity=score) for object_id, score in matches if object_id in documents]
+
+    def search(self, query, user_id=None, limit=5):
+        """
+        Searches the meetings `user_id` attended (all meetings if None). Returns up to `limit` utterances,
+        each with the title and start date of its meeting.
+        """
+        start = time.perf_counter()
+        meeting_ids = self.attended_meetings(user_id) if user_id is not None else None
+        if meeting_ids == []:
+            return []
+
+        ranked = {}
+        for hits in (self.text_search(query, limit * 2, meeting_ids), self.semantic_search(query, limit * 2, meeting_ids)):
+            for rank, hit in enumerate(hits):
+                entry = ranked.setdefault(hit["_id"], [0.0, hit])
+                entry[0] += 1 / (RRF_K + rank + 1)
+        results = [hit for _, hit in sorted(ranked.values(), key=lambda item: item[0], reverse=True)[:limit]]
+
+        meetings = {
+            meeting["meeting_id"]: meeting
+            for meeting in self.db_handler.find_entries(
+                "meetings",
+                {"meeting_id": {"$in": list({hit["meeting_id"] for hit in results})}},
+                {"meeting_id": 1, "meeting_title": 1, "start_date": 1},
+            )
+        }
+        for hit in results:
+            meeting = meetings.get(hit["meeting_id"], {})
+            hit["meeting_title"] = meeting.get("meeting_title", hit["meeting_id"])
+            hit["meeting_start"] = meeting.get("start_date")
+        SEARCH_SECONDS.labels(index="combined").observe(time.perf_counter() - start)
+        return results
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
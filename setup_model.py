@@ -1,13 +1,61 @@
-import torch
-from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
+import logging
+# torch and transformers take seconds to import, so they are only imported once a model is loaded
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = ("none", "int8", "bf16")
+
+
+def resolve_device(device_setting):
+    import torch
 
-def setup_whisper_model(model_id, device_setting, cache_dir="cache"):
-    # Set device and dtype
     if device_setting == 'auto':
-        device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    else:
-        device = device_setting
-    torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+        return torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    return torch.device(device_setting)
+
+
+def resolve_quantization(quantization, device):
+    """Checks the quantization setting against the device, falls back to 'none' where it can't run."""
+    import torch
+
+    quantization = quantization or "none"
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization: {quantization}")
+    if quantization == "int8" and device.type != "cpu":
+        # Dynamic int8 quantization only has CPU kernels
+        logger.warning("int8 quantization only runs on the CPU, not on %s. Using the default precision.", device)
+        return "none"
+    if quantization == "bf16" and device.type == "cpu" and not torch.backends.mkldnn.is_available():
+        logger.warning("This CPU build has no bf16 support. Using float32.")
+        return "none"
+    return quantization
+
+
+def quantization_dtype(quantization, device):
+    """The dtype a model is loaded in; int8 models are loaded in float32 and quantized afterwards."""
+    import torch
+
+    if quantization == "bf16":
+        return torch.bfloat16
+    return torch.float16 if device.type == "cuda" else torch.float32
+
+
+def quantize_model(model, quantization):
+    """Replaces the Linear layers of a float32 CPU model with dynamically quantized int8 ones."""
+    if quantization != "int8":
+        return model
+    import torch
+
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def setup_whisper_model(model_id, device_setting, cache_dir="cache", quantization="none"):
+    from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
+
+    # Set device and dtype
+    device = resolve_device(device_setting)
+    quantization = resolve_quantization(quantization, device)
+    torch_dtype = quantization_dtype(quantization, device)
 
     # Load processor first
     processor = AutoProcessor.from_pretrained(model_id)
@@ -22,6 +70,7 @@ def setup_whisper_model(model_id, device_setting, cache_dir="cache"):
     )
     model.config.pad_token_id = processor.tokenizer.pad_token_id
     model.to(device)
+    model = quantize_model(model, quantization)
 
     # Create ASR pipeline with modified settings
     pipe = pipeline(
@@ -40,4 +89,4 @@ def setup_whisper_model(model_id, device_setting, cache_dir="cache"):
             "task": "transcribe"
         }
     )
-    return pipe
\ No newline at end of file
+    return pipe
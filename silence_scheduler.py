@@ -0,0 +1,123 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from metrics import LogSampler, span
+
+logger = logging.getLogger(__name__)
+
+
+class SilenceScheduler:
+    """
+    Single thread that flushes recorders once they have been silent for `silence_timeout` seconds.
+    Packets only update the recorder's `last_spoken_time`; a deadline is pushed onto the heap
+    once per utterance and re-armed lazily when it expires while the speaker is still talking.
+    """
+
+    def __init__(self, silence_timeout=5.0, log_sample_seconds=10.0):
+        self.silence_timeout = silence_timeout
+        self._flush_log = LogSampler(logger, log_sample_seconds)
+        self._heap = []  # (deadline, sequence, recorder)
+        self._armed = set()  # recorders that currently have a deadline on the heap
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        self.flushes = 0
+        self.total_lateness = 0.0
+        self.max_lateness = 0.0
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="silence-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def touch(self, recorder):
+        """Called after every packet. O(1) unless the recorder has no pending deadline yet."""
+        if recorder in self._armed:
+            return
+        with self._condition:
+            if recorder in self._armed:
+                return
+            self._armed.add(recorder)
+            deadline = recorder.last_spoken_time + self.silence_timeout
+            heapq.heappush(self._heap, (deadline, next(self._counter), recorder))
+            # Only wake the thread if this is now the earliest deadline
+            if self._heap[0][2] is recorder:
+                self._condition.notify()
+
+    def forget(self, recorder):
+        """Drops a recorder's pending deadline, e.g. when it was flushed elsewhere."""
+        with self._condition:
+            self._armed.discard(recorder)
+
+    def stats(self):
+        with self._condition:
+            return {
+                "pending": len(self._armed),
+                "flushes": self.flushes,
+                "mean_lateness": self.total_lateness / self.flushes if self.flushes else 0.0,
+                "max_lateness": self.max_lateness,
+            }
+
+    def _next_due(self):
+        """Waits for the earliest deadline and returns the recorder to flush, or None on stop."""
+        with self._condition:
+            while self._running:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                deadline, _, recorder = self._heap[0]
+                now = time.time()
+                if deadline > now:
+                    self._condition.wait(deadline - now)
+                    continue
+
+                heapq.heappop(self._heap)
+                if recorder not in self._armed:
+                    continue
+
+                # The speaker kept talking after this deadline was set, push it back
+                actual_deadline = recorder.last_spoken_time + self.silence_timeout
+                if actual_deadline > now:
+                    heapq.heappush(self._heap, (actual_deadline, next(self._counter), recorder))
+                    continue
+
+                self._armed.discard(recorder)
+                lateness = now - actual_deadline
+                self.flushes += 1
+                self.total_lateness += lateness
+                self.max_lateness = max(self.max_lateness, lateness)
+                return recorder, lateness
+            return None
+
+    def _run(self):
+        while True:
+            due = self._next_due()
+            if due is None:
+                return
+            recorder, lateness = due
+            self._flush_log.log(
+                logging.DEBUG,
+                "Flushing utterance of %s %.0f ms after the silence deadline", recorder.user.name, lateness * 1000,
+            )
+            try:
+                with span("silence_flush"):
+                    recorder.save_recording()
+            except Exception:
+                logger.exception("Error flushing recording of %s", recorder.user.name)
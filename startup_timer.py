@@ -0,0 +1,30 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """
+    Records how long after process start the bot reaches each startup milestone
+    (e.g. logged in, transcription model ready, first transcription).
+    Only the first time a milestone is reached counts.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.milestones = {}  # name -> seconds since start
+        self._lock = threading.Lock()
+
+    def mark(self, name):
+        with self._lock:
+            if name in self.milestones:
+                return
+            elapsed = time.perf_counter() - self.started
+            self.milestones[name] = elapsed
+        logger.info("Startup: %s after %.2fs", name, elapsed)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.milestones)
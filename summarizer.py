@@ -0,0 +1,237 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import SUMMARY_SECONDS, SUMMARY_TOKENS
+
+try:
+    import tiktoken
+except ImportError:  # Optional, token counts are estimated without it
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = "You are a helpful assistant that summarizes meeting transcripts."
+
+MAP_PROMPT = (
+    "You are given one part of the transcripts of a longer meeting.\n\n"
+    "Dont make any information up or assume anything. Only summarize the existing transcripts.\n\n"
+    "Write the summary in the language that was spoken in the transcripts.\n\n"
+    "List the key points, decisions and action items of this part, including who said or owns them.\n\n"
+    "{label}:\n{text}"
+)
+
+FINAL_PROMPT = (
+    "You are given transcripts from a meeting.\n\n"
+    "Dont make any information up or assume anything. Only summarize the existing transcripts.\n\n"
+    "Generate the response in the language that was spoken in the meeting. So if the transcripts are in german, sumamrize in germand and create a german title. If the languag is englisch, do everything in english and so on. \n\n"
+    "1. Invent a brief, fitting meeting title that captures the overall theme or purpose of the meeting.\n"
+    "2. Summarize the key points, decisions, and action items from the transcripts.\n\n"
+    "3. Create a to-do list of action items that need to be completed after the meeting.\n\n"
+    "The first line of your response should be the newly created meeting title.\n\n"
+    "{label}:\n{text}"
+)
+
+TRANSCRIPTS_LABEL = "Transcripts"
+PARTIAL_SUMMARIES_LABEL = "Summaries of consecutive parts of the meeting, in order"
+
+
+class OpenAISummaryBackend:
+    """
+    Summarizes with a chat model, parts of the transcript are sent as concurrent requests from a thread pool.
+    The synchronous client is thread-safe, so the rolling and final summaries (and reprocess.py's workers)
+    can share it; an async client would be tied to the event loop it was first used on.
+    """
+
+    produces_title = True
+
+    def __init__(self, client, model_id, max_concurrency=4, context_tokens=8000, max_tokens=300):
+        self.client = client
+        self.model_id = model_id
+        self.max_concurrency = max_concurrency
+        self.context_tokens = context_tokens
+        self.max_tokens = max_tokens
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.encoding_for_model(model_id)
+            except KeyError:
+                self._encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count_tokens(self, text):
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        # Roughly four characters per token
+        return len(text) // 4 + 1
+
+    def _complete(self, prompt):
+        response = self.client.chat.completions.create(
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            model=self.model_id,
+            max_tokens=self.max_tokens,
+            temperature=0.7,
+        )
+        return response.choices[0].message.content.strip()
+
+    def map(self, chunks, label):
+        prompts = [MAP_PROMPT.format(label=label, text=chunk) for chunk in chunks]
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            return list(executor.map(self._complete, prompts))
+
+    def reduce(self, text, label):
+        return self._complete(FINAL_PROMPT.format(label=label, text=text))
+
+
+class HuggingFaceSummaryBackend:
+    """Summarizes with a Hugging Face summarization pipeline, parts run on a thread pool."""
+
+    produces_title = False
+
+    def __init__(self, summarizer, max_workers=2, max_length=130, min_length=30):
+        self.summarizer = summarizer
+        self.max_workers = max_workers
+        self.max_length = max_length
+        self.min_length = min_length
+        self.tokenizer = summarizer.tokenizer
+        # Leave room for special tokens
+        self.context_tokens = min(self.tokenizer.model_max_length, 4096) - 16
+
+    def count_tokens(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def _summarize(self, text):
+        summary = self.summarizer(text, max_length=self.max_length, min_length=self.min_length, do_sample=False, truncation=True)
+        return summary[0]["summary_text"] if summary else ""
+
+    def map(self, chunks, label):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self._summarize, chunks))
+
+    def reduce(self, text, label):
+        return self._summarize(text)
+
+
+class MapReduceSummarizer:
+    """
+    Summarizes transcripts of any length within the backend's context window.
+    The transcript is split on a token budget, the chunks are summarized concurrently (map)
+    and the partial summaries are combined into the final summary (reduce). If the partial
+    summaries still do not fit, they are mapped again until they do.
+    A backend needs `context_tokens`, `count_tokens(text)`, `map(chunks, label)` and
+    `reduce(text, label)`, so tests can pass a stub instead of a real model.
+    """
+
+    def __init__(self, backend, chunk_tokens=None, max_levels=5):
+        self.backend = backend
+        self.chunk_tokens = chunk_tokens or backend.context_tokens // 2
+        self.max_levels = max_levels
+
+    def split(self, lines):
+        """Groups lines into chunks of at most `chunk_tokens` tokens, splitting oversized lines on words."""
+        chunks = []
+        current = []
+        current_tokens = 0
+        for line in lines:
+            tokens = self.backend.count_tokens(line) + 1
+            if tokens > self.chunk_tokens:
+                pieces = self._split_line(line)
+            else:
+                pieces = [(line, tokens)]
+            for piece, piece_tokens in pieces:
+                if current and current_tokens + piece_tokens > self.chunk_tokens:
+                    chunks.append("\n".join(current))
+                    current = []
+                    current_tokens = 0
+                current.append(piece)
+                current_tokens += piece_tokens
+        if current:
+            chunks.append("\n".join(current))
+        return chunks
+
+    def _split_line(self, line):
+        pieces = []
+        words = []
+        tokens = 0
+        for word in line.split():
+            word_tokens = self.backend.count_tokens(word) + 1
+            if words and tokens + word_tokens > self.chunk_tokens:
+                pieces.append((" ".join(words), tokens))
+                words = []
+                tokens = 0
+            words.append(word)
+            tokens += word_tokens
+        if words:
+            pieces.append((" ".join(words), tokens))
+        return pieces
+
+    def summarize(self, lines, partials=None):
+        """
+        Returns the final summary text and per-stage statistics.
+        `partials` are summaries of earlier parts of the meeting (see summarize_part); when they
+        are given, `lines` only need to contain the transcript after those parts.
+        """
+        stats = []
+        texts = self.split(lines)
+        label = TRANSCRIPTS_LABEL
+        if partials:
+            if texts:
+                partials = partials + self._map(texts, label, "map delta", stats)
+            texts = self.split(partials)
+            label = PARTIAL_SUMMARIES_LABEL
+
+        level = 0
+        while len(texts) > 1 and level < self.max_levels:
+            level += 1
+            partials = self._map(texts, label, f"map {level}", stats)
+            texts = self.split(partials)
+            label = PARTIAL_SUMMARIES_LABEL
+
+        if not texts:
+            return "", stats
+
+        start = time.perf_counter()
+        text = "\n\n".join(texts)
+        summary = self.backend.reduce(text, label)
+        stats.append(self._stage("reduce", 1, self.backend.count_tokens(text), [summary], start))
+        return summary, stats
+
+    def summarize_part(self, lines, partials=None):
+        """
+        Map stage only: summarizes the lines and appends them to `partials`.
+        Partials that outgrow one chunk are summarized again, so the list stays small.
+        """
+        stats = []
+        partials = list(partials or [])
+        texts = self.split(lines)
+        if texts:
+            partials += self._map(texts, TRANSCRIPTS_LABEL, "rolling map", stats)
+        if len(self.split(partials)) > 1:
+            partials = self._map(self.split(partials), PARTIAL_SUMMARIES_LABEL, "rolling compact", stats)
+        return partials, stats
+
+    def _map(self, texts, label, name, stats):
+        start = time.perf_counter()
+        tokens_in = sum(self.backend.count_tokens(text) for text in texts)
+        partials = [p for p in self.backend.map(texts, label) if p]
+        stats.append(self._stage(name, len(texts), tokens_in, partials, start))
+        return partials
+
+    def _stage(self, name, calls, tokens_in, outputs, start):
+        stage = {
+            "stage": name,
+            "calls": calls,
+            "tokens_in": tokens_in,
+            "tokens_out": sum(self.backend.count_tokens(output) for output in outputs),
+            "seconds": time.perf_counter() - start,
+        }
+        SUMMARY_SECONDS.labels(stage=name).observe(stage["seconds"])
+        SUMMARY_TOKENS.labels(direction="in").inc(tokens_in)
+        SUMMARY_TOKENS.labels(direction="out").inc(stage["tokens_out"])
+        logger.info(
+            "Summarization %s: %d call(s), %d tokens in, %d tokens out, %.2fs",
+            name, calls, tokens_in, stage["tokens_out"], stage["seconds"],
+        )
+        return stage
@@ -0,0 +1,136 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class TranscriptionCache:
+    """
+    Content-addressed cache for transcriptions.
+    Keys are a hash of the peak-normalized 16 kHz audio plus model id and task, so audio
+    that is re-sent (reconnect replays, reprocessing runs) skips inference entirely.
+    Entries live in an in-memory LRU and, optionally, in a size-bounded directory on disk.
+    """
+
+    def __init__(self, model_id, max_entries=1024, cache_dir=None, max_disk_bytes=100 * 1024 * 1024):
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()  # key -> text
+        self._disk = OrderedDict()  # key -> file size, least recently used first
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._load_disk_index()
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            settings.get("model_id"),
+            max_entries=settings.get("transcriptionCacheSize", 1024),
+            cache_dir=settings.get("transcriptionCachePath"),
+            max_disk_bytes=settings.get("transcriptionCacheMaxBytes", 100 * 1024 * 1024),
+        )
+
+    def _load_disk_index(self):
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".txt"):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.txt")
+
+    def key(self, audio_array, task):
+        """Hashes the audio after normalizing its gain and quantizing it to 16 bit."""
+        peak = float(np.max(np.abs(audio_array))) if len(audio_array) else 0.0
+        scale = 32767.0 / peak if peak > 0 else 0.0
+        normalized = np.rint(audio_array * scale).astype(np.int16)
+        digest = hashlib.sha256()
+        digest.update(f"{self.model_id}\0{task}\0".encode())
+        digest.update(normalized.tobytes())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns the cached transcription or None."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+            if key in self._disk:
+                try:
+                    with open(self._path(key), "r", encoding="utf-8") as file:
+                        text = file.read()
+                except OSError:
+                    self._forget_disk_entry(key)
+                else:
+                    self._disk.move_to_end(key)
+                    os.utime(self._path(key))
+                    self._remember(key, text)
+                    self.hits += 1
+                    return text
+
+            self.misses += 1
+            return None
+
+    def put(self, key, text):
+        with self._lock:
+            self._remember(key, text)
+            if self.cache_dir is not None and key not in self._disk:
+                self._write_disk_entry(key, text)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _remember(self, key, text):
+        self._memory[key] = text
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _write_disk_entry(self, key, text):
+        data = text.encode("utf-8")
+        try:
+            with open(self._path(key), "wb") as file:
+                file.write(data)
+        except OSError as e:
+            logger.warning("Could not write transcription cache entry: %s", e)
+            return
+        self._disk[key] = len(data)
+        self._disk_bytes += len(data)
+
+        # Evict the least recently used files until we are under the size limit
+        while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+            oldest = next(iter(self._disk))
+            self._forget_disk_entry(oldest)
+            try:
+                os.remove(self._path(oldest))
+            except OSError:
+                pass
+
+    def _forget_disk_entry(self, key):
+        self._disk_bytes -= self._disk.pop(key, 0)
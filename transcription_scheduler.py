@@ -0,0 +1,418 @@
+import heapq
+import itertools
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from metrics import (
+    ASR_AUDIO_SECONDS,
+    ASR_BATCH_SECONDS,
+    ASR_CACHE_HITS,
+    ASR_DROPPED,
+    ASR_QUEUE_DEPTH,
+    ASR_QUEUE_BYTES,
+    ASR_REAL_TIME_FACTOR,
+    ASR_SPILLED,
+    LogSampler,
+    span,
+)
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+OVERLOAD_POLICIES = ("block", "drop_oldest", "downsample", "spill_to_disk")
+
+
+class TranscriptionJob:
+    def __init__(self, audio_array, task, callback):
+        self.audio_array = audio_array  # 16 kHz mono float32, int16 once compacted, None once spilled
+        self.samples = len(audio_array)
+        self.spill_path = None
+        self.task = task  # 'transcribe' or 'translate'
+        self.callback = callback  # called with the transcribed text
+        self.submitted_at = time.time()
+        self.cache_key = None
+
+    @property
+    def duration(self):
+        return self.samples / SAMPLE_RATE
+
+    @property
+    def nbytes(self):
+        """Memory held by the queued audio."""
+        return self.audio_array.nbytes if self.audio_array is not None else 0
+
+    def compact(self):
+        """Keeps the audio as int16 while it waits, half the memory of float32."""
+        if self.audio_array is not None and self.audio_array.dtype != np.int16:
+            self.audio_array = (np.clip(self.audio_array, -1.0, 1.0) * 32767).astype(np.int16)
+
+    def spill(self, directory):
+        """Moves the audio to an int16 file in `directory` until a worker picks the job up."""
+        self.compact()
+        fd, self.spill_path = tempfile.mkstemp(suffix=".pcm", dir=directory)
+        with os.fdopen(fd, "wb") as file:
+            file.write(self.audio_array.tobytes())
+        self.audio_array = None
+
+    def load(self):
+        """Returns the audio as float32, reading it back from disk if it was spilled."""
+        if self.spill_path is not None:
+            self.audio_array = np.fromfile(self.spill_path, dtype=np.int16)
+            self.discard()
+        if self.audio_array.dtype == np.int16:
+            return self.audio_array.astype(np.float32) / 32768.0
+        return self.audio_array
+
+    def discard(self):
+        if self.spill_path is not None:
+            try:
+                os.remove(self.spill_path)
+            except OSError:
+                pass
+            self.spill_path = None
+
+
+class TranscriptionScheduler:
+    """
+    Bounded job queue in front of the shared Whisper pipeline.
+    Recorders submit finished utterances, a fixed number of workers pull them off
+    the queue in priority order and run them through the pipeline in batches.
+    The pipeline can be handed over later with set_model(); until then utterances
+    wait in the queue and `ready` is not set.
+
+    The queue is bounded by job count and by the bytes of audio it holds. What happens when it
+    is full depends on the overload policy:
+    - 'block': recorders wait for room, for at most `transcriptionQueueTimeout` seconds
+    - 'drop_oldest': the oldest queued utterance is dropped to make room
+    - 'downsample': once the queue holds half of `transcriptionQueueMaxBytes`, all queued audio is kept
+      as int16 (half the memory); when it is full anyway, the oldest utterance is dropped. Needs the byte
+      limit, against the job count alone converting audio frees nothing
+    - 'spill_to_disk': utterances that don't fit are written to `transcriptionSpillPath` and read
+      back when a worker gets to them; the oldest is dropped once the spill directory is full
+    Only 'block' ever makes a recorder (and with it the voice packet thread) wait, and only once the
+    model is ready: while it is still loading, utterances that don't fit are spilled to disk instead.
+    """
+
+    def __init__(self, model_pipeline, settings, cache=None):
+        self.model_pipeline = None
+        self.cache = cache  # Optional TranscriptionCache
+        self.num_workers = max(1, settings.get("transcriptionWorkers", 1))
+        self.batch_size = max(1, settings.get("transcriptionBatchSize", 4))
+        self.max_queue_size = max(1, settings.get("transcriptionQueueSize", 64))
+        self.max_queue_bytes = settings.get("transcriptionQueueMaxBytes")
+        self.queue_timeout = settings.get("transcriptionQueueTimeout")
+        self.overload_policy = settings.get("transcriptionOverloadPolicy", "block")
+        if self.overload_policy not in OVERLOAD_POLICIES:
+            raise ValueError(f"Unknown transcription overload policy: {self.overload_policy}")
+        if self.overload_policy == "downsample" and self.max_queue_bytes is None:
+            raise ValueError("The 'downsample' overload policy needs transcriptionQueueMaxBytes")
+        self.spill_path = settings.get("transcriptionSpillPath") or tempfile.gettempdir()
+        self.max_spill_bytes = settings.get("transcriptionSpillMaxBytes", 1024 ** 3)
+        self.priority = settings.get("transcriptionPriority", "oldest")
+        if self.priority not in ("oldest", "shortest"):
+            raise ValueError(f"Unknown transcription priority: {self.priority}")
+
+        self._queue = []
+        self._queued_bytes = 0  # audio held in memory by queued jobs
+        self._memory_jobs = 0  # queued jobs that are not spilled to disk
+        self._spilled_bytes = 0
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._workers = []
+        self._running = False
+        self._batch_listeners = []
+        self.ready = threading.Event()
+        self._queued_log = LogSampler(logger, settings.get("logSampleSeconds", 10))
+        self._drop_log = LogSampler(logger, settings.get("logSampleSeconds", 10))
+        ASR_QUEUE_DEPTH.set_function(self.queue_depth)
+        ASR_QUEUE_BYTES.set_function(lambda: self._queued_bytes)
+
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.batches = 0
+
+        if model_pipeline is not None:
+            self.set_model(model_pipeline)
+
+    def set_model(self, model_pipeline):
+        """Hands the loaded pipeline to the workers, utterances queued so far are transcribed now."""
+        with self._condition:
+            self.model_pipeline = model_pipeline
+            # A pipeline that runs several model copies (e.g. ProcessInferenceBackend) needs a worker per copy
+            self.num_workers = max(self.num_workers, getattr(model_pipeline, "concurrency", 1))
+            running = self._running
+            waiting = len(self._queue)
+            self.ready.set()
+            self._condition.notify_all()
+        if running:
+            self._start_workers()
+        logger.info("Transcription model ready, %d utterance(s) waiting", waiting)
+
+    def add_batch_listener(self, listener):
+        """Registers a function that is called with the jobs of every transcribed batch."""
+        self._batch_listeners.append(listener)
+
+    def start(self):
+        """Starts the worker threads."""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._start_workers()
+        logger.info(
+            "Transcription scheduler started with %d worker(s), batch size %d, priority '%s'",
+            self.num_workers, self.batch_size, self.priority,
+        )
+
+    def _start_workers(self):
+        for i in range(len(self._workers), self.num_workers):
+            worker = threading.Thread(
+                target=self._worker_loop, name=f"transcription-worker-{i}", daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self):
+        """
+        Stops the workers once they finished their current batch. Utterances still queued are not
+        transcribed, they get an empty transcription so their recorders don't wait for them.
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        with self._condition:
+            discarded = [job for _, _, job in self._queue]
+            self._queue = []
+            for job in discarded:
+                self._account(job, -1)
+                # Spilled audio would otherwise outlive the process
+                job.discard()
+        for job in discarded:
+            self._answer(job, "")
+
+    def submit(self, audio_array, task, callback):
+        """
+        Queues an utterance for transcription. With the 'block' policy this waits while the queue
+        is full, for at most `transcriptionQueueTimeout` seconds (forever if unset), and returns
+        False if the job was dropped because the queue stayed full. Nothing waits before the model
+        is ready, the queue could only drain once loading is done. The other policies never wait;
+        utterances they drop to make room get an empty transcription.
+        """
+        job = TranscriptionJob(audio_array, task, callback)
+        if self.cache is not None:
+            job.cache_key = self.cache.key(audio_array, task)
+            cached = self.cache.get(job.cache_key)
+            if cached is not None:
+                # Seen this audio before, skip the model entirely
+                ASR_CACHE_HITS.inc()
+                callback(cached)
+                return True
+
+        dropped = []
+        with self._condition:
+            if self.overload_policy == "block" and self.ready.is_set():
+                has_room = self._condition.wait_for(lambda: not self._is_full(job), timeout=self.queue_timeout)
+                if not has_room:
+                    self.dropped += 1
+                    ASR_DROPPED.inc()
+                    logger.warning("Transcription queue full (%d jobs), dropping utterance", len(self._queue))
+                    return False
+            elif self.overload_policy == "block":
+                # Still loading: keep the audio of every speaker on disk rather than stall the voice threads
+                dropped = self._make_room(job, "spill_to_disk")
+            else:
+                dropped = self._make_room(job, self.overload_policy)
+            self._push(job)
+            self.submitted += 1
+            self._condition.notify_all()
+            self._queued_log.log(
+                logging.DEBUG, "Queued %.1fs utterance for transcription (queue depth: %d)", job.duration, len(self._queue)
+            )
+
+        for old_job in dropped:
+            self._answer(old_job, "")
+        return True
+
+    def _is_full(self, job, fraction=1.0):
+        """Whether `job` would push the in-memory part of the queue over its limits. Caller holds the condition."""
+        if not self._memory_jobs:
+            return False  # A single utterance always fits
+        if self._memory_jobs >= self.max_queue_size * fraction:
+            return True
+        return self.max_queue_bytes is not None and self._queued_bytes + job.nbytes > self.max_queue_bytes * fraction
+
+    def _make_room(self, job, policy):
+        """Applies an overload policy so `job` can be queued right away. Returns the jobs dropped for it."""
+        if policy == "downsample" and self._is_full(job, fraction=0.5):
+            self._compact_queued()
+            job.compact()
+        if not self._is_full(job):
+            return []
+
+        dropped = []
+        if policy == "spill_to_disk" and job.samples * 2 <= self.max_spill_bytes:
+            while self._spilled_bytes + job.samples * 2 > self.max_spill_bytes:
+                dropped.append(self._drop_oldest(spilled=True))
+            try:
+                job.spill(self.spill_path)
+                return dropped
+            except OSError as e:
+                logger.error("Could not spill utterance to %s: %s", self.spill_path, e)
+
+        while self._is_full(job):
+            dropped.append(self._drop_oldest(spilled=False))
+        return dropped
+
+    def _compact_queued(self):
+        """Converts the audio of every queued in-memory job to int16. Caller holds the condition."""
+        for _, _, job in self._queue:
+            if job.spill_path is None:
+                self._queued_bytes -= job.nbytes
+                job.compact()
+                self._queued_bytes += job.nbytes
+
+    def _drop_oldest(self, spilled):
+        """Removes the oldest queued job that is (or is not) spilled to disk. Caller holds the condition."""
+        index = min(
+            (i for i, entry in enumerate(self._queue) if (entry[2].spill_path is not None) == spilled),
+            key=lambda i: self._queue[i][2].submitted_at,
+        )
+        job = self._queue[index][2]
+        self._queue[index] = self._queue[-1]
+        self._queue.pop()
+        heapq.heapify(self._queue)
+        self._account(job, -1)
+        job.discard()
+        self.dropped += 1
+        ASR_DROPPED.inc()
+        self._drop_log.log(
+            logging.WARNING, "Transcription queue over its limit, dropped the oldest %.1fs utterance", job.duration
+        )
+        return job
+
+    def _push(self, job):
+        heapq.heappush(self._queue, (self._priority_key(job), next(self._counter), job))
+        self._account(job, 1)
+        if job.spill_path is not None:
+            self.spilled += 1
+            ASR_SPILLED.inc()
+
+    def _account(self, job, sign):
+        if job.spill_path is not None:
+            self._spilled_bytes += sign * job.samples * 2
+        else:
+            self._memory_jobs += sign
+            self._queued_bytes += sign * job.nbytes
+
+    def queue_depth(self):
+        """Returns the number of utterances waiting for a worker."""
+        with self._condition:
+            return len(self._queue)
+
+    def stats(self):
+        with self._condition:
+            return {
+                "queue_depth": len(self._queue),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "dropped": self.dropped,
+                "spilled": self.spilled,
+                "queued_bytes": self._queued_bytes,
+                "spilled_bytes": self._spilled_bytes,
+                "batches": self.batches,
+                "ready": self.ready.is_set(),
+                "cache": self.cache.stats() if self.cache is not None else None,
+            }
+
+    def _priority_key(self, job):
+        if self.priority == "shortest":
+            return job.samples
+        return job.submitted_at
+
+    def _next_batch(self):
+        """Waits for work and pops up to `batch_size` jobs that share the same task."""
+        with self._condition:
+            # Nothing is taken off the queue before the model is loaded
+            self._condition.wait_for(lambda: (self._queue and self.ready.is_set()) or not self._running)
+            if not self._queue or not self.ready.is_set():
+                return []
+
+            batch = [heapq.heappop(self._queue)[2]]
+            skipped = []
+            while self._queue and len(batch) < self.batch_size:
+                entry = heapq.heappop(self._queue)
+                if entry[2].task == batch[0].task:
+                    batch.append(entry[2])
+                else:
+                    skipped.append(entry)
+            for entry in skipped:
+                heapq.heappush(self._queue, entry)
+            for job in batch:
+                self._account(job, -1)
+
+            # Wake up recorders waiting for room in the queue
+            self._condition.notify_all()
+            return batch
+
+    def _worker_loop(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        start = time.perf_counter()
+        try:
+            with span("asr_batch"):
+                results = self.model_pipeline(
+                    [job.load() for job in batch],
+                    batch_size=len(batch),
+                    generate_kwargs={"task": batch[0].task},
+                    return_timestamps=False,
+                )
+        except Exception:
+            logger.exception("Transcription batch of %d utterance(s) failed", len(batch))
+            # Recorders save their utterances in order and would wait for these forever
+            for job in batch:
+                self._answer(job, "")
+            return
+        elapsed = time.perf_counter() - start
+        audio_seconds = sum(job.duration for job in batch)
+        ASR_BATCH_SECONDS.observe(elapsed)
+        ASR_AUDIO_SECONDS.inc(audio_seconds)
+        if audio_seconds:
+            ASR_REAL_TIME_FACTOR.observe(elapsed / audio_seconds)
+
+        with self._condition:
+            self.batches += 1
+            self.completed += len(batch)
+
+        for listener in self._batch_listeners:
+            try:
+                listener(batch)
+            except Exception:
+                logger.exception("Error in transcription batch listener")
+
+        for job, result in zip(batch, results):
+            if self.cache is not None and job.cache_key is not None:
+                self.cache.put(job.cache_key, result["text"])
+            self._answer(job, result["text"])
+
+    def _answer(self, job, text):
+        """Hands a job its transcription, empty if it was dropped or failed."""
+        try:
+            job.callback(text)
+        except Exception:
+            logger.exception("Error handling transcription result")
@@ -0,0 +1,75 @@
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+class EnergyVAD:
+    """
+    Frame-energy voice activity detector for 16 kHz mono float32 audio.
+    Frames louder than `threshold_db` dBFS count as speech, pauses shorter than
+    `min_silence_ms` are kept, longer ones are cut out before the audio reaches Whisper.
+    """
+
+    def __init__(self, threshold_db=-40, frame_ms=30, min_silence_ms=1000, min_speech_ms=90, padding_ms=200):
+        self.threshold_db = threshold_db
+        self.frame_size = SAMPLE_RATE * frame_ms // 1000
+        self.min_silence_frames = max(1, min_silence_ms // frame_ms)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.padding = SAMPLE_RATE * padding_ms // 1000
+        # Compare mean squares instead of taking a log of every frame
+        self._threshold_energy = 10 ** (threshold_db / 10)
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            threshold_db=settings.get("vadThreshold", -40),
+            min_silence_ms=settings.get("vadMinSilenceMs", 1000),
+            padding_ms=settings.get("vadPaddingMs", 200),
+        )
+
+    def speech_mask(self, audio_array):
+        """Returns one boolean per frame, True where the frame is louder than the threshold."""
+        usable = len(audio_array) - len(audio_array) % self.frame_size
+        frames = audio_array[:usable].reshape(-1, self.frame_size)
+        energy = np.einsum("ij,ij->i", frames, frames) / self.frame_size
+        return energy >= self._threshold_energy
+
+    def speech_regions(self, audio_array):
+        """Returns (start, end) sample ranges that contain speech, including padding."""
+        mask = self.speech_mask(audio_array)
+        if not mask.any():
+            return []
+
+        # Run boundaries of voiced frames
+        edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+
+        # Bridge short pauses, then drop clicks that are too short to be speech
+        runs = []
+        for start, end in zip(starts, ends):
+            if runs and start - runs[-1][1] < self.min_silence_frames:
+                runs[-1][1] = end
+            else:
+                runs.append([start, end])
+        runs = [run for run in runs if run[1] - run[0] >= self.min_speech_frames]
+
+        regions = []
+        for start, end in runs:
+            start = max(0, start * self.frame_size - self.padding)
+            end = min(len(audio_array), end * self.frame_size + self.padding)
+            if regions and start <= regions[-1][1]:
+                regions[-1] = (regions[-1][0], end)
+            else:
+                regions.append((start, end))
+        return regions
+
+    def trim(self, audio_array):
+        """Returns the audio with leading, trailing and long inner silences removed (empty if silent)."""
+        regions = self.speech_regions(audio_array)
+        if not regions:
+            return audio_array[:0]
+        if len(regions) == 1:
+            start, end = regions[0]
+            return audio_array[start:end]
+        return np.concatenate([audio_array[start:end] for start, end in regions])
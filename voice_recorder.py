@@ -1,100 +1,239 @@
-import io
-import os
-from threading import Timer
+import threading
 import time
-from pydub import AudioSegment
-from pydub.silence import detect_nonsilent
-import numpy as np
 from datetime import datetime
+from discord import opus
+from audio_archiver import ArchivedAudio
+from audio_buffer import FRAME_BYTES, INPUT_SAMPLE_RATE, OUTPUT_SAMPLE_RATE, PcmRingBuffer
+from metrics import BUFFER_BYTES, PACKETS, VAD_DROPPED_WINDOWS, VAD_INPUT_SECONDS, VAD_KEPT_SECONDS, span
+from vad import EnergyVAD
+
+
+def remove_overlap(previous_text, text, max_words=30):
+    """
+    Removes the words at the start of `text` that repeat the end of `previous_text`.
+    Used to stitch transcriptions of overlapping audio windows together.
+    """
+    def normalize(word):
+        return word.strip(".,!?;:\"'").lower()
+
+    previous_words = [normalize(w) for w in previous_text.split()[-max_words:]]
+    words = text.split()
+    normalized = [normalize(w) for w in words[:max_words]]
+    for size in range(min(len(previous_words), len(normalized)), 0, -1):
+        if previous_words[-size:] == normalized[:size]:
+            return " ".join(words[size:])
+    return text
 
 
 class VoiceRecorder:
-    def __init__(self, user, meeting_id, model_pipeline, settings, db_handler):
+    def __init__(self, user, meeting_id, transcriber, settings, db_handler, archiver=None, budget=None, pending=None):
         self.user = user
         self.meeting_id = meeting_id
-        self.buffer = io.BytesIO()
-        self.last_spoken_time = time.time()
-        self.silence_timer = None
-        self.recording = AudioSegment.empty()
-        self.model_pipeline = model_pipeline  # Hugging Face pipeline
         self.settings = settings  # Load settings from NoteBot
-        self.db_handler = db_handler  # MongoDB handler instance
-
-    def add_packet(self, data):
-        # Add the received packet data to the buffer
-        self.buffer.write(data)
+        self.buffer = PcmRingBuffer(self.settings.get("maxUtteranceSeconds", 30))
+        self.lock = threading.Lock()  # Packets and the silence scheduler touch the buffer from different threads
         self.last_spoken_time = time.time()
+        self.transcriber = transcriber  # Shared TranscriptionScheduler
+        self.db_handler = db_handler  # AsyncMongoDBHandler instance
+        self.archiver = archiver  # Shared AudioArchiver, None unless saveAudio is enabled
+        self.budget = budget  # Shared BufferBudget, caps the audio buffered by all recorders together
+        self.pending = pending  # Shared PendingTranscriptions, lets the meeting summary wait for the last utterances
+        self.passthrough = archiver is not None and archiver.passthrough
+        self.decoder = None  # Opus decoder, only used when the sink hands over undecoded packets
+        # Passthrough archive: (path, offset) of the first buffered frame, None if the buffer isn't fully archived
+        self.archive_position = None
+        # Wall-clock time the first buffered frame was captured, so utterances are ordered by when they were spoken
+        self.buffer_start_time = None
+        self.vad = EnergyVAD.from_settings(self.settings)
+        # Per-speaker metrics, looked up once instead of on every packet
+        self.packet_counter = PACKETS.labels(speaker=user.id)
+        self.buffer_gauge = BUFFER_BYTES.labels(speaker=user.id)
+
+        # Streaming mode transcribes overlapping windows while the user is still talking
+        self.streaming = self.settings.get("streamingTranscription", False)
+        window_seconds = min(
+            self.settings.get("streamingWindowSeconds", 20), self.buffer.capacity / INPUT_SAMPLE_RATE
+        )
+        overlap_seconds = min(self.settings.get("streamingOverlapSeconds", 2), window_seconds / 2)
+        self.window_frames = int(window_seconds * INPUT_SAMPLE_RATE)
+        self.overlap_frames = int(overlap_seconds * INPUT_SAMPLE_RATE)
+        self.in_utterance = False  # True while the buffer continues an already transcribed window
+
+        # Windows are numbered so results can be stitched in order even if workers finish out of order
+        self.result_lock = threading.Lock()
+        self.next_sequence = 0
+        self.next_result = 0
+        self.pending_results = {}
+        self.previous_window_text = ""
+
+    def add_opus_packet(self, packet):
+        """Decodes a packet from a passthrough sink for transcription, the packet itself is archived as is."""
+        if self.decoder is None:
+            self.decoder = opus.Decoder()
+        self.add_packet(self.decoder.decode(packet, fec=False), packet)
+
+    def add_packet(self, data, packet=None):
+        received = time.time()
+        frames = len(data) // FRAME_BYTES
+        # Flush early if the utterance would not fit into the buffer anymore
+        if frames > self.buffer.free_frames():
+            self.save_recording()
 
-        # Reset the silence detection timer
-        if self.silence_timer:
-            self.silence_timer.cancel()
-
-        self.silence_timer = Timer(5.0, self.save_recording)
-        self.silence_timer.start()
+        # Add the received packet data to the buffer
+        window = None
+        with self.lock:
+            if not len(self.buffer):
+                # The packet arrives once it is complete, its audio started a packet length earlier
+                self.buffer_start_time = received - frames / INPUT_SAMPLE_RATE
+            if self.passthrough and packet is not None:
+                position = self.archiver.archive_packet(self.meeting_id, self.user, packet)
+                if not len(self.buffer) or position is None:
+                    self.archive_position = position
+            self.buffer.write(data)
+            if self.streaming and len(self.buffer) >= self.window_frames:
+                # Cut a window but keep the overlap in the buffer for the next one
+                window = self._take_window(self.window_frames, self.window_frames - self.overlap_frames, final=False)
+            buffered = self.buffer.nbytes
+        self.buffer_gauge.set(buffered)
+        self.packet_counter.inc()
+        # The cog's SilenceScheduler flushes the buffer once this is old enough
+        self.last_spoken_time = received
+
+        if window is not None:
+            self.transcribe_recording(*window)
+        if self.budget is not None:
+            over_budget = self.budget.update(self, buffered)
+            if over_budget is not None:
+                # All buffers together are too big, transcribe the longest one now
+                over_budget.save_recording()
 
     def save_recording(self):
-        if self.buffer.getvalue():
-            self.buffer.seek(0)
-            audio_segment = AudioSegment.from_raw(
-                self.buffer, sample_width=2, frame_rate=48000, channels=2
-            )
-
-            # Detect nonsilent parts to avoid transcribing empty audio
-            nonsilent_ranges = detect_nonsilent(
-                audio_segment, min_silence_len=1000, silence_thresh=-40
-            )
-
-            if nonsilent_ranges:
-                # Transcribe the audio and save results in the database
-                transcription = self.transcribe_recording(audio_segment)
-                if transcription:
-                    audio_path = None
-                    if self.settings.get("saveAudio"):
-                        audio_path = self.save_audio_file(audio_segment)
-
-                    # Save transcription to the database
-                    self.save_transcription_to_db(transcription, audio_path)
-
-        # Reset buffer and audio data
-        self.buffer = io.BytesIO()
-        self.recording = AudioSegment.empty()
-
-    def transcribe_recording(self, audio_segment):
-        # Convert the audio to mono and resample to 16 kHz
-        audio_segment = audio_segment.set_channels(1).set_frame_rate(16000)
-        samples = np.array(audio_segment.get_array_of_samples())
-        audio_array = samples.astype(np.float32) / 32768.0
-
-        # Use Hugging Face pipeline to transcribe
-        transcription = self.model_pipeline(
+        with self.lock:
+            if not len(self.buffer):
+                return
+            window = self._take_window(len(self.buffer), len(self.buffer), final=True)
+            # Reset buffer
+            self.buffer.clear()
+            self.buffer_gauge.set(0)
+        if self.budget is not None:
+            self.budget.update(self, 0)
+
+        self.transcribe_recording(*window)
+
+    def release(self):
+        """Transcribes what is still buffered and stops counting this recorder, e.g. when the speaker left."""
+        self.save_recording()
+        if self.budget is not None:
+            self.budget.remove(self)
+        # Per-speaker series would otherwise pile up for every user ever heard; a returning speaker's
+        # counter starts again at 0, which Prometheus treats as a counter reset
+        BUFFER_BYTES.remove(speaker=self.user.id)
+        PACKETS.remove(speaker=self.user.id)
+
+    def _take_window(self, frames, advance, final):
+        """Reads `frames` frames and drops the first `advance` of them. Caller must hold self.lock."""
+        audio_array = self.buffer.to_whisper(frames)
+        raw_audio = self.buffer.raw_bytes(advance) if self.archiver is not None and not self.passthrough else None
+        archived = None
+        if self.archive_position is not None:
+            # The packets are already in the archive, just point at them
+            path, offset = self.archive_position
+            archived = ArchivedAudio(path, offset, advance / INPUT_SAMPLE_RATE)
+            self.archive_position = (path, offset + advance / INPUT_SAMPLE_RATE)
+        self.buffer.consume(advance)
+
+        # When the window was spoken. Pauses between packets are not in the buffer, so a whole
+        # utterance ends with its last packet; a streaming window ends where its audio ends.
+        start = self.buffer_start_time
+        end = self.last_spoken_time if final else start + frames / INPUT_SAMPLE_RATE
+        self.buffer_start_time = start + advance / INPUT_SAMPLE_RATE
+        spoken = (start, max(start, end))
+
+        sequence = self.next_sequence
+        self.next_sequence += 1
+        overlaps_previous = self.in_utterance
+        self.in_utterance = not final
+        # Counted under the buffer lock, so audio that left the buffer is always counted
+        meeting_id = self.meeting_id
+        if self.pending is not None:
+            self.pending.add(meeting_id)
+        return sequence, audio_array, raw_audio, archived, spoken, overlaps_previous, final, meeting_id
+
+    def transcribe_recording(
+        self, sequence, audio_array, raw_audio, archived, spoken, overlaps_previous, final, meeting_id=None
+    ):
+        def on_transcribed(transcription):
+            try:
+                self._on_window_transcribed(sequence, transcription, archived, spoken, overlaps_previous, final)
+            finally:
+                # Saving waits for earlier windows, which are still counted until their own result arrives
+                if self.pending is not None:
+                    self.pending.done(meeting_id)
+
+        # Cut out silence so Whisper only decodes speech, and skip windows without any
+        VAD_INPUT_SECONDS.inc(len(audio_array) / OUTPUT_SAMPLE_RATE)
+        with span("vad"):
+            audio_array = self.vad.trim(audio_array)
+        if not len(audio_array):
+            VAD_DROPPED_WINDOWS.inc()
+            on_transcribed("")
+            return False
+        VAD_KEPT_SECONDS.inc(len(audio_array) / OUTPUT_SAMPLE_RATE)
+
+        if raw_audio is not None:
+            # Queued for the background archiver, the transcription does not wait for it
+            archived = self.archiver.archive(self.meeting_id, self.user, raw_audio)
+
+        # Hand the 16 kHz mono audio to the shared transcription scheduler
+        submitted = self.transcriber.submit(
             audio_array,
-            generate_kwargs={"task": 'transcribe' if self.settings.get("useOriginalLanguage") == True else "translate"},
-            return_timestamps=False,
+            'transcribe' if self.settings.get("useOriginalLanguage") == True else "translate",
+            on_transcribed,
         )
-        return transcription["text"]
-
-    def save_audio_file(self, audio_segment):
-        audio_path = self.settings.get("audioPath")
-        filename = f"{self.user.name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.mp3"
-        filepath = os.path.join(audio_path, filename)
-        audio_segment.export(filepath, format="mp3")
-        return filepath
+        if not submitted:
+            # Keep the window order intact for the windows after the dropped one
+            on_transcribed("")
+        return submitted
+
+    def _on_window_transcribed(self, sequence, transcription, archived, spoken, overlaps_previous, final):
+        with self.result_lock:
+            self.pending_results[sequence] = (transcription or "", archived, spoken, overlaps_previous, final)
+
+            # Save every window whose predecessors are done, in the order they were spoken
+            while self.next_result in self.pending_results:
+                transcription, archived, spoken, overlaps_previous, final = self.pending_results.pop(self.next_result)
+                self.next_result += 1
+
+                text = transcription
+                if overlaps_previous:
+                    text = remove_overlap(self.previous_window_text, transcription)
+                self.previous_window_text = "" if final else transcription
+
+                if text.strip():
+                    # Save transcription to the database
+                    self.save_transcription_to_db(text, archived, spoken, partial=not final)
 
-    def save_transcription_to_db(self, transcription, audio_path):
+    def save_transcription_to_db(self, transcription, archived=None, spoken=None, partial=False):
         # Prepare the data to save in the database
         timestamp = datetime.now()
         entry = {
             "user": self.user.name,
-            "timestamp": timestamp,
+            "user_id": self.user.id,
+            "timestamp": timestamp,  # when the transcription was saved
             "transcription": transcription,
+            "transcription_model": self.settings.get("model_id"),
         }
-        if audio_path:
-            entry["audio_path"] = audio_path
-
-        # Append the transcription to the 'transcriptions' array
-        self.db_handler.update_entry(
-            "meetings",
-            {"meeting_id": self.meeting_id},
-            {"$push": {"transcriptions": entry}} 
-        )
-
+        if spoken is not None:
+            # When the utterance was spoken, the transcript is ordered by this
+            entry["start_time"] = datetime.fromtimestamp(spoken[0])
+            entry["end_time"] = datetime.fromtimestamp(spoken[1])
+        if archived is not None:
+            # The utterance is a section of the speaker's archive file
+            entry["audio_path"] = archived.path
+            entry["audio_offset"] = round(archived.offset, 3)
+            entry["audio_duration"] = round(archived.duration, 3)
+        if self.streaming:
+            entry["partial"] = partial
+
+        # Buffer the transcription, it is inserted into the 'transcriptions' collection with the next bulk write
+        self.db_handler.queue_transcription(self.meeting_id, entry)